@@ -0,0 +1,41 @@
+"""文件下载交给 nginx：Django 只做权限检查，然后以 X-Accel-Redirect 指向 nginx 的 internal location，
+由 nginx 发送文件内容（含 Range / If-Range），gunicorn worker 不再被慢速下载占住。
+
+LL_ACCEL_REDIRECT 为 False（默认，如本地开发或没有 nginx 的部署）或文件不在本地磁盘（如 Cloudinary）时，
+调用方退回 Python 流式发送（ranges.file_response）。nginx 配置见 deploy/nginx/diary.conf。
+"""
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.http import HttpResponse
+
+ACCEL_REDIRECT = getattr(settings, 'LL_ACCEL_REDIRECT', False)
+# 与 nginx 中 internal location 对应的前缀：分别映射 MEDIA_ROOT 与 zip 缓存目录
+ACCEL_MEDIA_PREFIX = getattr(settings, 'LL_ACCEL_MEDIA_PREFIX', '/_protected/media/')
+ACCEL_ZIPCACHE_PREFIX = getattr(settings, 'LL_ACCEL_ZIPCACHE_PREFIX', '/_protected/zipcache/')
+
+
+def storage_uri(storage, name):
+    """本地存储中的文件名 -> internal URI；未启用或不在本地磁盘时返回 None。"""
+    if not ACCEL_REDIRECT or not name or not isinstance(storage, FileSystemStorage):
+        return None
+    return ACCEL_MEDIA_PREFIX + quote(name.replace('\\', '/').lstrip('/'))
+
+
+def media_uri(fieldfile):
+    return storage_uri(fieldfile.storage, fieldfile.name) if fieldfile else None
+
+
+def zipcache_uri(path):
+    """zip 缓存中的归档（文件名即内容摘要）-> internal URI；未启用时返回 None。"""
+    if not ACCEL_REDIRECT:
+        return None
+    return ACCEL_ZIPCACHE_PREFIX + quote(str(path).replace('\\', '/').rsplit('/', 1)[-1])
+
+
+def redirect(uri, content_type='application/octet-stream'):
+    """nginx 保留这里的 Content-Type 与 Content-Disposition，其余由它按文件生成。"""
+    response = HttpResponse(content_type=content_type)
+    response['X-Accel-Redirect'] = uri
+    return response
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class LearningLogsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'learning_logs'
+
+    def ready(self):
+        # 注册冗余计数的信号处理
+        from . import counters  # noqa: F401
@@ -0,0 +1,175 @@
+"""把 tar（可 gzip / bz2 / xz 压缩）或 zip 归档展开为附件，相对路径取自归档内的路径。
+
+- tar 以流模式读取，逐个成员边读边处理，不需要先把整个归档落盘；
+  zip 的目录在文件末尾，请求体中的 zip 先写入临时文件（同样受大小上限约束）再读取。
+- 每个成员交给 uploads.SpooledUploadHandler 接收：小文件留在内存预算内，其余写临时文件，
+  同时算出 SHA-256 与 MIME 类型，之后与普通上传一样由 _save_attachments_from_request 入库。
+- 成员按 ARCHIVE_BATCH_FILES 个一批交给调用方，批与批之间释放内存与临时文件句柄。
+- 目录、链接、设备文件与不安全的路径（绝对路径、含 ..）被跳过并记入 skipped；
+  文件数、单个成员与解压后总字节数超过上限时抛 ArchiveError。
+"""
+import posixpath
+import stat
+import tarfile
+import tempfile
+import zipfile
+import zlib
+
+from django.conf import settings
+
+from .uploads import UPLOAD_CHUNK_SIZE, SpooledUploadHandler
+
+# 解压后的总字节数 / 单个成员字节数上限
+ARCHIVE_MAX_BYTES = getattr(settings, 'LL_ARCHIVE_MAX_BYTES', 1024 ** 3)
+ARCHIVE_MAX_MEMBER_BYTES = getattr(settings, 'LL_ARCHIVE_MAX_MEMBER_BYTES', 256 * 1024 * 1024)
+# 每批交给调用方入库的文件数
+ARCHIVE_BATCH_FILES = getattr(settings, 'LL_ARCHIVE_BATCH_FILES', 200)
+# relative_path 字段长度
+MAX_PATH_LENGTH = 500
+
+_ZIP_MAGIC = b'PK\x03\x04'
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+def safe_member_path(name, prefix=''):
+    """归档内路径 -> 附件 relative_path；绝对路径、含 .. 或过长时返回 None。"""
+    name = (name or '').replace('\\', '/')
+    if name.startswith('/') or (len(name) > 1 and name[1] == ':'):
+        return None
+    parts = [seg for seg in name.split('/') if seg not in ('', '.')]
+    if not parts or '..' in parts or parts[0] == '__MACOSX':
+        return None
+    path = '/'.join([prefix, *parts]) if prefix else '/'.join(parts)
+    return path if len(path) <= MAX_PATH_LENGTH else None
+
+
+class _Prefixed:
+    """把已读出的文件头放回流前面，供 tarfile 流模式读取。"""
+
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+
+    def read(self, n=-1):
+        if self.head:
+            if n is None or n < 0:
+                data, self.head = self.head + self.stream.read(), b''
+                return data
+            data, self.head = self.head[:n], self.head[n:]
+            if len(data) < n:
+                data += self.stream.read(n - len(data))
+            return data
+        return self.stream.read(n)
+
+
+def _tar_members(stream, skipped):
+    try:
+        with tarfile.open(fileobj=stream, mode='r|*') as tf:
+            for info in tf:
+                if info.isdir():
+                    continue
+                if not info.isfile():
+                    skipped.append({'name': info.name, 'reason': 'not a regular file'})
+                    continue
+                yield info.name, tf.extractfile(info), info.size
+    except (tarfile.TarError, EOFError, zlib.error) as e:
+        raise ArchiveError(f'invalid archive: {e}')
+
+
+def _zip_members(fileobj, skipped):
+    try:
+        with zipfile.ZipFile(fileobj) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                if stat.S_ISLNK(info.external_attr >> 16):
+                    skipped.append({'name': info.filename, 'reason': 'not a regular file'})
+                    continue
+                with zf.open(info) as src:
+                    yield info.filename, src, info.file_size
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, NotImplementedError, RuntimeError) as e:
+        raise ArchiveError(f'invalid archive: {e}')
+
+
+def _members(fileobj, skipped):
+    head = fileobj.read(len(_ZIP_MAGIC))
+    if head != _ZIP_MAGIC:
+        yield from _tar_members(_Prefixed(head, fileobj), skipped)
+        return
+    seekable = getattr(fileobj, 'seekable', lambda: False)()
+    if seekable:
+        fileobj.seek(0)
+        yield from _zip_members(fileobj, skipped)
+        return
+    # 请求体中的 zip：先写入临时文件
+    with tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR) as spool:
+        spool.write(head)
+        copied = len(head)
+        while True:
+            chunk = fileobj.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            copied += len(chunk)
+            if copied > ARCHIVE_MAX_BYTES:
+                raise ArchiveError('archive too large')
+            spool.write(chunk)
+        spool.seek(0)
+        yield from _zip_members(spool, skipped)
+
+
+def _spool(handler, src, path, total):
+    """把一个成员读入上传处理器，返回 (UploadedFile, 新的总字节数)。"""
+    handler.new_file('files', posixpath.basename(path), None, None)
+    size = 0
+    try:
+        while True:
+            chunk = src.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > ARCHIVE_MAX_MEMBER_BYTES:
+                raise ArchiveError(f'file too large: {path}')
+            if total + size > ARCHIVE_MAX_BYTES:
+                raise ArchiveError('archive too large')
+            handler.receive_data_chunk(chunk, size - len(chunk))
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError, OSError, zlib.error) as e:
+        handler.upload_interrupted()
+        raise ArchiveError(f'invalid archive: {e}')
+    except ArchiveError:
+        handler.upload_interrupted()
+        raise
+    return handler.file_complete(size), total + size
+
+
+def iter_batches(fileobj, *, max_files, prefix='', request=None, skipped=None, batch_size=None):
+    """逐批产出 [(relative_path, UploadedFile), ...]；调用方处理完一批后应关闭其中的文件。"""
+    skipped = [] if skipped is None else skipped
+    batch_size = batch_size or ARCHIVE_BATCH_FILES
+    prefix = (safe_member_path(prefix) or '') if prefix else ''
+    handler = SpooledUploadHandler(request)
+    batch = []
+    count = 0
+    total = 0
+    for name, src, declared in _members(fileobj, skipped):
+        path = safe_member_path(name, prefix)
+        if path is None:
+            skipped.append({'name': name, 'reason': 'unsafe path'})
+            continue
+        if declared is not None and declared > ARCHIVE_MAX_MEMBER_BYTES:
+            raise ArchiveError(f'file too large: {path}')
+        count += 1
+        if count > max_files:
+            raise ArchiveError(f'Too many files in archive (max {max_files}).')
+        f, total = _spool(handler, src, path, total)
+        batch.append((path, f))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+            # 每批使用新的处理器，请求内的内存预算随上一批文件关闭而归还
+            handler = SpooledUploadHandler(request)
+    if batch:
+        yield batch
+
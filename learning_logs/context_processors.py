@@ -1,8 +1,11 @@
 import random
+from functools import lru_cache
 
 from django.templatetags.static import static
 from django.conf import settings
 from django.contrib.staticfiles import finders
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 
 COMMON_BACKGROUNDS = [
     'img/backgrounds/bg1.jpg',
@@ -25,12 +28,33 @@ import os
 CUSTOM_BG_IMAGE = os.getenv('BACKGROUND_IMAGE', '').strip()
 
 
+# 下面的静态文件查找与 URL 解析结果在进程内缓存：finders.find 每次都会遍历
+# STATICFILES_DIRS 与各 app 的 static 目录，而这些处理器在每次模板渲染时都会执行。
+# 部署 collectstatic（manifest 变化）后进程会重启，缓存随之重建；测试中修改静态文件相关
+# 设置时由 _clear_static_caches 清空。
+@lru_cache(maxsize=None)
+def _static_exists(path: str) -> bool:
+    try:
+        return bool(finders.find(path))
+    except Exception:
+        return False
+
+
+@lru_cache(maxsize=None)
 def _resolve_path(path: str) -> str:
     if path.startswith(('http://', 'https://')):
         return path
     return static(path)
 
 
+@receiver(setting_changed)
+def _clear_static_caches(setting, **kwargs):
+    if setting.startswith('STATIC') or setting in ('STORAGES', 'INSTALLED_APPS'):
+        _static_exists.cache_clear()
+        _resolve_path.cache_clear()
+        _video_path.cache_clear()
+
+
 def _choose(path_list: list[str]) -> str:
     if not path_list:
         return static('img/backgrounds/bg1.jpg')
@@ -48,11 +72,7 @@ def background_image(request):
             return {'background_image_url': url}
         else:
             # 对静态路径进行存在性检查，避免 Manifest 模式下找不到文件导致模板渲染报错
-            try:
-                found = finders.find(CUSTOM_BG_IMAGE)
-            except Exception:
-                found = None
-            if found:
+            if _static_exists(CUSTOM_BG_IMAGE):
                 return {'background_image_url': _resolve_path(CUSTOM_BG_IMAGE)}
             # 否则继续走默认选择逻辑
     if path.startswith('/accounts/login') or path.startswith('/accounts/register'):
@@ -73,41 +93,42 @@ def background_video(request):
     Otherwise treat it as a static-relative path.
     Default is empty string to avoid 100MB+ assets in repo; template will simply not preload if empty.
     """
-    path = getattr(settings, 'BACKGROUND_VIDEO', '') or ''
+    return {
+        'BACKGROUND_VIDEO': _video_path(getattr(settings, 'BACKGROUND_VIDEO', '') or ''),
+        'BACKGROUND_VIDEO_PRELOAD': getattr(settings, 'BACKGROUND_VIDEO_PRELOAD', 'metadata'),
+    }
 
+
+@lru_cache(maxsize=None)
+def _video_path(path: str) -> str:
+    """Resolve the configured BACKGROUND_VIDEO once per process (see _static_exists)."""
     # Fallback: if not explicitly configured, try common default locations
     # like static/video/bg.mp4 to preserve behavior after env resets.
     if not path:
         for candidate in ('video/bg.mp4', 'video/bg.webm'):
-            try:
-                if finders.find(candidate):
-                    path = candidate
-                    break
-            except Exception:
-                # Ignore lookup errors and continue
-                pass
+            if _static_exists(candidate):
+                return candidate
+        return ''
 
     # Absolute URLs pass through directly
     if path.startswith(('http://', 'https://')):
-        return {
-            'BACKGROUND_VIDEO': path,
-            'BACKGROUND_VIDEO_PRELOAD': getattr(settings, 'BACKGROUND_VIDEO_PRELOAD', 'metadata'),
-        }
+        return path
 
     # For local static paths, suppress template errors when file isn't collected yet.
     # If the static file can't be found by Django's finders (including STATIC_ROOT/manifest),
     # return empty so templates won't call `{% static %}` and trigger a manifest error.
-    if path:
-        try:
-            found = finders.find(path)
-        except Exception:
-            found = None
-        if not found:
-            return {
-                'BACKGROUND_VIDEO': '',
-                'BACKGROUND_VIDEO_PRELOAD': getattr(settings, 'BACKGROUND_VIDEO_PRELOAD', 'metadata'),
-            }
+    return path if _static_exists(path) else ''
+
+
+def page_cache_placeholders(request):
+    """整页缓存渲染时，把每个请求都不同的值替换为占位符（命中缓存后再填回，见 pagecache）。
+
+    需排在 context_processors 列表末尾，以覆盖 background_image 与内置 csrf 的输出。
+    """
+    if not getattr(request, 'll_page_cache', False):
+        return {}
+    from .pagecache import BACKGROUND_PLACEHOLDER, CSRF_PLACEHOLDER
     return {
-        'BACKGROUND_VIDEO': path,
-        'BACKGROUND_VIDEO_PRELOAD': getattr(settings, 'BACKGROUND_VIDEO_PRELOAD', 'metadata'),
+        'background_image_url': BACKGROUND_PLACEHOLDER,
+        'csrf_token': CSRF_PLACEHOLDER,
     }
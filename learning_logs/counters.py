@@ -0,0 +1,283 @@
+"""Topic / Entry / Comment 上冗余计数的维护。
+
+- 单条创建 / 删除：由本模块的 post_save / post_delete 信号以 F() 表达式原子增减，
+  并与 Comment.save / Attachment.save / 级联删除处于同一事务。
+- 批量导入（_save_attachments_from_request 的 bulk_create）：不发送信号，由 add_created 按归属聚合计入。
+- 批量删除（删除文件夹、评论子树、日记本）：在 suspended() 中执行，先按归属对象聚合，
+  每个受影响的父对象只执行一条 UPDATE，避免逐行信号带来的 N 次更新。
+- 附件文件夹索引（AttachmentFolder）的删除维护也在这里触发，见 folders 模块。
+- Entry.render_version（日记卡片片段缓存的版本）随上述更新一并递增，
+  日记自身保存或评论 / 附件被修改时也会递增；所属 Topic.render_version（页面 ETag）同步递增。
+- 涉及公开日记本的变化同时递增公开内容版本号，使发现页整页缓存失效（pagecache.touch_public）。
+- 计数出现偏差时可运行 ``python manage.py recount`` 分批修复（见 recount_model）。
+"""
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import BigIntegerField, Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import folders
+from .models import Topic, Entry, Comment, Attachment
+from .pagecache import bump_public, touch_public, touched_topics
+
+_suspended = contextvars.ContextVar('ll_counters_suspended', default=False)
+# 维护文件夹索引所需的附件字段
+_INDEX_FIELDS = ('topic_id', 'entry_id', 'comment_id', 'folder_path', 'size', 'upload_session')
+
+
+@contextmanager
+def suspended():
+    """暂停逐行计数维护，由调用方自行一次性修正。"""
+    token = _suspended.set(True)
+    try:
+        yield
+    finally:
+        _suspended.reset(token)
+
+
+def _bump_attachment_parents(topic_id, entry_id, comment_id, count, size):
+    if topic_id:
+        Topic.objects.filter(pk=topic_id).update(
+            attachment_count=F('attachment_count') + count,
+            attachment_bytes=F('attachment_bytes') + size,
+        )
+    if entry_id:
+        Entry.objects.filter(pk=entry_id).update(
+            attachment_count=F('attachment_count') + count,
+            attachment_bytes=F('attachment_bytes') + size,
+            render_version=F('render_version') + 1,
+        )
+    if comment_id:
+        Comment.objects.filter(pk=comment_id).update(attachment_count=F('attachment_count') + count)
+        Entry.objects.filter(comment__id=comment_id).update(render_version=F('render_version') + 1)
+    touch_topics([topic_id] if topic_id else (), [entry_id] if entry_id else (),
+                 [comment_id] if comment_id else ())
+
+
+def _bump_comment_parents(entry_id, ancestor_ids, count):
+    Entry.objects.filter(pk=entry_id).update(comment_count=F('comment_count') + count,
+                                             render_version=F('render_version') + 1)
+    Topic.objects.filter(entry__id=entry_id).update(comment_count=F('comment_count') + count,
+                                                    render_version=F('render_version') + 1)
+    if ancestor_ids:
+        Comment.objects.filter(pk__in=ancestor_ids).update(reply_count=F('reply_count') + count)
+    touch_public(entry_ids=[entry_id])
+
+
+def add_attachments(qs, sign=1, fields=('topic', 'entry', 'comment')):
+    """按归属对象聚合 qs 中附件的数量与字节数，一次性计入对应计数（sign=-1 时扣除）。
+
+    fields 限定要更新哪些归属，例如把 topic 级临时附件转挂到 entry 时只需计入 entry。
+    """
+    for field in fields:
+        key = f'{field}_id'
+        rows = (qs.filter(**{f'{key}__isnull': False}).order_by()
+                .values(key).annotate(n=Count('id'), b=Coalesce(Sum('size'), 0)))
+        for row in rows:
+            ids = {'topic_id': None, 'entry_id': None, 'comment_id': None, key: row[key]}
+            _bump_attachment_parents(count=sign * row['n'], size=sign * row['b'], **ids)
+
+
+def add_created(attachments):
+    """bulk_create 不发送 post_save：按归属聚合刚插入的附件，一次性计入计数。"""
+    groups = defaultdict(lambda: [0, 0])
+    for att in attachments:
+        g = groups[(att.topic_id, att.entry_id, att.comment_id)]
+        g[0] += 1
+        g[1] += att.size or 0
+    for (topic_id, entry_id, comment_id), (n, size) in groups.items():
+        _bump_attachment_parents(topic_id, entry_id, comment_id, n, size)
+
+
+def reassigned_to_entry(qs):
+    """topic 级暂存附件以 UPDATE 转挂到日记后的计数与文件夹索引维护（UPDATE 不发送 post_save）。
+
+    转挂只计入日记，日记本的计数在上传时已计入；暂存附件此前不在文件夹索引中，此时同时计入日记本与日记。
+    """
+    add_attachments(qs, fields=('entry',))
+    folders.index_attachments(qs.only(*_INDEX_FIELDS), fields=('topic', 'entry'))
+
+
+def delete_attachments(qs):
+    """批量删除附件：先聚合扣减计数与文件夹索引，再一次性删除（文件仍由 post_delete 清理）。"""
+    with transaction.atomic(), suspended():
+        add_attachments(qs, sign=-1)
+        folders.unindex_attachments(qs.only(*_INDEX_FIELDS))
+        return qs.delete()
+
+
+def delete_comment_subtree(comment):
+    """删除评论及全部后代，日记 / 日记本 / 祖先评论的计数各只更新一次。"""
+    with transaction.atomic(), suspended():
+        subtree = comment.subtree()
+        n = subtree.count()
+        if n:
+            _bump_comment_parents(comment.entry_id, Comment.ids_in_path(comment.path)[:-1], -n)
+            attachments = Attachment.objects.filter(comment__in=subtree)
+            add_attachments(attachments, sign=-1, fields=('topic', 'entry'))
+            folders.unindex_attachments(attachments.only(*_INDEX_FIELDS), fields=('topic', 'entry'))
+        return comment.delete_subtree()
+
+
+def delete_topic(topic):
+    """删除日记本：其下的日记、评论、附件随之级联删除，计数无需逐行维护。"""
+    with transaction.atomic(), suspended():
+        return topic.delete()
+
+
+def touch_topics(topic_ids=(), entry_ids=(), comment_ids=()):
+    """递增相关日记本的 render_version（页面 ETag 失效），并同步公开内容版本号。"""
+    topics = touched_topics(topic_ids, entry_ids, comment_ids)
+    if topics is None:
+        return
+    topics.update(render_version=F('render_version') + 1)
+    touch_public(topic_ids, entry_ids, comment_ids)
+
+
+def touch_entries(entry_ids=(), comment_ids=(), topic_ids=()):
+    """递增日记的 render_version，使其卡片片段缓存失效；所属日记本一并递增。"""
+    q = Q(pk__in=list(entry_ids))
+    if comment_ids:
+        q |= Q(comment__id__in=list(comment_ids))
+    Entry.objects.filter(q).update(render_version=F('render_version') + 1)
+    touch_topics(topic_ids, entry_ids, comment_ids)
+
+
+@receiver(pre_save, sender=Entry)
+def entry_saving(sender, instance, **kwargs):
+    # 公开日记改为私密后 touch_public 已看不出它曾对访客可见，在此记下
+    instance._was_public = bool(instance.pk and not instance.is_public
+                                and Entry.objects.filter(pk=instance.pk, is_public=True).exists())
+
+
+@receiver(post_save, sender=Entry)
+def entry_saved(sender, instance, **kwargs):
+    touch_entries([instance.pk])
+    if getattr(instance, '_was_public', False):
+        bump_public()
+
+
+@receiver(post_delete, sender=Entry)
+def entry_deleted(sender, instance, **kwargs):
+    if not _suspended.get():
+        touch_topics(topic_ids=[instance.topic_id])
+        if instance.is_public:
+            bump_public()
+
+
+@receiver(post_save, sender=Topic)
+def topic_saved(sender, instance, created, **kwargs):
+    Topic.objects.filter(pk=instance.pk).update(render_version=F('render_version') + 1)
+    # 公开 / 私密切换后 instance.is_public 已是新值，无法得知之前是否公开，因此除新建私密日记本外都递增
+    if not created or instance.is_public:
+        bump_public()
+
+
+@receiver(post_delete, sender=Topic)
+def topic_deleted(sender, instance, **kwargs):
+    if instance.is_public:
+        bump_public()
+
+
+@receiver(post_save, sender=Attachment)
+def attachment_created(sender, instance, created, **kwargs):
+    if created and not _suspended.get():
+        _bump_attachment_parents(instance.topic_id, instance.entry_id, instance.comment_id,
+                                 1, instance.size or 0)
+    elif not created:
+        # 修改（如转挂、改名）不影响计数，但会改变卡片与页面内容
+        touch_entries([instance.entry_id] if instance.entry_id else (),
+                      [instance.comment_id] if instance.comment_id else (),
+                      [instance.topic_id] if instance.topic_id else ())
+
+
+@receiver(post_delete, sender=Attachment)
+def attachment_deleted(sender, instance, **kwargs):
+    if not _suspended.get():
+        _bump_attachment_parents(instance.topic_id, instance.entry_id, instance.comment_id,
+                                 -1, -(instance.size or 0))
+        folders.unindex_attachments([instance])
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created and not _suspended.get():
+        # 此时自身 path 尚未写入，祖先即父评论 path 中的全部 id
+        ancestors = Comment.ids_in_path(instance.parent.path) if instance.parent_id else []
+        _bump_comment_parents(instance.entry_id, ancestors, 1)
+    elif not created:
+        touch_entries([instance.entry_id])
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if not _suspended.get():
+        _bump_comment_parents(instance.entry_id, Comment.ids_in_path(instance.path)[:-1], -1)
+
+
+def _aggregate(model, lookup, agg):
+    """相关子查询：按 lookup 关联到外层行并聚合，无匹配时为 0。"""
+    sub = (model.objects.filter(**{lookup: OuterRef('pk')}).order_by()
+           .values(lookup).annotate(v=agg).values('v'))
+    return Coalesce(Subquery(sub), Value(0), output_field=BigIntegerField())
+
+
+def expected_counts(model):
+    """各计数字段的真实值表达式，供 recount 比较与修复。"""
+    if model is Topic:
+        return {
+            'comment_count': _aggregate(Comment, 'entry__topic', Count('id')),
+            'attachment_count': _aggregate(Attachment, 'topic', Count('id')),
+            'attachment_bytes': _aggregate(Attachment, 'topic', Sum('size')),
+        }
+    if model is Entry:
+        return {
+            'comment_count': _aggregate(Comment, 'entry', Count('id')),
+            'attachment_count': _aggregate(Attachment, 'entry', Count('id')),
+            'attachment_bytes': _aggregate(Attachment, 'entry', Sum('size')),
+        }
+    if model is Comment:
+        replies = (Comment.objects.filter(entry=OuterRef('entry'), path__startswith=OuterRef('path'))
+                   .exclude(pk=OuterRef('pk')).order_by()
+                   .values('entry').annotate(v=Count('id')).values('v'))
+        return {
+            'reply_count': Coalesce(Subquery(replies), Value(0), output_field=BigIntegerField()),
+            'attachment_count': _aggregate(Attachment, 'comment', Count('id')),
+        }
+    raise ValueError(f'no counters on {model.__name__}')
+
+
+def recount_model(model, batch_size=500):
+    """按主键分批比对并修复 model 上的计数，返回 (检查行数, 修复行数)。"""
+    exprs = expected_counts(model)
+    drifted = Q()
+    for field in exprs:
+        drifted |= ~Q(**{field: F(f'_true_{field}')})
+    checked = fixed = 0
+    last_pk = 0
+    while True:
+        ids = list(model.objects.filter(pk__gt=last_pk).order_by('pk')
+                   .values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        last_pk = ids[-1]
+        checked += len(ids)
+        stale = list(
+            model.objects.filter(pk__in=ids)
+            .annotate(**{f'_true_{f}': e for f, e in exprs.items()})
+            .filter(drifted)
+            .only('pk', *exprs)
+        )
+        for obj in stale:
+            for field in exprs:
+                setattr(obj, field, getattr(obj, f'_true_{field}'))
+        if stale:
+            with transaction.atomic():
+                model.objects.bulk_update(stale, list(exprs))
+            fixed += len(stale)
+    return checked, fixed
@@ -0,0 +1,129 @@
+"""附件文件夹索引（AttachmentFolder）的维护与查询。
+
+附件只记录 relative_path；为了让“展开文件夹”只读取直接子项，这里为每个归属对象的每个目录
+维护一行索引，包含父目录指针、直接文件 / 子目录数以及子树文件总数与字节数。
+
+- 新增：_save_attachments_from_request 保存完一批附件后调用 index_attachments。
+- 转挂：new_entry 把 upload_session 附件转给新日记后，对其调用 index_attachments。
+- 删除：单条删除由 counters 的 post_delete 信号调用 unindex_attachments；
+  批量删除在 counters.delete_attachments 等函数中按批调用。
+归属对象被删除时其索引行随外键级联删除。
+"""
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import AttachmentFolder
+
+OWNER_FIELDS = ('topic', 'entry', 'comment')
+
+
+def _prefixes(folder_path):
+    """'a/b/c' -> ['a', 'a/b', 'a/b/c']"""
+    parts = folder_path.split('/')
+    return ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+def _deltas(attachments, sign, fields):
+    """按 (归属字段, 归属 id, 目录) 汇总 [直接文件数, 子树文件数, 子树字节数] 的变化量。"""
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for att in attachments:
+        if att.upload_session or not att.folder_path:
+            continue
+        size = sign * (att.size or 0)
+        for field in fields:
+            owner_id = getattr(att, f'{field}_id')
+            if not owner_id:
+                continue
+            for path in _prefixes(att.folder_path):
+                d = deltas[(field, owner_id, path)]
+                d[1] += sign
+                d[2] += size
+            deltas[(field, owner_id, att.folder_path)][0] += sign
+    return deltas
+
+
+def _ensure_folders(keys):
+    """为缺失的目录创建索引行（父目录先于子目录），并累加父目录的直接子目录数。"""
+    by_owner = defaultdict(set)
+    for field, owner_id, path in keys:
+        by_owner[(field, owner_id)].add(path)
+    for (field, owner_id), paths in by_owner.items():
+        owner = {f'{field}_id': owner_id}
+        ids = dict(AttachmentFolder.objects.filter(**owner, path__in=paths).values_list('path', 'id'))
+        missing = sorted((p for p in paths if p not in ids), key=lambda p: p.count('/'))
+        new_children = Counter()
+        for path in missing:
+            parent_path, _, name = path.rpartition('/')
+            parent_id = ids.get(parent_path) if parent_path else None
+            try:
+                with transaction.atomic():
+                    ids[path] = AttachmentFolder.objects.create(parent_id=parent_id, path=path, name=name, **owner).id
+            except IntegrityError:
+                # 并发上传的另一个分块刚建好这一行，由它计入父目录的子目录数
+                ids[path] = AttachmentFolder.objects.get(**owner, path=path).id
+                continue
+            if parent_id:
+                new_children[parent_id] += 1
+        for parent_id, n in new_children.items():
+            AttachmentFolder.objects.filter(pk=parent_id).update(folder_count=F('folder_count') + n)
+
+
+def _prune_empty(keys):
+    """删除已无文件的目录索引行（子目录随 parent 外键级联），并扣减幸存父目录的子目录数。"""
+    by_owner = defaultdict(set)
+    for field, owner_id, path in keys:
+        by_owner[(field, owner_id)].add(path)
+    for (field, owner_id), paths in by_owner.items():
+        empty = list(AttachmentFolder.objects.filter(
+            **{f'{field}_id': owner_id}, path__in=paths, total_files__lte=0).values_list('id', 'parent_id'))
+        if not empty:
+            continue
+        empty_ids = {pk for pk, _ in empty}
+        removed_children = Counter(parent_id for _, parent_id in empty
+                                   if parent_id and parent_id not in empty_ids)
+        for parent_id, n in removed_children.items():
+            AttachmentFolder.objects.filter(pk=parent_id).update(folder_count=F('folder_count') - n)
+        AttachmentFolder.objects.filter(pk__in=empty_ids).delete()
+
+
+def _apply(attachments, sign, fields):
+    deltas = _deltas(attachments, sign, fields)
+    if not deltas:
+        return
+    with transaction.atomic():
+        if sign > 0:
+            _ensure_folders(deltas)
+        for (field, owner_id, path), (direct, total, size) in deltas.items():
+            AttachmentFolder.objects.filter(**{f'{field}_id': owner_id}, path=path).update(
+                file_count=F('file_count') + direct,
+                total_files=F('total_files') + total,
+                total_bytes=F('total_bytes') + size,
+            )
+        if sign < 0:
+            _prune_empty(deltas)
+
+
+def index_attachments(attachments, fields=OWNER_FIELDS):
+    """把一批附件计入所属对象的文件夹索引；每个受影响目录只执行一条 UPDATE。"""
+    _apply(attachments, 1, fields)
+
+
+def unindex_attachments(attachments, fields=OWNER_FIELDS):
+    """把一批（即将或已经删除的）附件移出文件夹索引，并清理变空的目录。"""
+    _apply(attachments, -1, fields)
+
+
+def list_folder(field, owner_id, folder_path=''):
+    """返回 (目录索引行或 None, 直接子目录 QuerySet)。根目录时索引行为 None。
+
+    先按 (归属, path) 唯一索引取目录，再按 parent 取子目录，代价只与直接子项数有关。
+    """
+    qs = AttachmentFolder.objects.filter(**{f'{field}_id': owner_id})
+    if not folder_path:
+        return None, qs.filter(parent__isnull=True)
+    folder = qs.filter(path=folder_path).first()
+    if folder is None:
+        return None, qs.none()
+    return folder, qs.filter(parent=folder)
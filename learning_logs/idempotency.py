@@ -0,0 +1,99 @@
+"""上传接口的幂等重试：客户端为每个分块附上 Idempotency-Key 请求头（或 idempotency_key 字段），
+首次请求的响应在 LL_IDEMPOTENCY_TTL_SECONDS 内被记住，重试时原样重放，不再重复入库。
+
+- 以 (用户, key) 的唯一约束占位，多个 worker 同时收到同一 key 时只有一个执行，
+  其余在首个请求完成前返回 409（客户端稍后重试即可得到重放的响应）；
+- 首个请求异常或返回 5xx 时删除占位，重试会重新执行；
+- 占位超过 LL_IDEMPOTENCY_PENDING_SECONDS 仍未完成（例如 worker 被杀）时，重试可以接管；
+- 同一 key 用在另一个地址上返回 422。
+"""
+import functools
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import UploadReceipt
+
+# 记住响应多久（秒）
+IDEMPOTENCY_TTL_SECONDS = getattr(settings, 'LL_IDEMPOTENCY_TTL_SECONDS', 24 * 3600)
+# 处理中的占位多久后视为失效（秒），应长于最慢的一次上传
+IDEMPOTENCY_PENDING_SECONDS = getattr(settings, 'LL_IDEMPOTENCY_PENDING_SECONDS', 15 * 60)
+PURGE_BATCH = 500
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = UploadReceipt._meta.get_field('key').max_length
+
+
+def purge_expired(limit=PURGE_BATCH):
+    """删除过期的幂等记录，返回删除条数。"""
+    ids = list(UploadReceipt.objects.filter(expires_at__lte=timezone.now()).values_list('pk', flat=True)[:limit])
+    if not ids:
+        return 0
+    return UploadReceipt.objects.filter(pk__in=ids).delete()[1].get(UploadReceipt._meta.label, 0)
+
+
+def _claim(owner, key, path):
+    """占位；返回 (receipt, None) 表示由本请求执行，(None, 已有记录) 表示重试。"""
+    now = timezone.now()
+    fields = {'path': path, 'created_at': now, 'expires_at': now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)}
+    try:
+        with transaction.atomic():
+            return UploadReceipt.objects.create(owner=owner, key=key, **fields), None
+    except IntegrityError:
+        pass
+    existing = UploadReceipt.objects.filter(owner=owner, key=key).first()
+    if existing is None:
+        # 刚被删除（首个请求失败），再占一次
+        return _claim(owner, key, path)
+    if existing.status_code is None and existing.path == path:
+        # 失效的占位：以 created_at 作条件接管，并发的重试中只有一个成功
+        stale = now - timedelta(seconds=IDEMPOTENCY_PENDING_SECONDS)
+        if existing.created_at <= stale and UploadReceipt.objects.filter(
+                pk=existing.pk, status_code__isnull=True, created_at=existing.created_at).update(**fields):
+            existing.created_at = fields['created_at']
+            return existing, None
+    return None, existing
+
+
+def _replay(receipt, path):
+    if receipt.path != path:
+        return JsonResponse({'ok': False, 'error': 'idempotency key reused for another request'}, status=422)
+    if receipt.status_code is None:
+        return JsonResponse({'ok': False, 'error': 'request in progress'}, status=409)
+    response = HttpResponse(receipt.response, status=receipt.status_code, content_type='application/json')
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """视图装饰器（放在 login_required 之内）：带 key 的请求按模块说明去重，不带 key 的照常处理。"""
+
+    @functools.wraps(view)
+    def wrapped(request, *args, **kwargs):
+        key = request.headers.get(HEADER) or request.GET.get('idempotency_key')
+        if not key and request.content_type in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+            key = request.POST.get('idempotency_key')
+        if not key or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({'ok': False, 'error': 'invalid idempotency key'}, status=400)
+        path = request.path[:UploadReceipt._meta.get_field('path').max_length]
+        purge_expired()
+        receipt, existing = _claim(request.user, key, path)
+        if receipt is None:
+            return _replay(existing, path)
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            UploadReceipt.objects.filter(pk=receipt.pk, created_at=receipt.created_at).delete()
+            raise
+        if response.status_code >= 500 or getattr(response, 'streaming', False):
+            UploadReceipt.objects.filter(pk=receipt.pk, created_at=receipt.created_at).delete()
+        else:
+            UploadReceipt.objects.filter(pk=receipt.pk, created_at=receipt.created_at).update(
+                status_code=response.status_code, response=response.content.decode('utf-8'))
+        return response
+
+    return wrapped
@@ -0,0 +1,175 @@
+"""页面数据装配：以固定次数的批量查询加载日记、评论、回复与附件，并在 Python 中分组。
+
+topic / discovey / public_discovey / index 共用这里的装配逻辑，模板只读取预先构建好的结构，
+不再在循环中触发 ``attachment_set`` / ``comment_set`` / ``replies`` 查询。
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q, QuerySet
+
+from .models import Comment, Attachment, AttachmentFolder
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+# 回复缩进的最大层级（更深的回复与该层对齐显示）
+THREAD_MAX_INDENT = 6
+# 日记卡片片段缓存时长（秒），0 表示不缓存
+ENTRY_CARD_CACHE_SECONDS = getattr(settings, 'LL_ENTRY_CARD_CACHE_SECONDS', 600)
+
+
+def build_attachment_roots(owners):
+    """批量构建附件树的第一层：根目录下的文件 + 顶级目录（附统计）。
+
+    owners 形如 {'entry': [id, ...], 'comment': [id, ...]}，返回 {(field, id): tree}。
+    tree 结构为 {'dirs': {name: {'total_files', 'total_bytes'}}, 'files': [attachment, ...]}；
+    目录节点不含子项，由前端展开时通过 list_folder_api 读取。
+    顶级目录及其统计直接取自文件夹索引（AttachmentFolder 的根行），
+    因此无论 owners 有多少、目录多大，总共只需 2 次查询。
+    """
+    trees = {(field, pk): {} for field, ids in owners.items() for pk in ids}
+    if not trees:
+        return trees
+    owner_filter = Q()
+    for field, ids in owners.items():
+        if ids:
+            owner_filter |= Q(**{f'{field}_id__in': ids})
+    # 待转挂的 topic 级临时附件（upload_session 非空）不显示
+    root_files = (Attachment.objects.filter(owner_filter, folder_path='', upload_session__isnull=True)
+                  .select_related('owner'))
+    for att in root_files:
+        for field in owners:
+            tree = trees.get((field, getattr(att, f'{field}_id')))
+            if tree is not None:
+                tree.setdefault('files', []).append(att)
+    for folder in AttachmentFolder.objects.filter(owner_filter, parent__isnull=True):
+        for field in owners:
+            tree = trees.get((field, getattr(folder, f'{field}_id')))
+            if tree is not None:
+                tree.setdefault('dirs', {})[folder.name] = {
+                    'total_files': folder.total_files, 'total_bytes': folder.total_bytes}
+    return trees
+
+
+def attachment_roots(field, owner_id):
+    """单个归属对象的附件树第一层，见 build_attachment_roots。"""
+    return build_attachment_roots({field: [owner_id]})[(field, owner_id)]
+
+
+def assemble_entries(entries, viewer, *, allow_modify=True):
+    """批量装配日记卡片所需的全部数据，返回 entry 列表。
+
+    entries 可以是 QuerySet 或已取出的列表（如 paginate_entries 返回的一页）。
+
+    无论 entries 有多少条、评论嵌套多深、附件目录多大，最多执行 4 次查询：日记（含作者）、
+    评论（含评论者）、根目录附件（含上传者）、顶级目录索引。
+    每个 entry 上挂载：
+      - attachment_tree：附件树第一层（见 build_attachment_roots）
+      - top_comments：顶级评论列表
+      - card_cache_key / card_cache_seconds：_entry_card.html 片段缓存的键与时长
+    每条评论上挂载：
+      - attachment_tree：评论附件树第一层
+      - thread：（仅顶级评论）全部后代，按深度优先排列，任意深度
+      - indent：（仅回复）缩进层级，超过 THREAD_MAX_INDENT 后不再增加
+      - allow_modify：当前查看者是否可修改该评论附件（评论作者或日记作者）
+    allow_modify=False 时（如公开发现页）所有评论均不可修改。
+    """
+    if isinstance(entries, QuerySet):
+        entries = entries.select_related('owner')
+    entries = list(entries)
+    if not entries:
+        return entries
+    viewer_id = getattr(viewer, 'id', None) if getattr(viewer, 'is_authenticated', False) else None
+
+    entry_ids = [e.id for e in entries]
+    comments = list(
+        Comment.objects.filter(entry_id__in=entry_ids)
+        .select_related('user')
+        .order_by('entry_id', 'path')
+    )
+    trees = build_attachment_roots({'entry': entry_ids, 'comment': [c.id for c in comments]})
+    entry_by_id = {e.id: e for e in entries}
+
+    # 评论按 path 排序即为深度优先顺序：每条顶级评论之后紧跟它的全部后代
+    comment_by_id = {c.id: c for c in comments}
+    top_by_entry = defaultdict(list)
+    step = Comment.PATH_STEP
+    for c in comments:
+        entry = entry_by_id[c.entry_id]
+        # 复用已加载的 entry，避免模板访问 c.entry 时再次查询
+        c.entry = entry
+        c.attachment_tree = trees[('comment', c.id)]
+        c.allow_modify = bool(allow_modify and viewer_id is not None
+                              and (c.user_id == viewer_id or entry.owner_id == viewer_id))
+        c.thread = []
+        ancestors = [int(c.path[i:i + step - 1]) for i in range(0, len(c.path) - step, step)]
+        top = comment_by_id.get(ancestors[0]) if ancestors else None
+        if top is None:
+            top_by_entry[c.entry_id].append(c)
+            continue
+        top.thread.append(c)
+        if c.parent_id in comment_by_id:
+            c.parent = comment_by_id[c.parent_id]
+        c.indent = min(c.depth - 1, THREAD_MAX_INDENT)
+
+    commenters = defaultdict(set)
+    for c in comments:
+        commenters[c.entry_id].add(c.user_id)
+    for entry in entries:
+        entry.attachment_tree = trees[('entry', entry.id)]
+        entry.top_comments = top_by_entry.get(entry.id, [])
+        entry.card_cache_key = _card_cache_key(entry, viewer_id, commenters[entry.id], allow_modify)
+        entry.card_cache_seconds = ENTRY_CARD_CACHE_SECONDS
+    return entries
+
+
+def _card_cache_key(entry, viewer_id, commenter_ids, allow_modify):
+    """卡片缓存键：日记身份 + render_version + 查看者角色。
+
+    卡片里与查看者有关的只有“编辑日记”、评论删除按钮与评论附件的可修改性，
+    因此按角色共享：日记作者一份；在该日记下发表过评论的用户各一份；其余查看者（含匿名）共用一份。
+    encode_cursor 带上 date_added，避免数据库重建后 id 复用命中旧缓存。
+    """
+    if viewer_id is not None and viewer_id == entry.owner_id:
+        role = 'owner'
+    elif viewer_id is not None and viewer_id in commenter_ids:
+        role = f'u{viewer_id}'
+    else:
+        role = 'reader'
+    if not allow_modify:
+        role += ':ro'
+    return f'{encode_cursor(entry)}:{entry.render_version}:{role}'
+
+
+def encode_cursor(entry):
+    """把 entry 的 (date_added, id) 编码为游标字符串：'<微秒时间戳>_<id>'。"""
+    delta = entry.date_added - _EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 10**6 + delta.microseconds
+    return f'{micros}_{entry.id}'
+
+
+def decode_cursor(cursor):
+    """解析 encode_cursor 生成的游标，返回 (date_added, id)；格式非法时抛出 ValueError。"""
+    micros, _, pk = (cursor or '').partition('_')
+    try:
+        return _EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except OverflowError:
+        raise ValueError(f'invalid cursor: {cursor!r}')
+
+
+def paginate_entries(entries, cursor=None, page_size=20):
+    """按 (date_added, id) 倒序做游标（keyset）分页。
+
+    只取 page_size + 1 行来判断是否还有下一页，代价与日记本总长度无关。
+    返回 (本页 entry 列表, 下一页游标或 None)。cursor 非法时抛出 ValueError。
+    """
+    entries = entries.select_related('owner').order_by('-date_added', '-id')
+    if cursor:
+        date_added, pk = decode_cursor(cursor)
+        entries = entries.filter(Q(date_added__lt=date_added) | Q(date_added=date_added, id__lt=pk))
+    page = list(entries[:page_size + 1])
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = encode_cursor(page[-1])
+    return page, next_cursor
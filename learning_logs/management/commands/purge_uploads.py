@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from learning_logs import idempotency, resumable, upload_sessions
+
+
+class Command(BaseCommand):
+    help = ("Delete abandoned resumable uploads whose expiry has passed, together with their temporary files, "
+            "expired upload sessions together with the attachments never moved to an entry, "
+            "and expired idempotency receipts.")
+
+    def handle(self, *args, **opts):
+        for label, purge in (('ResumableUpload', resumable.purge_expired),
+                             ('UploadSession', upload_sessions.purge_expired),
+                             ('UploadReceipt', idempotency.purge_expired)):
+            total = 0
+            while True:
+                n = purge()
+                if not n:
+                    break
+                total += n
+            self.stdout.write(f'{label}: purged {total}')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from learning_logs.counters import recount_model
+from learning_logs.models import Topic, Entry, Comment
+
+
+class Command(BaseCommand):
+    help = "Recompute denormalized comment/reply/attachment counters and repair any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows checked per batch (default 500)')
+
+    def handle(self, *args, **opts):
+        batch_size = max(1, int(opts.get('batch_size') or 500))
+        # 先修复评论，再修复其上层对象（各模型计数互不依赖，顺序仅影响输出）
+        for model in (Comment, Entry, Topic):
+            checked, fixed = recount_model(model, batch_size=batch_size)
+            self.stdout.write(f'{model.__name__}: checked {checked}, fixed {fixed}')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from learning_logs import relocate
+
+
+class Command(BaseCommand):
+    help = ("Move files of attachments that were reassigned from a topic to an entry into the entry's "
+            "storage directory (finishes relocations interrupted in the background).")
+
+    def handle(self, *args, **opts):
+        n = relocate.relocate(relocate.pending())
+        self.stdout.write(f'Attachment: relocated {n}')
@@ -0,0 +1,80 @@
+"""文件夹上传的相对路径清单（manifest）。
+
+客户端把清单作为单独的文件部分（字段名 manifest）随上传一起发送，不占表单字段数，
+也不受 DATA_UPLOAD_MAX_MEMORY_SIZE 对普通字段的限制；服务器逐行读取，不整体载入内存。
+
+格式为 NDJSON（UTF-8，每行一个 JSON 值），按 files 的顺序列出文件：
+
+    {"d": "photos/2024"}          之后的文件都位于该目录（根目录为 ""），同一目录只写一次
+    ["a.jpg", 1234, 1700000000]   文件名、大小、可选的 lastModified
+    ["b.jpg", 99]
+    ["c.jpg", 99, 0, "<sha256>"]   预检（preflight）时附上内容的 SHA-256，没有摘要的文件视为需要上传
+
+第 i 个文件行对应 files 中的第 i 个文件，目录行与空行不占序号。
+格式错误时抛 ManifestError，调用方按没有清单处理。
+"""
+import json
+
+from django.conf import settings
+
+MANIFEST_FIELD = 'manifest'
+# 单行最大字节数，超出视为格式错误，避免一行无换行的数据占满内存
+MAX_LINE_BYTES = getattr(settings, 'LL_MANIFEST_MAX_LINE_BYTES', 8192)
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class ManifestError(ValueError):
+    pass
+
+
+def _lines(fileobj):
+    buf = b''
+    while True:
+        chunk = fileobj.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        buf += chunk
+        *lines, buf = buf.split(b'\n')
+        for line in lines:
+            if len(line) > MAX_LINE_BYTES:
+                raise ManifestError('manifest line too long')
+            yield line
+        if len(buf) > MAX_LINE_BYTES:
+            raise ManifestError('manifest line too long')
+    if buf:
+        yield buf
+
+
+def iter_entries(fileobj, limit=None, with_digest=False):
+    """逐个产出 (序号, 相对路径, 文件名, 大小, lastModified)；超过 limit 个文件抛 ManifestError。
+
+    with_digest 时在末尾再附上 SHA-256（未提供时为 None）。
+    """
+    directory = ''
+    index = 0
+    for raw in _lines(fileobj):
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            item = json.loads(raw.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            raise ManifestError('invalid manifest line')
+        if isinstance(item, dict):
+            if isinstance(item.get('d'), str):
+                directory = item['d'].strip('/')
+            continue
+        if not isinstance(item, list) or not item or not isinstance(item[0], str):
+            raise ManifestError('invalid manifest line')
+        if limit is not None and index >= limit:
+            raise ManifestError('too many manifest entries')
+        name = item[0]
+        size = item[1] if len(item) > 1 else None
+        last_modified = item[2] if len(item) > 2 else None
+        path = f'{directory}/{name}' if directory else name
+        if with_digest:
+            digest = item[3] if len(item) > 3 and isinstance(item[3], str) else None
+            yield index, path, name, size, last_modified, digest
+        else:
+            yield index, path, name, size, last_modified
+        index += 1
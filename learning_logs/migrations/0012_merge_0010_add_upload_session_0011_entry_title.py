@@ -0,0 +1,14 @@
+# Generated by Django 4.2.30 on 2026-10-17 10:28
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning_logs', '0010_add_upload_session'),
+        ('learning_logs', '0011_entry_title'),
+    ]
+
+    operations = [
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 10:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning_logs', '0013_comment_parent_entry_last_edited'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(fields=['topic', 'date_added', 'id'], name='ll_entry_topic_cursor_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.30 on 2026-10-17 10:32
+
+from django.db import migrations, models
+
+
+def fill_comment_paths(apps, schema_editor):
+    """为已有评论补写物化路径与深度。"""
+    Comment = apps.get_model('learning_logs', 'Comment')
+    parents = dict(Comment.objects.values_list('id', 'parent_id'))
+    paths = {}
+
+    def resolve(cid):
+        chain = []
+        while cid is not None and cid not in paths:
+            chain.append(cid)
+            pid = parents.get(cid)
+            # 父评论缺失或出现环时按顶级评论处理
+            cid = pid if pid in parents and pid not in chain else None
+        for c in reversed(chain):
+            pid = parents.get(c)
+            prefix, depth = paths.get(pid, ('', -1))
+            paths[c] = (prefix + f"{c:010d}/", depth + 1)
+        return paths
+
+    batch = []
+    for cid in parents:
+        resolve(cid)
+        obj = Comment(id=cid)
+        obj.path, obj.depth = paths[cid]
+        batch.append(obj)
+        if len(batch) >= 500:
+            Comment.objects.bulk_update(batch, ['path', 'depth'])
+            batch = []
+    if batch:
+        Comment.objects.bulk_update(batch, ['path', 'depth'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning_logs', '0014_entry_cursor_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=440),
+        ),
+        migrations.RunPython(fill_comment_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['entry', 'path'], name='ll_comment_entry_path_idx'),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 4.2.30 on 2026-10-17 10:38
+
+from django.db import migrations, models
+from django.db.models import BigIntegerField, Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    """按现有数据回填冗余计数（每个字段一条 UPDATE）。"""
+    Topic = apps.get_model('learning_logs', 'Topic')
+    Entry = apps.get_model('learning_logs', 'Entry')
+    Comment = apps.get_model('learning_logs', 'Comment')
+    Attachment = apps.get_model('learning_logs', 'Attachment')
+
+    def agg(model, lookup, expr):
+        sub = (model.objects.filter(**{lookup: OuterRef('pk')}).order_by()
+               .values(lookup).annotate(v=expr).values('v'))
+        return Coalesce(Subquery(sub), Value(0), output_field=BigIntegerField())
+
+    Topic.objects.update(
+        comment_count=agg(Comment, 'entry__topic', Count('id')),
+        attachment_count=agg(Attachment, 'topic', Count('id')),
+        attachment_bytes=agg(Attachment, 'topic', Sum('size')),
+    )
+    Entry.objects.update(
+        comment_count=agg(Comment, 'entry', Count('id')),
+        attachment_count=agg(Attachment, 'entry', Count('id')),
+        attachment_bytes=agg(Attachment, 'entry', Sum('size')),
+    )
+    replies = (Comment.objects.filter(entry=OuterRef('entry'), path__startswith=OuterRef('path'))
+               .exclude(pk=OuterRef('pk')).order_by().values('entry').annotate(v=Count('id')).values('v'))
+    Comment.objects.update(
+        reply_count=Coalesce(Subquery(replies), Value(0), output_field=BigIntegerField()),
+        attachment_count=agg(Attachment, 'comment', Count('id')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning_logs', '0015_comment_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='attachment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='attachment_bytes',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='attachment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='attachment_bytes',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='attachment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
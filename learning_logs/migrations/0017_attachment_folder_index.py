@@ -0,0 +1,129 @@
+# Generated by Django 4.2.30 on 2026-10-17 10:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_folder_index(apps, schema_editor):
+    """为已有附件补写 folder_path，并据此建立文件夹索引。"""
+    Attachment = apps.get_model('learning_logs', 'Attachment')
+    AttachmentFolder = apps.get_model('learning_logs', 'AttachmentFolder')
+
+    batch = []
+    # (归属字段, 归属 id, 目录) -> [直接文件数, 子树文件数, 子树字节数]
+    stats = {}
+    rows = Attachment.objects.order_by().values_list(
+        'id', 'topic_id', 'entry_id', 'comment_id', 'relative_path', 'size', 'upload_session')
+    for pk, topic_id, entry_id, comment_id, rel, size, session in rows.iterator():
+        folder_path = (rel or '').rpartition('/')[0]
+        if folder_path:
+            obj = Attachment(id=pk)
+            obj.folder_path = folder_path
+            batch.append(obj)
+            if len(batch) >= 500:
+                Attachment.objects.bulk_update(batch, ['folder_path'])
+                batch = []
+        if session or not folder_path:
+            continue
+        parts = folder_path.split('/')
+        for field, owner_id in (('topic', topic_id), ('entry', entry_id), ('comment', comment_id)):
+            if not owner_id:
+                continue
+            for i in range(1, len(parts) + 1):
+                d = stats.setdefault((field, owner_id, '/'.join(parts[:i])), [0, 0, 0])
+                d[1] += 1
+                d[2] += size or 0
+            stats[(field, owner_id, folder_path)][0] += 1
+    if batch:
+        Attachment.objects.bulk_update(batch, ['folder_path'])
+
+    ids = {}
+    subfolders = {}
+    for key in sorted(stats, key=lambda k: k[2].count('/')):
+        field, owner_id, path = key
+        parent_path, _, name = path.rpartition('/')
+        parent_key = (field, owner_id, parent_path)
+        direct, total, size = stats[key]
+        folder = AttachmentFolder.objects.create(
+            parent_id=ids.get(parent_key), path=path, name=name,
+            file_count=direct, total_files=total, total_bytes=size, **{f'{field}_id': owner_id})
+        ids[key] = folder.id
+        if parent_path:
+            subfolders[ids[parent_key]] = subfolders.get(ids[parent_key], 0) + 1
+    for pk, n in subfolders.items():
+        AttachmentFolder.objects.filter(pk=pk).update(folder_count=n)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning_logs', '0016_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentFolder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500)),
+                ('name', models.CharField(max_length=255)),
+                ('file_count', models.PositiveIntegerField(default=0)),
+                ('folder_count', models.PositiveIntegerField(default=0)),
+                ('total_files', models.PositiveIntegerField(default=0)),
+                ('total_bytes', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='folder_path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=500),
+        ),
+        migrations.AddIndex(
+            model_name='attachment',
+            index=models.Index(fields=['topic', 'folder_path'], name='ll_att_topic_folder_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attachment',
+            index=models.Index(fields=['entry', 'folder_path'], name='ll_att_entry_folder_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attachment',
+            index=models.Index(fields=['comment', 'folder_path'], name='ll_att_comment_folder_idx'),
+        ),
+        migrations.AddField(
+            model_name='attachmentfolder',
+            name='comment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='learning_logs.comment'),
+        ),
+        migrations.AddField(
+            model_name='attachmentfolder',
+            name='entry',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='learning_logs.entry'),
+        ),
+        migrations.AddField(
+            model_name='attachmentfolder',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='learning_logs.attachmentfolder'),
+        ),
+        migrations.AddField(
+            model_name='attachmentfolder',
+            name='topic',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='learning_logs.topic'),
+        ),
+        migrations.AddConstraint(
+            model_name='attachmentfolder',
+            constraint=models.UniqueConstraint(condition=models.Q(('topic__isnull', False)), fields=('topic', 'path'), name='ll_folder_topic_path_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='attachmentfolder',
+            constraint=models.UniqueConstraint(condition=models.Q(('entry__isnull', False)), fields=('entry', 'path'), name='ll_folder_entry_path_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='attachmentfolder',
+            constraint=models.UniqueConstraint(condition=models.Q(('comment__isnull', False)), fields=('comment', 'path'), name='ll_folder_comment_path_uniq'),
+        ),
+        migrations.RunPython(build_folder_index, migrations.RunPython.noop),
+    ]
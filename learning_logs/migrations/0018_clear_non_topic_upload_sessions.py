@@ -0,0 +1,29 @@
+from importlib import import_module
+
+from django.db import migrations
+from django.db.models import Q
+
+build_folder_index = import_module('learning_logs.migrations.0017_attachment_folder_index').build_folder_index
+
+
+def clear_sessions_and_reindex(apps, schema_editor):
+    """日记 / 评论附件此前也会带上 upload_session，导致未进入文件夹索引。
+    清除这些 session 后重建索引。"""
+    Attachment = apps.get_model('learning_logs', 'Attachment')
+    AttachmentFolder = apps.get_model('learning_logs', 'AttachmentFolder')
+    stale = Attachment.objects.filter(Q(entry__isnull=False) | Q(comment__isnull=False), upload_session__isnull=False)
+    if not stale.update(upload_session=None):
+        return
+    AttachmentFolder.objects.all().delete()
+    build_folder_index(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning_logs', '0017_attachment_folder_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_sessions_and_reindex, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning_logs', '0018_clear_non_topic_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='render_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-17 10:46
+
+from django.db import migrations, models
+
+
+def create_public_version(apps, schema_editor):
+    ContentVersion = apps.get_model('learning_logs', 'ContentVersion')
+    ContentVersion.objects.get_or_create(name='public')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning_logs', '0019_entry_render_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_public_version, migrations.RunPython.noop),
+    ]
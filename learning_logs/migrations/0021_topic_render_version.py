@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('learning_logs', '0020_content_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='topic',
+            name='render_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
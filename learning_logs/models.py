@@ -1,13 +1,26 @@
 import mimetypes
 import os
+import tempfile
 from pathlib import Path
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
 from django.db.models.signals import post_delete
 from django.dispatch import receiver
 
+# 由 counters 模块以 F() 表达式维护的字段：普通 save() 不写回，避免用过期的内存值覆盖并发递增
+COUNTER_FIELDS = ('comment_count', 'attachment_count', 'attachment_bytes', 'reply_count', 'render_version')
+
+
+def _without_counters(instance, kwargs):
+    """保存已存在的行且未指定 update_fields 时，只写回计数以外的字段。"""
+    if (not instance._state.adding and instance.pk is not None
+            and kwargs.get('update_fields') is None and not kwargs.get('force_insert')):
+        kwargs['update_fields'] = [f.name for f in instance._meta.concrete_fields
+                                   if not f.primary_key and f.name not in COUNTER_FIELDS]
+    return kwargs
+
 
 class Topic(models.Model):
     """A topic the user is learning about."""
@@ -16,6 +29,16 @@ class Topic(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     # 是否公开：False 为私密，True 为公开
     is_public = models.BooleanField(default=False)
+    # 冗余计数（由 counters 模块维护，可用 manage.py recount 修复）：
+    # 本日记本下全部评论数；直接挂在日记本上的附件数与总字节数
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    attachment_count = models.PositiveIntegerField(default=0, editable=False)
+    attachment_bytes = models.BigIntegerField(default=0, editable=False)
+    # 页面版本：日记本自身、其下日记 / 评论 / 附件变化时由 counters 模块递增，用作页面 ETag
+    render_version = models.PositiveIntegerField(default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **_without_counters(self, kwargs))
 
     def __str__(self):
         """Return a string representation of the model."""
@@ -35,9 +58,22 @@ class Entry(models.Model):
     is_public = models.BooleanField(default=False)
     # 日记作者（新增，用于区分谁写的这篇日记）
     owner = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    # 冗余计数：全部评论（含回复）数；直接挂在日记上的附件数与总字节数
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    attachment_count = models.PositiveIntegerField(default=0, editable=False)
+    attachment_bytes = models.BigIntegerField(default=0, editable=False)
+    # 卡片渲染版本：日记、评论或附件变化时由 counters 模块递增，作为片段缓存键的一部分
+    render_version = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         verbose_name_plural = 'entries'
+        indexes = [
+            # 日记流按 (date_added, id) 游标分页，见 loaders.paginate_entries
+            models.Index(fields=['topic', 'date_added', 'id'], name='ll_entry_topic_cursor_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **_without_counters(self, kwargs))
 
     def __str__(self):
         """Return a simple string representing the entry.
@@ -50,16 +86,73 @@ class Entry(models.Model):
 
 
 class Comment(models.Model):
-    """对公开日记的评论。允许匿名（无 user），或登录用户。"""
+    """对公开日记的评论。允许匿名（无 user），或登录用户。
+
+    回复树以物化路径（materialized path）保存：path 由祖先到自身的定宽 id 段拼接而成，
+    按 path 排序即为深度优先顺序，path 前缀匹配即为整棵子树。
+    """
+    # 每层路径段：10 位十进制 id + '/'
+    PATH_STEP = 11
+    # 最大嵌套层数；更深的回复挂到倒数第二层，保证 path 不超长
+    MAX_DEPTH = 40
+
     entry = models.ForeignKey(Entry, on_delete=models.CASCADE)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     name = models.CharField(max_length=100, blank=True)
     text = models.TextField()
     date_added = models.DateTimeField(auto_now_add=True)
+    # 物化路径与深度（顶级评论 depth=0），在首次保存时写入
+    path = models.CharField(max_length=PATH_STEP * MAX_DEPTH, blank=True, default='', editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    # 冗余计数：后代回复数；评论附件数
+    reply_count = models.PositiveIntegerField(default=0, editable=False)
+    attachment_count = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ["date_added"]
+        indexes = [
+            models.Index(fields=['entry', 'path'], name='ll_comment_entry_path_idx'),
+        ]
+
+    @staticmethod
+    def path_segment(pk):
+        return f"{pk:010d}/"
+
+    @classmethod
+    def ids_in_path(cls, path):
+        """解析物化路径中的评论 id（从根到自身）。"""
+        step = cls.PATH_STEP
+        return [int(path[i:i + step - 1]) for i in range(0, len(path), step)]
+
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        if creating and self.parent_id and self.parent.depth + 1 >= self.MAX_DEPTH:
+            self.parent = self.parent.parent
+        # 与 post_save 中的计数更新处于同一事务
+        with transaction.atomic():
+            super().save(*args, **_without_counters(self, kwargs))
+            if creating and not self.path:
+                parent = self.parent if self.parent_id else None
+                self.depth = parent.depth + 1 if parent else 0
+                self.path = (parent.path if parent else '') + self.path_segment(self.pk)
+                Comment.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+
+    def subtree(self):
+        """本评论及全部后代（一条查询，按深度优先顺序）。"""
+        qs = Comment.objects.filter(entry_id=self.entry_id)
+        if not self.path:
+            # 尚未写入路径时只返回自身，避免空前缀匹配到整篇日记的评论
+            return qs.filter(pk=self.pk)
+        return qs.filter(path__startswith=self.path).order_by('path')
+
+    def descendant_count(self):
+        """后代数量：一次 COUNT，无需递归。"""
+        return self.subtree().exclude(pk=self.pk).count()
+
+    def delete_subtree(self):
+        """删除本评论及全部后代；附件随级联删除，并由 post_delete 信号清理文件。"""
+        return self.subtree().delete()
 
     def display_name(self):
         return self.user.username if self.user else (self.name or "匿名")
@@ -68,6 +161,18 @@ class Comment(models.Model):
         return f"评论 by {self.display_name()} on {self.entry_id}"
 
 
+class ContentVersion(models.Model):
+    """具名的内容版本号：相关数据变化时递增，作为整页缓存键的一部分（见 pagecache）。
+
+    存在数据库中而非缓存里，多个 gunicorn worker 即使各自使用本地内存缓存也能看到同一版本。
+    """
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}={self.value}"
+
+
 def upload_to_attachment(instance, filename):
     """根据归属（topic/entry/comment）决定存储子目录，
     同时在归属目录下附加相对路径（如通过“上传文件夹”功能带来的子目录）。"""
@@ -113,11 +218,24 @@ class Attachment(models.Model):
     uploaded_at = models.DateTimeField(auto_now_add=True)
     # 临时上传 session key：用于 new_entry 情况下在创建 entry 后将 topic-level临时附件附加到该 entry
     upload_session = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    # relative_path 的目录部分（根目录为空串），用于按目录直接取文件
+    folder_path = models.CharField(max_length=500, blank=True, default='', editable=False)
+    # 文件内容的 SHA-256（十六进制），上传时由 uploads.SpooledUploadHandler 在接收过程中算出
+    sha256 = models.CharField(max_length=64, blank=True, default='', editable=False)
 
     class Meta:
         ordering = ["-uploaded_at"]
+        indexes = [
+            models.Index(fields=['topic', 'folder_path'], name='ll_att_topic_folder_idx'),
+            models.Index(fields=['entry', 'folder_path'], name='ll_att_entry_folder_idx'),
+            models.Index(fields=['comment', 'folder_path'], name='ll_att_comment_folder_idx'),
+        ]
 
-    def save(self, *args, **kwargs):
+    def prepare(self):
+        """填好由文件推导出的字段（名称、规范化路径、类型、摘要、大小）。
+
+        批量导入在把文件写入存储之前调用，之后 bulk_create 不再经过 save()。
+        """
         if self.file and not self.original_name:
             self.original_name = self.file.name
         # 规范化 relative_path
@@ -125,14 +243,25 @@ class Attachment(models.Model):
             rp = self.relative_path.replace('\\', '/').strip('/')
             parts = [seg for seg in rp.split('/') if seg not in ('', '.', '..')]
             self.relative_path = '/'.join(parts)
+        self.folder_path = self.relative_path.rpartition('/')[0]
+        # 新上传的文件：类型与摘要已在接收时算出（见 uploads 模块），不必重新读取
+        upload = self.file.file if self.file and not self.file._committed else None
+        if upload is not None and not self.sha256:
+            self.sha256 = getattr(upload, 'sha256', '') or ''
         if self.file and not self.content_type:
+            sniffed = getattr(upload, 'sniffed_content_type', None)
             guessed, _ = mimetypes.guess_type(self.file.name)
-            self.content_type = guessed or "application/octet-stream"
+            self.content_type = sniffed or guessed or "application/octet-stream"
         try:
             self.size = self.file.size
         except Exception:
             pass
-        super().save(*args, **kwargs)
+
+    def save(self, *args, **kwargs):
+        self.prepare()
+        # 与 post_save 中的计数更新处于同一事务
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     @property
     def is_image(self):
@@ -154,6 +283,130 @@ class Attachment(models.Model):
         ))
 
 
+class AttachmentFolder(models.Model):
+    """附件文件夹索引：每个归属对象（topic/entry/comment 三选一）下的每个目录一行。
+
+    由 folders 模块随附件的新增、删除与转挂同步维护，只统计 upload_session 为空的附件。
+    展开文件夹时只需读取直接子目录与直接文件，不必扫描整棵子树。
+    """
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, null=True, blank=True)
+    entry = models.ForeignKey(Entry, on_delete=models.CASCADE, null=True, blank=True)
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE, null=True, blank=True)
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
+    # 完整目录路径（如 'a/b'）与末段名称（'b'）
+    path = models.CharField(max_length=500)
+    name = models.CharField(max_length=255)
+    # 直接文件数 / 直接子目录数 / 子树文件总数 / 子树总字节数
+    file_count = models.PositiveIntegerField(default=0)
+    folder_count = models.PositiveIntegerField(default=0)
+    total_files = models.PositiveIntegerField(default=0)
+    total_bytes = models.BigIntegerField(default=0)
+
+    class Meta:
+        ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(fields=['topic', 'path'], condition=models.Q(topic__isnull=False),
+                                    name='ll_folder_topic_path_uniq'),
+            models.UniqueConstraint(fields=['entry', 'path'], condition=models.Q(entry__isnull=False),
+                                    name='ll_folder_entry_path_uniq'),
+            models.UniqueConstraint(fields=['comment', 'path'], condition=models.Q(comment__isnull=False),
+                                    name='ll_folder_comment_path_uniq'),
+        ]
+
+    def __str__(self):
+        return self.path
+
+
+class UploadSession(models.Model):
+    """一批异步上传（见 upload_sessions 模块）：记录预期与已收到的文件数 / 字节数、归属与过期时间。
+
+    key 即 Attachment.upload_session 中保存的字符串；topic 级附件带着它等待 new_entry 转挂，
+    过期仍未转挂的视为放弃，连同这些附件一起清理。
+    """
+    key = models.CharField(max_length=64, unique=True)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, null=True, blank=True)
+    entry = models.ForeignKey(Entry, on_delete=models.CASCADE, null=True, blank=True)
+    comment = models.ForeignKey('Comment', on_delete=models.CASCADE, null=True, blank=True)
+    expected_files = models.PositiveIntegerField(default=0)
+    expected_bytes = models.BigIntegerField(default=0)
+    # 由 F() 表达式递增，并发上传的多个分块互不覆盖
+    received_files = models.PositiveIntegerField(default=0)
+    received_bytes = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    @property
+    def is_complete(self):
+        return self.received_files >= self.expected_files and self.received_bytes >= self.expected_bytes
+
+    def __str__(self):
+        return f"{self.key} {self.received_files}/{self.expected_files}"
+
+
+class UploadReceipt(models.Model):
+    """上传请求的幂等记录（见 idempotency 模块）：同一用户重试同一 Idempotency-Key 时重放首次的响应。
+
+    status_code 为空表示首次请求仍在处理中。
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=100)
+    path = models.CharField(max_length=200)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'key'], name='ll_receipt_owner_key_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} {self.status_code or 'pending'}"
+
+
+def resumable_upload_dir() -> Path:
+    """续传中的分块临时文件目录（不在 MEDIA_ROOT 下，避免未完成的文件被当作媒体文件访问）。"""
+    default = Path(getattr(settings, 'FILE_UPLOAD_TEMP_DIR', None) or tempfile.gettempdir()) / 'll-resumable'
+    return Path(getattr(settings, 'LL_RESUMABLE_UPLOAD_DIR', None) or default)
+
+
+class ResumableUpload(models.Model):
+    """可续传的单文件上传：按字节区间追加写入临时文件，收齐后生成 Attachment（见 resumable 模块）。"""
+    token = models.CharField(max_length=32, unique=True)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    # 完成后附件的归属，与 Attachment 相同（三选一）
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, null=True, blank=True)
+    entry = models.ForeignKey(Entry, on_delete=models.CASCADE, null=True, blank=True)
+    comment = models.ForeignKey('Comment', on_delete=models.CASCADE, null=True, blank=True)
+    name = models.CharField(max_length=255)
+    relative_path = models.CharField(max_length=500, blank=True, default='')
+    upload_session = models.CharField(max_length=64, blank=True, null=True)
+    # 声明的总字节数与已连续收到的字节数（下一块应从 received 开始）
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # 每收到一块顺延；过期后由 resumable.purge_expired 清理
+    expires_at = models.DateTimeField(db_index=True)
+
+    def partial_path(self, suffix='.part') -> Path:
+        return resumable_upload_dir() / f'{self.token}{suffix}'
+
+    def __str__(self):
+        return f"{self.name} {self.received}/{self.size}"
+
+
+@receiver(post_delete, sender=ResumableUpload)
+def delete_partial_file(sender, instance, **kwargs):
+    """删除续传记录（完成、放弃、过期或归属被删除）时清理残留的临时文件。"""
+    for suffix in ('.part', '.done'):
+        try:
+            instance.partial_path(suffix).unlink()
+        except FileNotFoundError:
+            pass
+
+
 @receiver(post_delete, sender=Attachment)
 def delete_attachment_file(sender, instance, **kwargs):
     """删除数据库记录后同步清理对应的物理文件和空目录。"""
@@ -0,0 +1,168 @@
+"""发现页整页缓存：匿名访客与共享的 traveler 用户看到的页面完全相同，渲染一次即可复用。
+
+- 缓存键包含受众（anon / traveler）、完整路径与 ContentVersion('public') 版本号；
+  公开日记本及其日记、评论、附件，以及私密日记本中的公开日记（匿名访客同样能看到）发生变化时
+  touch_public 递增版本号，旧页面自然失效。
+- 冷键只由一个请求渲染：先用 cache.add 抢占锁，其余请求短暂轮询等待结果，超时再自行渲染。
+  锁与页面都存放在默认缓存中；使用 Redis / Memcached 等共享缓存时对所有 worker 生效，
+  本地内存缓存下则按 worker 生效。
+- 每个请求都不同的部分（随机背景图、CSRF token）在缓存中保存为占位符，命中后再替换，
+  因此背景图仍按请求随机选择。
+- 条件请求：etag_for 由版本号等廉价字段拼出弱 ETag，not_modified 在 If-None-Match 命中时
+  直接返回 304，无需渲染。整页缓存的 ETag 取自缓存键，命中只需查询一次版本号。
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Exists, F, Q
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response
+
+from . import signed_media
+from .models import Topic, ContentVersion
+
+PUBLIC = 'public'
+# 整页缓存时长（秒），0 表示关闭
+PUBLIC_PAGE_CACHE_SECONDS = getattr(settings, 'LL_PUBLIC_PAGE_CACHE_SECONDS', 300)
+# 冷键渲染锁的最长持有时间，以及其他请求等待结果的最长时间（秒）
+PAGE_RENDER_LOCK_SECONDS = getattr(settings, 'LL_PAGE_RENDER_LOCK_SECONDS', 30)
+PAGE_RENDER_WAIT_SECONDS = getattr(settings, 'LL_PAGE_RENDER_WAIT_SECONDS', 2.0)
+
+BACKGROUND_PLACEHOLDER = 'll-page-cache-background-image'
+CSRF_PLACEHOLDER = 'll-page-cache-csrf-token'
+
+
+def touched_topics(topic_ids=(), entry_ids=(), comment_ids=()):
+    """给定的日记本 / 日记 / 评论所属的日记本 QuerySet；全部为空时返回 None。"""
+    q = Q()
+    if topic_ids:
+        q |= Q(pk__in=list(topic_ids))
+    if entry_ids:
+        q |= Q(entry__id__in=list(entry_ids))
+    if comment_ids:
+        q |= Q(entry__comment__id__in=list(comment_ids))
+    if not q:
+        return None
+    return Topic.objects.filter(q)
+
+
+def touch_public(topic_ids=(), entry_ids=(), comment_ids=()):
+    """若给定的日记本 / 日记 / 评论属于公开日记本或公开日记，递增公开内容版本号（一条 UPDATE）。
+
+    私密日记本中的公开日记也对匿名访客展示，只看日记本是否公开会漏掉它们。
+    """
+    topics = touched_topics(topic_ids, entry_ids, comment_ids)
+    if topics is None:
+        return
+    visible = Q(is_public=True)
+    if topic_ids:
+        visible |= Q(pk__in=list(topic_ids), entry__is_public=True)
+    if entry_ids:
+        visible |= Q(entry__id__in=list(entry_ids), entry__is_public=True)
+    if comment_ids:
+        visible |= Q(entry__comment__id__in=list(comment_ids), entry__is_public=True)
+    public = topics.filter(visible)
+    ContentVersion.objects.filter(Exists(public), name=PUBLIC).update(value=F('value') + 1)
+
+
+def bump_public():
+    """无条件递增公开内容版本号（如日记本公开 / 私密切换，无法从当前行判断之前是否公开）。"""
+    ContentVersion.objects.filter(name=PUBLIC).update(value=F('value') + 1)
+
+
+def etag_for(request, *parts):
+    """弱 ETag：查看者、完整路径与 parts（各类版本号）的摘要。背景图随机，故为弱校验器。"""
+    viewer = request.user.pk if request.user.is_authenticated else 'anon'
+    # 页面中的附件签名地址按时段签发，换时段后页面需要重新渲染
+    raw = ':'.join(str(p) for p in (viewer, request.get_full_path(), signed_media.epoch(), *parts))
+    return 'W/"%s"' % hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def not_modified(request, etag):
+    """GET / HEAD 请求的 If-None-Match / If-Modified-Since 命中时返回 304 响应，否则返回 None。"""
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    return get_conditional_response(request, etag=etag)
+
+
+def _public_version():
+    return ContentVersion.objects.get_or_create(name=PUBLIC)[0].value
+
+
+def _audience(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return 'anon'
+    if user.username == 'traveler':
+        return 'traveler'
+    return None
+
+
+def _page_key(audience, request):
+    digest = hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest()
+    return f'll:page:{audience}:{_public_version()}:{signed_media.epoch()}:{digest}'
+
+
+def _materialize(request, page):
+    """把缓存的页面还原为响应：替换背景图与 CSRF 占位符。"""
+    from .context_processors import background_image
+
+    content_type, html = page
+    html = html.replace(BACKGROUND_PLACEHOLDER, background_image(request)['background_image_url'])
+    if CSRF_PLACEHOLDER in html:
+        html = html.replace(CSRF_PLACEHOLDER, get_token(request))
+    return HttpResponse(html, content_type=content_type)
+
+
+def _wait_for(key):
+    deadline = time.monotonic() + PAGE_RENDER_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        page = cache.get(key)
+        if page is not None:
+            return page
+    return None
+
+
+def public_page_cache(view):
+    """为匿名访客与 traveler 缓存整页 GET 响应；其余用户照常渲染。"""
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        audience = _audience(request)
+        if audience is None or request.method not in ('GET', 'HEAD') or PUBLIC_PAGE_CACHE_SECONDS <= 0:
+            return view(request, *args, **kwargs)
+        key = _page_key(audience, request)
+        etag = 'W/"%s"' % hashlib.md5(key.encode('utf-8')).hexdigest()
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        page = cache.get(key)
+        if page is None:
+            lock = key + ':lock'
+            if not cache.add(lock, 1, PAGE_RENDER_LOCK_SECONDS):
+                page = _wait_for(key)
+                if page is None:
+                    return view(request, *args, **kwargs)
+            else:
+                try:
+                    # 让 context_processors.page_cache_placeholders 输出占位符
+                    request.ll_page_cache = True
+                    try:
+                        response = view(request, *args, **kwargs)
+                    finally:
+                        request.ll_page_cache = False
+                    # 重定向等响应不缓存（这些视图只在 200 时渲染模板）
+                    if response.status_code != 200 or getattr(response, 'streaming', False):
+                        return response
+                    page = (response['Content-Type'], response.content.decode(response.charset))
+                    cache.set(key, page, PUBLIC_PAGE_CACHE_SECONDS)
+                finally:
+                    cache.delete(lock)
+        response = _materialize(request, page)
+        response['ETag'] = etag
+        return response
+    return wrapped
@@ -0,0 +1,77 @@
+"""重新同步文件夹前的预检：按清单判断哪些文件在服务器上已存在且未改变，客户端只需上传其余文件。
+
+清单格式见 manifest 模块，每个文件行附上内容的 SHA-256。同一归属下 relative_path、大小
+与 SHA-256 都相同的附件才视为未改变；没有摘要的文件（或库中附件没有摘要）一律需要上传，
+大小相同而内容不同的修改不会被误判为未改变。
+
+stale 为清单所覆盖的顶层目录中、清单里已不存在的文件，以及同一路径上已有一致版本时
+其余不一致的旧版本（重新上传后留下的副本）；只统计当前用户自己上传的附件。
+prune 时一次性删除它们（尚未重新上传的已改变文件不会被删除）。
+"""
+from collections import defaultdict
+
+from . import counters
+from .models import Attachment
+
+
+def normalize_path(path):
+    """与 Attachment.prepare 相同的规范化，使清单路径与库中的 relative_path 可直接比较。"""
+    parts = [seg for seg in (path or '').replace('\\', '/').split('/') if seg not in ('', '.', '..')]
+    return '/'.join(parts)
+
+
+def _matches(att, size, digest):
+    if not digest or not att.sha256:
+        return False
+    if size is not None and att.size != size:
+        return False
+    return att.sha256 == digest.lower()
+
+
+def compare(entries, owner, *, prune=False, **parent):
+    """entries 为 manifest.iter_entries(..., with_digest=True) 的结果，parent 为唯一的归属。
+
+    返回 {'unchanged': [序号], 'upload': [序号], 'stale': [{'id', 'relative_path'}], 'removed': n}。
+    """
+    wanted = {}
+    roots = set()
+    for index, path, _name, size, _lastm, digest in entries:
+        path = normalize_path(path)
+        if not path:
+            continue
+        wanted.setdefault(path, []).append((index, size if isinstance(size, int) else None, digest))
+        if '/' in path:
+            roots.add(path.split('/', 1)[0])
+
+    existing = defaultdict(list)
+    if wanted:
+        qs = (Attachment.objects.filter(**parent, upload_session__isnull=True)
+              .only('id', 'relative_path', 'size', 'sha256', 'owner_id').order_by('id'))
+        for att in qs.iterator():
+            path = att.relative_path
+            if path in wanted or path.split('/', 1)[0] in roots:
+                existing[path].append(att)
+
+    unchanged, upload = [], []
+    stale_ids = []
+    for path, items in wanted.items():
+        found = existing.get(path, [])
+        for index, size, digest in items:
+            if any(_matches(att, size, digest) for att in found):
+                unchanged.append(index)
+            else:
+                upload.append(index)
+        # 同一路径上已有与清单一致的版本时，其余不一致的是旧版本
+        current = [att for att in found if any(_matches(att, size, digest) for _, size, digest in items)]
+        if current:
+            stale_ids.extend(att.id for att in found if att.owner_id == owner.pk and att not in current)
+    for path, found in existing.items():
+        if path not in wanted:
+            stale_ids.extend(att.id for att in found if att.owner_id == owner.pk)
+
+    paths = {att.id: att.relative_path for found in existing.values() for att in found}
+    stale = [{'id': pk, 'relative_path': paths[pk]} for pk in sorted(stale_ids)]
+    removed = 0
+    if prune and stale_ids:
+        removed = counters.delete_attachments(Attachment.objects.filter(pk__in=stale_ids))[1].get(Attachment._meta.label, 0)
+    return {'unchanged': sorted(unchanged), 'upload': sorted(upload), 'stale': stale, 'removed': removed}
@@ -0,0 +1,165 @@
+"""附件下载的 HTTP Range 支持（RFC 9110 第 14 节），使 <video>/<audio> 可以拖动、中断的下载可以续传。
+
+- 单个区间返回 206 与 Content-Range；多个区间返回 multipart/byteranges；
+  区间全部超出文件末尾时返回 416（Content-Range: bytes */大小）。
+- If-Range 与当前的强 ETag 或 Last-Modified 不一致时忽略 Range，返回完整文件。
+- 语法错误或区间过多（超过 LL_MAX_RANGES）时按规范忽略 Range，返回 200。
+- 文件可 seek 时（本地存储）直接定位；远程存储返回的不可 seek 的流按顺序读过去并丢弃不需要的部分。
+"""
+import secrets
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+RANGE_CHUNK_SIZE = getattr(settings, 'LL_RANGE_CHUNK_SIZE', 256 * 1024)
+# 一个请求最多接受的区间数，超出时返回完整文件
+MAX_RANGES = getattr(settings, 'LL_MAX_RANGES', 16)
+
+
+def parse_range(header, size):
+    """解析 Range 请求头，返回 [(start, end), ...]（闭区间，已按起点排序并合并重叠）。
+
+    语法错误或区间过多时返回 None（应忽略 Range）；没有可满足的区间时返回 []。
+    """
+    unit, _, spec = (header or '').partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+    specs = spec.split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for item in specs:
+        first, sep, last = item.strip().partition('-')
+        if not sep:
+            return None
+        first, last = first.strip(), last.strip()
+        if not first:
+            # 后缀区间：最后 N 个字节
+            if not last.isdigit():
+                return None
+            n = int(last)
+            if n and size:
+                ranges.append((max(size - n, 0), size - 1))
+            continue
+        if not first.isdigit() or (last and not last.isdigit()):
+            return None
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = int(last) if last else size - 1
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _if_range_matches(request, etag, last_modified):
+    value = request.headers.get('If-Range')
+    if value is None:
+        return True
+    value = value.strip()
+    if value.startswith(('"', 'W/')):
+        # 只认强校验器
+        return bool(etag) and value == etag
+    modified = parse_http_date_safe(value)
+    return modified is not None and last_modified is not None and modified == int(last_modified.timestamp())
+
+
+def _read_range(fh, start, end, position):
+    """fh 当前位于 position，逐块产出 [start, end] 的内容。"""
+    if position != start:
+        if getattr(fh, 'seekable', lambda: False)():
+            fh.seek(start)
+        else:
+            if position > start:
+                raise ValueError('ranges must be read in order from a non-seekable file')
+            _discard(fh, start - position)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = fh.read(min(RANGE_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _discard(fh, n):
+    while n > 0:
+        chunk = fh.read(min(RANGE_CHUNK_SIZE, n))
+        if not chunk:
+            break
+        n -= len(chunk)
+
+
+def _single(fh, start, end):
+    try:
+        yield from _read_range(fh, start, end, 0)
+    finally:
+        fh.close()
+
+
+def _multipart(fh, parts, closing):
+    try:
+        position = 0
+        for head, start, end in parts:
+            yield head
+            yield from _read_range(fh, start, end, position)
+            position = end + 1
+        yield closing
+    finally:
+        fh.close()
+
+
+def file_response(request, fh, *, size, content_type='application/octet-stream', etag=None, last_modified=None):
+    """按请求头返回 200 / 206 / 304 / 416 响应；fh 为以二进制方式打开的文件，响应负责关闭它。
+
+    etag 为强 ETag（不带引号时自动加上），last_modified 为带时区的 datetime。
+    """
+    etag = quote_etag(etag) if etag else None
+    last_modified_ts = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified_ts)
+    ranges = None
+    if response is None and request.method in ('GET', 'HEAD') and 'Range' in request.headers \
+            and _if_range_matches(request, etag, last_modified):
+        ranges = parse_range(request.headers['Range'], size)
+        if ranges == []:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+    if response is not None:
+        fh.close()
+    elif not ranges:
+        response = FileResponse(fh, content_type=content_type)
+        response['Content-Length'] = str(size)
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(_single(fh, start, end), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        boundary = secrets.token_hex(16)
+        parts = []
+        length = 0
+        for start, end in ranges:
+            head = (f'\r\n--{boundary}\r\nContent-Type: {content_type}\r\n'
+                    f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n').encode('latin-1')
+            parts.append((head, start, end))
+            length += len(head) + end - start + 1
+        closing = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+        length += len(closing)
+        response = StreamingHttpResponse(_multipart(fh, parts, closing), status=206,
+                                         content_type=f'multipart/byteranges; boundary={boundary}')
+        response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    if etag:
+        response['ETag'] = etag
+    if last_modified_ts is not None:
+        response['Last-Modified'] = http_date(last_modified_ts)
+    return response
@@ -0,0 +1,86 @@
+"""把转挂到日记的附件文件从 attachments/topics/<id>/ 移到该日记的存储目录 attachments/entries/<id>/ 下。
+
+new_entry 只用一条 UPDATE 改归属，不碰存储；文件搬迁在事务提交后于后台线程进行
+（LL_RELOCATE_IN_BACKGROUND=False 时在请求内同步进行），中断或失败的可由 relocate_attachments 命令补做。
+
+每个文件先复制到新位置，再以旧文件名为条件更新 file 字段，成功后才删除旧文件；
+条件不成立（附件已被删除或已被别处搬迁）时删除新副本，库中始终指向存在的文件。
+本地存储中的副本沿用原文件的修改时间，签名地址据此判断文件名是否被复用（见 signed_media）。
+"""
+import logging
+import os
+import posixpath
+import threading
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+
+from . import counters
+from .models import Attachment, upload_to_attachment
+
+RELOCATE_IN_BACKGROUND = getattr(settings, 'LL_RELOCATE_IN_BACKGROUND', True)
+
+log = logging.getLogger('learning_logs.relocate')
+
+
+def target_name(att):
+    """按当前归属应存放的文件名（文件名部分不变）。"""
+    return upload_to_attachment(att, posixpath.basename(att.file.name))
+
+
+def pending(qs=None):
+    """已挂到日记、但文件仍在日记本目录下的附件。"""
+    qs = Attachment.objects.all() if qs is None else qs
+    return qs.filter(entry__isnull=False, file__startswith='attachments/topics/')
+
+
+def relocate(qs):
+    """搬迁 qs 中文件不在目标位置的附件，返回搬迁的个数。"""
+    moved_entries = set()
+    n = 0
+    for att in qs.only('id', 'file', 'topic_id', 'entry_id', 'comment_id', 'relative_path').iterator():
+        old = att.file.name
+        want = target_name(att)
+        if not old or posixpath.dirname(old) == posixpath.dirname(want):
+            continue
+        storage = att.file.storage
+        try:
+            with storage.open(old, 'rb') as src:
+                new = storage.save(want, src)
+            if isinstance(storage, FileSystemStorage):
+                st = os.stat(storage.path(old))
+                os.utime(storage.path(new), ns=(st.st_atime_ns, st.st_mtime_ns))
+        except OSError:
+            log.warning('relocate: cannot copy attachment id=%s from %s', att.pk, old, exc_info=True)
+            continue
+        if Attachment.objects.filter(pk=att.pk, file=old).update(file=new):
+            storage.delete(old)
+            moved_entries.add(att.entry_id)
+            n += 1
+        else:
+            storage.delete(new)
+    if moved_entries:
+        # 文件地址变了，已渲染的页面随之失效
+        counters.touch_entries(entry_ids=moved_entries)
+    return n
+
+
+def _run(entry_id, in_thread=False):
+    try:
+        n = relocate(pending(Attachment.objects.filter(entry_id=entry_id)))
+        log.debug('relocated %s attachments for entry id=%s', n, entry_id)
+    except Exception:
+        log.exception('relocate failed for entry id=%s', entry_id)
+    finally:
+        if in_thread:
+            # 后台线程有自己的数据库连接，用完关闭
+            connection.close()
+
+
+def schedule(entry_id):
+    """在当前事务提交后搬迁该日记的附件文件，不阻塞请求。"""
+    if RELOCATE_IN_BACKGROUND:
+        transaction.on_commit(lambda: threading.Thread(target=_run, args=(entry_id, True), daemon=True).start())
+    else:
+        transaction.on_commit(lambda: _run(entry_id))
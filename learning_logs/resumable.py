@@ -0,0 +1,176 @@
+"""可续传的单文件上传（大文件中断后从已收到的位置继续，而不是整个文件重传）。
+
+协议（均需登录，视图见 views.resumable_*）：
+1. POST attachments/resumable/ 建立上传：parent_type / parent_id / name / size，
+   可选 relative_path 与 upload_session，返回 token 与建议的分块大小；
+2. PUT attachments/resumable/<token>/，请求头 ``Content-Range: bytes <start>-<end>/<size>``，
+   请求体为该区间的字节。start 必须等于已收到的字节数，否则返回 409 与当前 offset；
+3. GET 同一地址查询已收到的 offset（中断后从这里继续），DELETE 放弃上传；
+4. POST attachments/resumable/<token>/finalize/ 收齐后生成附件，
+   返回与 upload_attachments_api 相同格式的 files 列表；已过期的上传返回 410。
+
+请求体按块直接写入临时文件的对应位置，不在内存中缓存整块；offset 以条件 UPDATE 推进，
+重试导致同一区间重复到达时只有一次生效。超过 LL_RESUMABLE_UPLOAD_TTL_SECONDS 未收到数据的上传
+在新建上传时、或由 ``python manage.py purge_uploads`` 清理，临时文件随记录删除。
+"""
+import hashlib
+import os
+import re
+import secrets
+import shutil
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.utils import timezone
+
+from .models import Attachment, ResumableUpload
+from .uploads import SNIFF_BYTES, UPLOAD_CHUNK_SIZE, sniff_content_type
+
+# 多久未收到数据视为放弃（秒）
+RESUMABLE_UPLOAD_TTL_SECONDS = getattr(settings, 'LL_RESUMABLE_UPLOAD_TTL_SECONDS', 24 * 3600)
+# 单个续传文件的大小上限（字节）
+RESUMABLE_UPLOAD_MAX_BYTES = getattr(settings, 'LL_RESUMABLE_UPLOAD_MAX_BYTES', 5 * 1024 ** 3)
+# 建议客户端每次 PUT 的字节数
+RESUMABLE_CHUNK_BYTES = getattr(settings, 'LL_RESUMABLE_CHUNK_BYTES', 8 * 1024 * 1024)
+# 每次清理最多删除的过期记录数，避免在请求中做过多工作
+PURGE_BATCH = 200
+
+_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class OffsetMismatch(Exception):
+    """区间起点与服务器已收到的字节数不一致；offset 为服务器当前进度。"""
+
+    def __init__(self, offset):
+        super().__init__(offset)
+        self.offset = offset
+
+
+def _expiry():
+    return timezone.now() + timedelta(seconds=RESUMABLE_UPLOAD_TTL_SECONDS)
+
+
+def purge_expired(limit=PURGE_BATCH):
+    """删除已过期的上传记录（临时文件由 post_delete 清理），返回删除条数。"""
+    ids = list(ResumableUpload.objects.filter(expires_at__lte=timezone.now())
+               .values_list('pk', flat=True)[:limit])
+    if not ids:
+        return 0
+    return ResumableUpload.objects.filter(pk__in=ids).delete()[1].get(ResumableUpload._meta.label, 0)
+
+
+def create(owner, *, name, size, relative_path='', upload_session=None, **parent):
+    """建立上传记录与空的临时文件；parent 为 topic / entry / comment 之一。"""
+    purge_expired()
+    upload = ResumableUpload.objects.create(
+        token=secrets.token_hex(16), owner=owner, name=name[:255], size=size,
+        relative_path=(relative_path or '')[:500], upload_session=upload_session or None,
+        expires_at=_expiry(), **parent,
+    )
+    path = upload.partial_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+    return upload
+
+
+def renew(upload):
+    """未过期时延长有效期并返回 True；已过期返回 False。
+
+    finalize 先调用它，处理期间记录不会被 purge_expired 删除（临时文件随之删除）。
+    """
+    expires_at = _expiry()
+    renewed = ResumableUpload.objects.filter(pk=upload.pk, expires_at__gt=timezone.now()).update(expires_at=expires_at)
+    if renewed:
+        upload.expires_at = expires_at
+    return bool(renewed)
+
+
+def parse_content_range(header):
+    """'bytes 0-99/1000' -> (0, 99, 1000)；格式不对时抛 ValueError。"""
+    m = _RANGE_RE.match((header or '').strip())
+    if not m:
+        raise ValueError('invalid Content-Range')
+    start, end, total = (int(v) for v in m.groups())
+    if end < start:
+        raise ValueError('invalid Content-Range')
+    return start, end, total
+
+
+def write_range(upload, stream, start, end):
+    """把 stream 中 [start, end] 区间的字节写入临时文件，返回新的 offset。
+
+    提前断开时只推进实际写入的部分，客户端查询 offset 后从那里继续。
+    """
+    if start != upload.received:
+        raise OffsetMismatch(upload.received)
+    if end >= upload.size:
+        raise ValueError('range exceeds declared size')
+    remaining = end - start + 1
+    with open(upload.partial_path(), 'r+b') as fh:
+        fh.seek(start)
+        while remaining:
+            data = stream.read(min(UPLOAD_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            fh.write(data)
+            remaining -= len(data)
+    offset = end + 1 - remaining
+    advanced = ResumableUpload.objects.filter(pk=upload.pk, received=start).update(
+        received=offset, expires_at=_expiry())
+    if not advanced:
+        upload.refresh_from_db(fields=['received'])
+        raise OffsetMismatch(upload.received)
+    upload.received = offset
+    return offset
+
+
+class CompletedUpload(UploadedFile):
+    """收齐的续传文件：存储层可直接移动临时文件（temporary_file_path），摘要与类型已算出。"""
+
+    def __init__(self, path, upload):
+        super().__init__(open(path, 'rb'), upload.name, None, upload.size, None)
+        self._path = str(path)
+        digest = hashlib.sha256()
+        head = b''
+        for chunk in self.chunks(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            if len(head) < SNIFF_BYTES:
+                head += chunk[:SNIFF_BYTES - len(head)]
+        self.seek(0)
+        self.sha256 = digest.hexdigest()
+        self.sniffed_content_type = self.content_type = sniff_content_type(head, upload.name)
+
+    def temporary_file_path(self):
+        return self._path
+
+
+def claim(upload):
+    """把收齐的临时文件改名占用并返回文件对象；并发的重复 finalize 中只有一个能占用成功，
+    其余抛 FileNotFoundError。"""
+    done = upload.partial_path('.done')
+    os.rename(upload.partial_path(), done)
+    return CompletedUpload(done, upload)
+
+
+def unclaim(upload, completed, stored_name=None):
+    """生成附件失败时把临时文件改回原名，客户端可以再次 finalize。
+
+    stored_name 为已写入存储、但没有记录的文件：本地存储会直接移走临时文件，此时从存储取回；
+    否则存储中的只是副本，删除即可。
+    """
+    completed.close()
+    done = completed.temporary_file_path()
+    if stored_name:
+        storage = Attachment._meta.get_field('file').storage
+        if not os.path.exists(done):
+            try:
+                os.replace(storage.path(stored_name), done)
+            except NotImplementedError:
+                with storage.open(stored_name, 'rb') as src, open(done, 'wb') as out:
+                    shutil.copyfileobj(src, out, UPLOAD_CHUNK_SIZE)
+        storage.delete(stored_name)
+    try:
+        os.rename(done, upload.partial_path())
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,127 @@
+"""带 HMAC 签名、会过期的附件地址：页面渲染时为当前查看者能看到的附件签发，
+之后浏览器取文件只经过 signed_media_file 视图验签，不查数据库、不做权限判断。
+
+- 地址形如 /m/<kid>.<expires>.<sig>/<存储文件名>?v=<版本>&d=inline&n=<下载名>&t=<类型>，
+  签名覆盖过期时间、文件名与这些参数（HMAC-SHA256 截取 128 位，URL 安全的 base64）。
+- 存储文件名在删除后可能被新上传的文件复用，签名因此还绑定附件版本 v（附件 id 与上传时间），
+  ETag 由 v 得出；本地存储中文件的修改时间晚于 v 中的上传时间时，说明该文件名已换成别的文件，不再提供。
+- 过期时间按 LL_SIGNED_URL_STEP_SECONDS 取整：同一时段内签出的地址相同，浏览器缓存与页面缓存可以复用；
+  地址至少在 LL_SIGNED_URL_TTL_SECONDS 内有效，应长于页面与片段缓存的时长。
+  页面 ETag 与整页缓存键包含当前时段（epoch），换时段后页面重新渲染。
+- 密钥轮换：LL_MEDIA_SIGNING_KEYS 为 [(kid, secret), ...]（kid 不含 '.'），第一个用于签发，全部可用于验证；
+  轮换时把新密钥放在最前，旧密钥保留到已签出的地址全部过期（TTL + STEP）后删除。
+  未配置时由 SECRET_KEY 与 SECRET_KEY_FALLBACKS 派生，随 Django 的密钥轮换一起轮换。
+- 只有图片、音视频等安全类型才允许 inline，其余一律作为附件下载，避免上传的 HTML 在本站同源打开。
+"""
+import base64
+import hashlib
+import hmac
+import os
+import time
+from functools import lru_cache
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.urls import reverse
+from django.utils.crypto import salted_hmac
+
+SIGNED_URL_TTL_SECONDS = getattr(settings, 'LL_SIGNED_URL_TTL_SECONDS', 3600)
+SIGNED_URL_STEP_SECONDS = getattr(settings, 'LL_SIGNED_URL_STEP_SECONDS', 3600)
+
+# 可以在本站同源内联显示的类型（不含 SVG：其中可以带脚本）
+_INLINE_PREFIXES = ('video/', 'audio/')
+_INLINE_IMAGES = frozenset(('image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/avif', 'image/bmp'))
+
+
+class SignatureError(ValueError):
+    pass
+
+
+def inline_safe(content_type):
+    ct = (content_type or '').split(';', 1)[0].strip().lower()
+    return ct in _INLINE_IMAGES or ct.startswith(_INLINE_PREFIXES)
+
+
+@lru_cache(maxsize=1)
+def _keys():
+    configured = getattr(settings, 'LL_MEDIA_SIGNING_KEYS', None)
+    if configured:
+        return tuple((str(kid), secret.encode() if isinstance(secret, str) else secret) for kid, secret in configured)
+    keys = []
+    for secret in [settings.SECRET_KEY, *getattr(settings, 'SECRET_KEY_FALLBACKS', ())]:
+        key = salted_hmac('learning_logs.signed_media', 'key', secret=secret, algorithm='sha256').digest()
+        keys.append((hashlib.sha256(key).hexdigest()[:8], key))
+    return tuple(keys)
+
+
+def epoch(now=None):
+    """当前签发时段；页面缓存以它区分新旧地址。"""
+    return int((time.time() if now is None else now) // SIGNED_URL_STEP_SECONDS)
+
+
+def _signature(key, expires, name, params):
+    msg = '\n'.join([str(expires), name, params.get('v', ''), params.get('d', ''), params.get('n', ''), params.get('t', '')])
+    digest = hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()[:16]
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def sign(name, *, version='', inline=False, download_name='', content_type='', now=None):
+    """存储文件名 -> 签名地址；version 见 attachment_version。"""
+    kid, key = _keys()[0]
+    expires = (epoch(now) + 1) * SIGNED_URL_STEP_SECONDS + SIGNED_URL_TTL_SECONDS
+    params = {}
+    if version:
+        params['v'] = version
+    if inline and inline_safe(content_type):
+        params['d'] = 'inline'
+    if download_name:
+        params['n'] = download_name
+    if content_type:
+        params['t'] = content_type
+    token = f'{kid}.{expires}.{_signature(key, expires, name, params)}'
+    url = reverse('learning_logs:signed_media_file', args=[token, name])
+    return f'{url}?{urlencode(params)}' if params else url
+
+
+def verify(token, name, params, now=None):
+    """校验签名与过期时间，返回剩余有效秒数；无效时抛 SignatureError。"""
+    try:
+        kid, expires, sig = token.split('.', 2)
+        expires = int(expires)
+    except ValueError:
+        raise SignatureError('malformed token')
+    key = dict(_keys()).get(kid)
+    if key is None:
+        raise SignatureError('unknown key')
+    if not hmac.compare_digest(sig.encode(), _signature(key, expires, name, params).encode()):
+        raise SignatureError('bad signature')
+    remaining = expires - int(time.time() if now is None else now)
+    if remaining <= 0:
+        raise SignatureError('expired')
+    return remaining
+
+
+def attachment_version(att):
+    """附件版本：'<id>.<上传时间（秒）>'，文件名被复用时随之不同。"""
+    return f'{att.pk}.{int(att.uploaded_at.timestamp())}' if att.uploaded_at else str(att.pk)
+
+
+def replaced(storage, name, version):
+    """本地存储中该文件名现在的文件是否晚于 version 对应的附件写入（即文件名已被复用）。
+
+    文件在记录插入前写入，原文件的修改时间不晚于上传时间；远程存储不检查。
+    """
+    _pk, _, uploaded = version.partition('.')
+    if not uploaded.isdigit() or not isinstance(storage, FileSystemStorage):
+        return False
+    try:
+        return int(os.stat(storage.path(name)).st_mtime) > int(uploaded)
+    except OSError:
+        return False
+
+
+def attachment_url(att, inline=False):
+    """为附件签发地址；调用方负责确认当前查看者可以看到该附件。"""
+    return sign(att.file.name, version=attachment_version(att), inline=inline,
+                download_name=att.original_name or '', content_type=att.content_type or '')
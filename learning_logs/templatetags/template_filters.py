@@ -9,6 +9,15 @@ def filename(value):
     return Path(value).name
 
 
+@register.filter(name='signed_url')
+def signed_url(attachment, mode=''):
+    """附件的签名地址（见 learning_logs.signed_media），mode='inline' 时图片与音视频可直接显示。
+    只应对当前查看者能看到的附件使用。
+    """
+    from learning_logs.signed_media import attachment_url
+    return attachment_url(attachment, inline=(mode == 'inline'))
+
+
 @register.filter(name='icon_for')
 def icon_for(filename: str) -> str:
     """根据文件扩展名返回合适的图标相对路径（用于 {% static %}）。
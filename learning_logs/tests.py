@@ -1,16 +1,69 @@
-from django.test import TestCase
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.core.files.storage import Storage
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.management import call_command
+from django.db import connection
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth import get_user_model
-from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.models import AnonymousUser
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from urllib.parse import quote, urlencode
+import hashlib
+import io
 import json
+import os
+import random
+import re
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
 
+from . import (accel, archives, context_processors as cp, folders, pagecache, relocate, resumable,
+               signed_media, upload_sessions, uploads, views, zipcache, zipstream)
+from .idempotency import IDEMPOTENCY_PENDING_SECONDS
+from .loaders import paginate_entries
+from .manifest import MAX_LINE_BYTES, ManifestError, iter_entries
+from .models import (Topic, Entry, Comment, Attachment, AttachmentFolder, ContentVersion,
+                     ResumableUpload, UploadReceipt, UploadSession)
+from .pagecache import BACKGROUND_PLACEHOLDER, CSRF_PLACEHOLDER
+from .ranges import file_response
+from .uploads import sniff_content_type
+from .views import _relative_path_lookup
+from .zipstream import iter_zip
+
+
+class TempMediaMixin:
+    """每个测试使用独立的临时目录作 MEDIA_ROOT，结束后删除。
+
+    temp_settings 把其他目录设置（如 LL_ZIP_CACHE_DIR）指向该临时目录下的子目录。
+    """
+    temp_settings = {}
 
-class AttachmentUploadTests(TestCase):
     def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp_dir = tmp.name
+        dirs = {'MEDIA_ROOT': tmp.name}
+        dirs.update({name: os.path.join(tmp.name, sub) for name, sub in self.temp_settings.items()})
+        media = override_settings(**dirs)
+        media.enable()
+        self.addCleanup(media.disable)
+
+
+class AttachmentUploadTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
         User = get_user_model()
         self.user = User.objects.create_user(username='tester', password='test')
         self.client.login(username='tester', password='test')
-        from .models import Topic
         self.topic = Topic.objects.create(owner=self.user, text='t')
 
     def test_upload_api_preserve_relative_path(self):
@@ -18,20 +71,19 @@ class AttachmentUploadTests(TestCase):
         f = SimpleUploadedFile('file.txt', content)
         rel_path = 'folder1/folder2/file.txt'
         rp_json = json.dumps([{"name": 'file.txt', "size": len(content), "path": rel_path}])
-        resp = self.client.post(reverse('learning_logs:upload_attachments_api'), {'parent_type': 'topic', 'parent_id': self.topic.id, 'relative_paths_json': rp_json}, files={'files': f})
+        resp = self.client.post(reverse('learning_logs:upload_attachments_api'), {'parent_type': 'topic', 'parent_id': self.topic.id, 'relative_paths_json': rp_json, 'files': f})
         self.assertEqual(resp.status_code, 200)
         data = resp.json()
         self.assertTrue(data.get('ok'))
         self.assertEqual(data['files'][0].get('relative_path'), rel_path)
 
     def test_upload_and_reassign_to_new_entry_preserves_path(self):
-        from .models import Attachment
         content = b'hello'
         f = SimpleUploadedFile('hello.txt', content)
         rel_path = 'a/b/hello.txt'
         rp_json = json.dumps([{"name": 'hello.txt', "size": len(content), "path": rel_path}])
         upload_session = 'sess12345'
-        resp = self.client.post(reverse('learning_logs:upload_attachments_api'), {'parent_type': 'topic', 'parent_id': self.topic.id, 'relative_paths_json': rp_json, 'upload_session': upload_session}, files={'files': f})
+        resp = self.client.post(reverse('learning_logs:upload_attachments_api'), {'parent_type': 'topic', 'parent_id': self.topic.id, 'relative_paths_json': rp_json, 'upload_session': upload_session, 'files': f})
         self.assertEqual(resp.status_code, 200)
         data = resp.json()
         self.assertTrue(data.get('ok'))
@@ -46,25 +98,17 @@ class AttachmentUploadTests(TestCase):
         self.assertEqual(att.relative_path, rel_path)
 
     def test_new_entry_form_uploads_with_relative_path(self):
-        from .models import Attachment
         content = b'hello2'
         f = SimpleUploadedFile('hello2.txt', content)
         rel_path = 'newfolder/sub/hello2.txt'
         rp_json = json.dumps([{"name": 'hello2.txt', "size": len(content), "path": rel_path}])
-        resp = self.client.post(reverse('learning_logs:new_entry', kwargs={'topic_id': self.topic.id}), {'title': 't', 'text': 'some', 'relative_paths_json': rp_json}, files={'attachments': f})
+        resp = self.client.post(reverse('learning_logs:new_entry', kwargs={'topic_id': self.topic.id}), {'title': 't', 'text': 'some', 'relative_paths_json': rp_json, 'attachments': f})
         self.assertIn(resp.status_code, (302, 301))
-        # Verify attachment exists and holds relative path
-        att = Attachment.objects.filter(topic=self.topic).order_by('-id').first()
+        # Verify attachment exists and holds relative path (form uploads attach to the new entry)
+        att = Attachment.objects.filter(entry__topic=self.topic).order_by('-id').first()
         self.assertIsNotNone(att)
         self.assertEqual(att.relative_path, rel_path)
-from django.test import TestCase
-from django.urls import reverse
-from django.contrib.auth import get_user_model
-from .models import Topic, Entry, Attachment
-from django.core.files.uploadedfile import SimpleUploadedFile
-
-
-class LearningLogsTests(TestCase):
+class LearningLogsTests(TempMediaMixin, TestCase):
 	def test_new_entry_with_async_topic_upload_reassigns_to_entry(self):
 		# Create user and topic
 		User = get_user_model()
@@ -76,7 +120,7 @@ class LearningLogsTests(TestCase):
 		file_content = b'Hello, world'
 		file = SimpleUploadedFile('hello.txt', file_content, content_type='text/plain')
 		upload_session_key = 'testsession123'
-		resp = self.client.post(reverse('learning_logs:upload_attachments_api'), {'parent_type': 'topic', 'parent_id': topic.id, 'upload_session': upload_session_key}, files={'files': file})
+		resp = self.client.post(reverse('learning_logs:upload_attachments_api'), {'parent_type': 'topic', 'parent_id': topic.id, 'upload_session': upload_session_key, 'files': file})
 		self.assertIn(resp.status_code, (200, 201))
 		data = resp.json()
 		self.assertTrue(data.get('ok'))
@@ -100,3 +144,1550 @@ class LearningLogsTests(TestCase):
 		self.assertIsNotNone(att.entry)
 		self.assertEqual(att.entry.topic, topic)
 
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class PageQueryCountTests(TestCase):
+    """topic / discovey / public_discovey 的查询次数不应随日记数量增长。"""
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='writer', password='pass')
+        self.other = User.objects.create_user(username='reader', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='公开本', is_public=True)
+
+    def _add_entries(self, n):
+        for i in range(n):
+            entry = Entry.objects.create(topic=self.topic, owner=self.user, text=f'text {i}', is_public=True)
+            Attachment.objects.create(owner=self.user, entry=entry, file=f'attachments/e{entry.id}/a.txt', original_name='a.txt', relative_path='docs/a.txt')
+            top = Comment.objects.create(entry=entry, user=self.other, text='top')
+            reply = Comment.objects.create(entry=entry, user=self.user, parent=top, text='reply')
+            Comment.objects.create(entry=entry, user=self.other, parent=reply, text='reply 2')
+            Attachment.objects.create(owner=self.other, comment=top, file=f'attachments/c{top.id}/b.png', original_name='b.png')
+
+    def _count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def _assert_flat(self, url):
+        self._add_entries(2)
+        small = self._count_queries(url)
+        self._add_entries(8)
+        large = self._count_queries(url)
+        self.assertEqual(small, large)
+
+    def test_topic_query_count_is_flat(self):
+        self.client.login(username='reader', password='pass')
+        self._assert_flat(reverse('learning_logs:topic_by_user', kwargs={'username': 'writer', 'topic_name': self.topic.text}))
+
+    def test_discovey_query_count_is_flat(self):
+        self.client.login(username='reader', password='pass')
+        self._assert_flat(reverse('learning_logs:discovey_by_user', kwargs={'username': 'writer', 'topic_name': self.topic.text}))
+
+    def test_public_discovey_query_count_is_flat(self):
+        self._assert_flat(reverse('learning_logs:discovey_home'))
+
+    def test_replies_rendered_from_prebuilt_structure(self):
+        self._add_entries(1)
+        resp = self.client.get(reverse('learning_logs:discovey_home'))
+        # 回复数统计整棵子树；第二层回复标注其回复对象
+        self.assertContains(resp, '展开回复 (2)')
+        self.assertContains(resp, '回复 @writer')
+        self.assertContains(resp, '<p>reply 2</p>', html=True)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class EntryPaginationTests(TestCase):
+    """日记流按 (date_added, id) 游标分页，并提供“加载更多”片段。"""
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='writer', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='长日记本', is_public=True)
+        self.entries = [Entry.objects.create(topic=self.topic, owner=self.user, text=f'第{i}篇', is_public=True) for i in range(7)]
+        # 时间戳相同的日记也必须按 id 稳定分页
+        Entry.objects.filter(id__in=[e.id for e in self.entries[2:5]]).update(date_added=self.entries[2].date_added)
+
+    def _ids(self, entries):
+        return [e.id for e in entries]
+
+    def test_pages_cover_all_entries_once(self):
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = paginate_entries(self.topic.entry_set.all(), cursor, page_size=3)
+            seen.extend(self._ids(page))
+            if not cursor:
+                break
+        expected = self._ids(Entry.objects.filter(topic=self.topic).order_by('-date_added', '-id'))
+        self.assertEqual(seen, expected)
+
+    def test_topic_page_is_limited_and_load_more_returns_next_cards(self):
+        url = reverse('learning_logs:discovey_home')
+        with mock.patch.object(views, 'ENTRY_PAGE_SIZE', 4):
+            resp = self.client.get(url)
+            self.assertEqual(len(resp.context['entries']), 4)
+            next_cursor = resp.context['next_cursor']
+            self.assertTrue(next_cursor)
+            self.assertContains(resp, 'll-load-more')
+            more = self.client.get(reverse('learning_logs:more_entries', kwargs={'topic_id': self.topic.id}), {'mode': 'public', 'cursor': next_cursor})
+        self.assertEqual(more.status_code, 200)
+        self.assertEqual(len(more.context['entries']), 3)
+        self.assertIsNone(more.context['next_cursor'])
+        self.assertNotContains(more, 'll-load-more')
+
+    def test_load_more_rejects_invalid_cursor(self):
+        resp = self.client.get(reverse('learning_logs:more_entries', kwargs={'topic_id': self.topic.id}), {'cursor': 'garbage'})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_load_more_hides_private_topic(self):
+        self.topic.is_public = False
+        self.topic.save()
+        resp = self.client.get(reverse('learning_logs:more_entries', kwargs={'topic_id': self.topic.id}))
+        self.assertEqual(resp.status_code, 404)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class CommentThreadTests(TestCase):
+    """评论回复树以物化路径保存：任意深度、单查询取整棵树、单语句删除子树。"""
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='writer', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='讨论', is_public=True)
+        self.entry = Entry.objects.create(topic=self.topic, owner=self.user, text='正文', is_public=True)
+
+    def _chain(self, depth, root=None):
+        parent = root
+        chain = []
+        for i in range(depth):
+            parent = Comment.objects.create(entry=self.entry, user=self.user, parent=parent, text=f'层{i}')
+            chain.append(parent)
+        return chain
+
+    def test_paths_order_thread_depth_first(self):
+        root = Comment.objects.create(entry=self.entry, user=self.user, text='root')
+        a = Comment.objects.create(entry=self.entry, user=self.user, parent=root, text='a')
+        b = Comment.objects.create(entry=self.entry, user=self.user, parent=root, text='b')
+        a1 = Comment.objects.create(entry=self.entry, user=self.user, parent=a, text='a1')
+        self.assertEqual(a1.depth, 2)
+        self.assertTrue(a1.path.startswith(a.path))
+        with self.assertNumQueries(1):
+            ids = [c.id for c in root.subtree()]
+        self.assertEqual(ids, [root.id, a.id, a1.id, b.id])
+        with self.assertNumQueries(1):
+            self.assertEqual(root.descendant_count(), 3)
+
+    def test_deep_thread_renders_every_level(self):
+        chain = self._chain(8)
+        resp = self.client.get(reverse('learning_logs:discovey_home'))
+        self.assertContains(resp, f'展开回复 ({len(chain) - 1})')
+        for c in chain:
+            self.assertContains(resp, f'<p>{c.text}</p>', html=True)
+
+    def test_delete_subtree_uses_single_comment_delete(self):
+        chain = self._chain(6)
+        sibling = Comment.objects.create(entry=self.entry, user=self.user, text='sibling')
+        Attachment.objects.create(owner=self.user, comment=chain[-1], file='attachments/misc/x.txt', original_name='x.txt')
+        self.client.login(username='writer', password='pass')
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.post(reverse('learning_logs:delete_comment', kwargs={'comment_id': chain[1].id}))
+        self.assertEqual(resp.status_code, 302)
+        comment_deletes = [q for q in ctx.captured_queries if q['sql'].startswith('DELETE FROM "learning_logs_comment"')]
+        self.assertEqual(len(comment_deletes), 1)
+        self.assertEqual(set(Comment.objects.values_list('id', flat=True)), {chain[0].id, sibling.id})
+        self.assertFalse(Attachment.objects.exists())
+
+
+class CounterTests(TestCase):
+    """Topic / Entry / Comment 上的冗余计数随评论与附件增删同步更新，recount 可修复偏差。"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(username='counter', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='计数', is_public=True)
+        self.entry = Entry.objects.create(topic=self.topic, owner=self.user, text='正文', is_public=True)
+
+    def _att(self, name, size, **parent):
+        return Attachment.objects.create(owner=self.user, file=f'attachments/misc/{name}', original_name=name,
+                                         relative_path=name, size=size, **parent)
+
+    def _counts(self, obj, *fields):
+        obj.refresh_from_db(fields=fields)
+        return tuple(getattr(obj, f) for f in fields)
+
+    def test_comment_counts_follow_create_and_subtree_delete(self):
+        root = Comment.objects.create(entry=self.entry, user=self.user, text='root')
+        a = Comment.objects.create(entry=self.entry, user=self.user, parent=root, text='a')
+        a1 = Comment.objects.create(entry=self.entry, user=self.user, parent=a, text='a1')
+        Comment.objects.create(entry=self.entry, user=self.user, parent=root, text='b')
+        self._att('c.txt', 5, comment=a1)
+        self.assertEqual(self._counts(self.entry, 'comment_count'), (4,))
+        self.assertEqual(self._counts(self.topic, 'comment_count'), (4,))
+        self.assertEqual(self._counts(root, 'reply_count'), (3,))
+        self.assertEqual(self._counts(a, 'reply_count'), (1,))
+        self.assertEqual(self._counts(a1, 'attachment_count'), (1,))
+
+        self.client.login(username='counter', password='pass')
+        self.client.post(reverse('learning_logs:delete_comment', kwargs={'comment_id': a.id}))
+        self.assertEqual(self._counts(self.entry, 'comment_count'), (2,))
+        self.assertEqual(self._counts(self.topic, 'comment_count'), (2,))
+        self.assertEqual(self._counts(root, 'reply_count'), (1,))
+
+    def test_attachment_counts_follow_single_and_folder_delete(self):
+        single = self._att('a.txt', 10, entry=self.entry)
+        for i in range(3):
+            self._att(f'dir/f{i}.txt', 100, entry=self.entry)
+        self.assertEqual(self._counts(self.entry, 'attachment_count', 'attachment_bytes'), (4, 310))
+
+        self.client.login(username='counter', password='pass')
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.post(reverse('learning_logs:delete_folder_api'), {
+                'parent_type': 'entry', 'parent_id': self.entry.id, 'folder_path': 'dir'})
+        self.assertEqual(resp.json()['deleted'], 3)
+        entry_updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "learning_logs_entry"')]
+        self.assertEqual(len(entry_updates), 1)
+        self.assertEqual(self._counts(self.entry, 'attachment_count', 'attachment_bytes'), (1, 10))
+
+        single.delete()
+        self.assertEqual(self._counts(self.entry, 'attachment_count', 'attachment_bytes'), (0, 0))
+
+    def test_recount_repairs_drift(self):
+        root = Comment.objects.create(entry=self.entry, user=self.user, text='root')
+        Comment.objects.create(entry=self.entry, user=self.user, parent=root, text='reply')
+        self._att('t.txt', 7, topic=self.topic)
+        Topic.objects.update(comment_count=99, attachment_count=0, attachment_bytes=0)
+        Entry.objects.update(comment_count=0)
+        Comment.objects.update(reply_count=5)
+
+        out = StringIO()
+        call_command('recount', batch_size=1, stdout=out)
+        self.assertIn('Topic: checked 1, fixed 1', out.getvalue())
+        self.assertEqual(self._counts(self.topic, 'comment_count', 'attachment_count', 'attachment_bytes'), (2, 1, 7))
+        self.assertEqual(self._counts(self.entry, 'comment_count'), (2,))
+        self.assertEqual(self._counts(root, 'reply_count'), (1,))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class FolderIndexTests(TempMediaMixin, TestCase):
+    """文件夹索引随上传、删除同步维护；展开文件夹只读取直接子项。"""
+
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='folders', password='pass')
+        self.client.login(username='folders', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='目录')
+        self.entry = Entry.objects.create(topic=self.topic, owner=self.user, text='正文')
+
+    def _upload(self, paths):
+        data = {'parent_type': 'entry', 'parent_id': self.entry.id,
+                'files': [SimpleUploadedFile(p.split('/')[-1], b'x' * 10) for p in paths]}
+        for i, p in enumerate(paths):
+            data[f'relative_path[{i}]'] = p
+        resp = self.client.post(reverse('learning_logs:upload_attachments_api'), data)
+        self.assertEqual(resp.status_code, 200)
+        return resp
+
+    def _list(self, folder_path=''):
+        return self.client.post(reverse('learning_logs:list_folder_api'), {
+            'parent_type': 'entry', 'parent_id': self.entry.id, 'folder_path': folder_path}).json()
+
+    def test_listing_get_revalidates_with_etag(self):
+        self._upload(['a/1.txt'])
+        url = reverse('learning_logs:list_folder_api')
+        params = {'parent_type': 'entry', 'parent_id': self.entry.id, 'folder_path': 'a'}
+        resp = self.client.get(url, params)
+        self.assertEqual([f['name'] for f in resp.json()['files']], ['1.txt'])
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=resp['ETag']).status_code, 304)
+
+        self._upload(['a/2.txt'])
+        resp = self.client.get(url, params, HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json()['files']), 2)
+
+    def test_upload_builds_index_and_listing_reads_children_only(self):
+        self._upload(['root.txt', 'a/1.txt', 'a/2.txt', 'a/b/3.txt', 'a/b/c/4.txt'])
+        a = AttachmentFolder.objects.get(entry=self.entry, path='a')
+        self.assertEqual((a.file_count, a.folder_count, a.total_files, a.total_bytes), (2, 1, 4, 40))
+        self.assertEqual(AttachmentFolder.objects.get(entry=self.entry, path='a/b/c').parent.path, 'a/b')
+
+        data = self._list('a')
+        self.assertEqual(sorted(f['name'] for f in data['files']), ['1.txt', '2.txt'])
+        self.assertEqual(data['folders'], [{'name': 'b', 'path': 'a/b', 'files': 2, 'bytes': 20}])
+        self.assertEqual([f['name'] for f in self._list('')['files']], ['root.txt'])
+
+        with CaptureQueriesContext(connection) as small:
+            self._list('a')
+        self._upload([f'a/b/c/bulk{i}.txt' for i in range(30)])
+        with CaptureQueriesContext(connection) as large:
+            self._list('a')
+        self.assertEqual(len(small), len(large))
+
+        resp = self.client.get(reverse('learning_logs:topic', kwargs={'topic_name': self.topic.text}))
+        self.assertContains(resp, '34 个文件')
+
+    def test_page_renders_only_first_level_of_tree(self):
+        self._upload(['top.txt'] + [f'big/deep/f{i}.txt' for i in range(30)])
+        resp = self.client.get(reverse('learning_logs:topic', kwargs={'topic_name': self.topic.text}))
+        self.assertContains(resp, 'top.txt')
+        self.assertContains(resp, 'data-folder-path="big"')
+        self.assertContains(resp, '30 个文件')
+        # 子目录内容由前端展开时再取
+        self.assertNotContains(resp, 'f0.txt')
+        self.assertNotContains(resp, 'data-folder-path="big/deep"')
+
+    def test_entry_upload_ignores_upload_session(self):
+        resp = self.client.post(reverse('learning_logs:upload_attachments_api'), {
+            'parent_type': 'entry', 'parent_id': self.entry.id, 'upload_session': 'sess1',
+            'files': [SimpleUploadedFile('s.txt', b'abc')], 'relative_path[0]': 'd/s.txt'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsNone(Attachment.objects.get().upload_session)
+        self.assertEqual(AttachmentFolder.objects.get(entry=self.entry).total_files, 1)
+
+    def test_deletes_update_and_prune_index(self):
+        self._upload(['a/1.txt', 'a/b/2.txt', 'a/b/3.txt'])
+        resp = self.client.post(reverse('learning_logs:delete_folder_api'), {
+            'parent_type': 'entry', 'parent_id': self.entry.id, 'folder_path': 'a/b'})
+        self.assertEqual(resp.json()['deleted'], 2)
+        a = AttachmentFolder.objects.get(entry=self.entry, path='a')
+        self.assertEqual((a.file_count, a.folder_count, a.total_files), (1, 0, 1))
+        self.assertFalse(AttachmentFolder.objects.filter(path='a/b').exists())
+
+        Attachment.objects.get(relative_path='a/1.txt').delete()
+        self.assertFalse(AttachmentFolder.objects.exists())
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class EntryCardCacheTests(TestCase):
+    """日记卡片片段缓存：render_version 随日记 / 评论 / 附件变化递增，按查看者角色共享。"""
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.owner = User.objects.create_user(username='author', password='pass')
+        self.reader = User.objects.create_user(username='reader', password='pass')
+        self.topic = Topic.objects.create(owner=self.owner, text='缓存', is_public=True)
+        self.entry = Entry.objects.create(topic=self.topic, owner=self.owner, text='初稿', is_public=True)
+        self.url = reverse('learning_logs:topic_by_user', kwargs={'username': 'author', 'topic_name': '缓存'})
+
+    def test_card_is_reused_until_version_bumps(self):
+        self.assertContains(self.client.get(self.url), '初稿')
+        # 绕过信号直接改库：版本未变，仍命中缓存
+        Entry.objects.filter(pk=self.entry.pk).update(text='绕过')
+        self.assertContains(self.client.get(self.url), '初稿')
+
+        Comment.objects.create(entry=self.entry, user=self.reader, text='新评论')
+        resp = self.client.get(self.url)
+        self.assertContains(resp, '绕过')
+        self.assertContains(resp, '新评论')
+
+        self.entry.refresh_from_db()
+        self.entry.text = '定稿'
+        self.entry.save()
+        self.assertContains(self.client.get(self.url), '定稿')
+
+    def test_viewer_dependent_parts_are_not_shared(self):
+        Comment.objects.create(entry=self.entry, user=self.reader, text='我的评论')
+        self.client.login(username='author', password='pass')
+        self.assertContains(self.client.get(self.url), '编辑日记')
+        self.client.logout()
+        resp = self.client.get(self.url)
+        self.assertNotContains(resp, '编辑日记')
+        self.assertNotContains(resp, 'delete-comment')
+        self.client.login(username='reader', password='pass')
+        resp = self.client.get(self.url)
+        self.assertNotContains(resp, '编辑日记')
+        self.assertContains(resp, 'delete-comment')
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class PublicPageCacheTests(TestCase):
+    """匿名访客与 traveler 的发现页整页缓存：精确失效、占位符替换与冷键单次渲染。"""
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='writer', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='公开', is_public=True)
+        self.entry = Entry.objects.create(topic=self.topic, owner=self.user, text='第一篇', is_public=True)
+        self.url = reverse('learning_logs:discovey_home')
+
+    def test_hit_costs_one_query_and_fills_placeholders(self):
+        self.assertContains(self.client.get(self.url), '第一篇')
+        with self.assertNumQueries(1):
+            resp = self.client.get(self.url)
+        self.assertContains(resp, '第一篇')
+        self.assertNotContains(resp, BACKGROUND_PLACEHOLDER)
+        self.assertContains(resp, '/static/img/backgrounds/')
+
+    def test_public_changes_invalidate_private_changes_do_not(self):
+        self.client.get(self.url)
+        private = Topic.objects.create(owner=self.user, text='私密')
+        version = ContentVersion.objects.get(name='public').value
+        Entry.objects.create(topic=private, owner=self.user, text='私密日记')
+        self.assertEqual(ContentVersion.objects.get(name='public').value, version)
+
+        Comment.objects.create(entry=self.entry, user=self.user, text='新的评论')
+        self.assertGreater(ContentVersion.objects.get(name='public').value, version)
+        self.assertContains(self.client.get(self.url), '新的评论')
+
+    def test_public_entry_in_private_topic_invalidates(self):
+        private = Topic.objects.create(owner=self.user, text='私密')
+        shared = Entry.objects.create(topic=private, owner=self.user, text='公开的一篇', is_public=True)
+        url = reverse('learning_logs:discovey_by_user', kwargs={'username': 'writer', 'topic_name': '私密'})
+        self.assertContains(self.client.get(url), '公开的一篇')
+        version = ContentVersion.objects.get(name='public').value
+        Comment.objects.create(entry=shared, user=self.user, text='私密日记本里的评论')
+        self.assertGreater(ContentVersion.objects.get(name='public').value, version)
+        self.assertContains(self.client.get(url), '私密日记本里的评论')
+        # 改为私密后不再出现在缓存的页面中
+        shared.is_public = False
+        shared.save()
+        self.assertNotContains(self.client.get(url), '公开的一篇')
+        # 私密日记本中私密日记的修改不影响公开页面缓存
+        version = ContentVersion.objects.get(name='public').value
+        shared.text = '仍是私密'
+        shared.save()
+        self.assertEqual(ContentVersion.objects.get(name='public').value, version)
+
+    def test_traveler_page_gets_fresh_csrf_token(self):
+        self.client.get(reverse('learning_logs:start_traveler'))
+        url = reverse('learning_logs:discovey_by_user', kwargs={'username': 'writer', 'topic_name': '公开'})
+        self.client.get(url)
+        resp = self.client.get(url)
+        self.assertContains(resp, 'csrfmiddlewaretoken')
+        self.assertNotContains(resp, CSRF_PLACEHOLDER)
+        self.assertContains(resp, '你好，traveler')
+
+    def test_waits_for_concurrent_render_instead_of_rendering(self):
+        request = RequestFactory().get(self.url)
+        request.user = AnonymousUser()
+        key = pagecache._page_key('anon', request)
+        cache.add(key + ':lock', 1, 30)
+        timer = threading.Timer(0.1, cache.set, (key, ('text/html; charset=utf-8', '<p>由另一个请求渲染</p>'), 60))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        with mock.patch('learning_logs.views.render', side_effect=AssertionError('rendered twice')):
+            resp = self.client.get(self.url)
+        self.assertContains(resp, '由另一个请求渲染')
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ConditionalResponseTests(TestCase):
+    """页面带 ETag；内容未变化时 If-None-Match 得到 304，任何相关变化都会换新 ETag。"""
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='writer', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='公开', is_public=True)
+        self.entry = Entry.objects.create(topic=self.topic, owner=self.user, text='第一篇', is_public=True)
+
+    def _revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_topic_page_not_modified_until_content_changes(self):
+        self.client.login(username='writer', password='pass')
+        url = reverse('learning_logs:topic', kwargs={'topic_name': '公开'})
+        etag = self.client.get(url)['ETag']
+        with self.assertTemplateNotUsed('learning_logs/topic.html'):
+            self.assertEqual(self._revalidate(url, etag).status_code, 304)
+
+        Comment.objects.create(entry=self.entry, user=self.user, text='新评论')
+        resp = self._revalidate(url, etag)
+        self.assertContains(resp, '新评论')
+        self.assertNotEqual(resp['ETag'], etag)
+
+    def test_etag_depends_on_viewer(self):
+        User = get_user_model()
+        User.objects.create_user(username='reader', password='pass')
+        url = reverse('learning_logs:discovey', kwargs={'topic_name': '公开'})
+        self.client.login(username='writer', password='pass')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self._revalidate(url, etag).status_code, 304)
+        self.client.login(username='reader', password='pass')
+        self.assertEqual(self._revalidate(url, etag).status_code, 200)
+
+    def test_private_edits_keep_anonymous_discovery_etag(self):
+        url = reverse('learning_logs:discovey_home')
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(self._revalidate(url, etag).status_code, 304)
+
+        private = Topic.objects.create(owner=self.user, text='私密')
+        Entry.objects.create(topic=private, owner=self.user, text='私密日记')
+        self.assertEqual(self._revalidate(url, etag).status_code, 304)
+        self.entry.text = '改过的第一篇'
+        self.entry.save()
+        self.assertContains(self._revalidate(url, etag), '改过的第一篇')
+
+
+class ContextProcessorCacheTests(TestCase):
+    """背景图 / 背景视频的静态文件查找在进程内缓存，静态文件设置变化时失效。"""
+
+    def test_static_lookups_are_memoized(self):
+        request = RequestFactory().get('/topics/')
+        request.user = AnonymousUser()
+        with override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+            with mock.patch.object(cp.finders, 'find', wraps=cp.finders.find) as find:
+                for _ in range(3):
+                    cp.background_video(request)
+                    self.assertIn('/static/img/backgrounds/', cp.background_image(request)['background_image_url'])
+                self.assertLessEqual(find.call_count, 2)
+            with override_settings(STATIC_URL='/assets/'):
+                self.assertIn('/assets/img/backgrounds/', cp.background_image(request)['background_image_url'])
+
+
+class SpooledUploadHandlerTests(TempMediaMixin, TestCase):
+    """上传按块接收：超出内存预算的文件落盘；摘要与类型在接收时算出并写入附件。"""
+
+    def _receive(self, handler, name, data, chunk=4):
+        handler.new_file('files', name, 'application/octet-stream', len(data))
+        for start in range(0, len(data), chunk):
+            handler.receive_data_chunk(data[start:start + chunk], start)
+        return handler.file_complete(len(data))
+
+    def test_budgets_spill_to_disk_and_are_returned(self):
+        baseline = uploads.worker_memory_in_use()
+        handler = uploads.SpooledUploadHandler()
+        with mock.patch.object(uploads, 'REQUEST_MEMORY_BUDGET', 12):
+            small = self._receive(handler, 'a.txt', b'x' * 8)
+            big = self._receive(handler, 'b.txt', b'y' * 8)
+        self.addCleanup(big.close)
+        self.assertNotIsInstance(small, TemporaryUploadedFile)
+        self.assertIsInstance(big, TemporaryUploadedFile)
+        self.assertEqual(big.read(), b'y' * 8)
+        self.assertEqual((big.size, big.sha256), (8, hashlib.sha256(b'y' * 8).hexdigest()))
+        self.assertEqual(uploads.worker_memory_in_use() - baseline, 8)
+        small.close()
+        self.assertEqual(uploads.worker_memory_in_use(), baseline)
+
+    def test_sniffs_extensionless_files(self):
+        self.assertEqual(sniff_content_type(b'\x89PNG\r\n\x1a\n....', 'scan'), 'image/png')
+        self.assertEqual(sniff_content_type(b'\x89PNG\r\n\x1a\n....', 'scan.jpg'), 'image/jpeg')
+        self.assertEqual(sniff_content_type('你好'.encode('utf-8'), 'README'), 'text/plain')
+        self.assertEqual(sniff_content_type(b'\x00\x01', 'blob'), 'application/octet-stream')
+
+    def test_upload_records_digest_and_type(self):
+        User = get_user_model()
+        user = User.objects.create_user(username='up', password='pass')
+        topic = Topic.objects.create(owner=user, text='上传')
+        self.client.login(username='up', password='pass')
+        png = b'\x89PNG\r\n\x1a\n' + b'\x00' * 32
+        resp = self.client.post(reverse('learning_logs:upload_attachments_api'), {
+            'parent_type': 'topic', 'parent_id': topic.id,
+            'files': [SimpleUploadedFile('scan', png)]})
+        self.assertEqual(resp.status_code, 200)
+        att = Attachment.objects.get()
+        self.assertEqual((att.size, att.content_type), (len(png), 'image/png'))
+        self.assertEqual(att.sha256, hashlib.sha256(png).hexdigest())
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ResumableUploadTests(TempMediaMixin, TestCase):
+    """可续传上传：按区间追加、查询 offset、错位返回 409、收齐后生成附件，失败可重试，过期记录连同临时文件清理。"""
+
+    temp_settings = {'MEDIA_ROOT': 'media', 'LL_RESUMABLE_UPLOAD_DIR': 'partial'}
+
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='big', password='pass')
+        self.client.login(username='big', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='视频')
+        self.entry = Entry.objects.create(topic=self.topic, owner=self.user, text='正文')
+
+    def _create(self, size, **extra):
+        resp = self.client.post(reverse('learning_logs:resumable_create'), {
+            'parent_type': 'entry', 'parent_id': self.entry.id, 'name': 'clip.mp4', 'size': size, **extra})
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()['token']
+
+    def _put(self, token, data, start, total):
+        return self.client.put(reverse('learning_logs:resumable_upload', args=[token]), data,
+                               content_type='application/octet-stream',
+                               HTTP_CONTENT_RANGE=f'bytes {start}-{start + len(data) - 1}/{total}')
+
+    def test_ranges_resume_and_finalize(self):
+        payload = bytes(range(256)) * 40
+        token = self._create(len(payload), relative_path='videos/clip.mp4')
+        url = reverse('learning_logs:resumable_upload', args=[token])
+
+        self.assertEqual(self._put(token, payload[:4000], 0, len(payload)).json()['offset'], 4000)
+        # 重试已收到的区间：409 并告知当前 offset
+        resp = self._put(token, payload[:4000], 0, len(payload))
+        self.assertEqual((resp.status_code, resp.json()['offset']), (409, 4000))
+        self.assertEqual(self.client.get(url).json()['offset'], 4000)
+        finalize = reverse('learning_logs:resumable_finalize', args=[token])
+        self.assertEqual(self.client.post(finalize).status_code, 409)
+
+        self._put(token, payload[4000:], 4000, len(payload))
+        resp = self.client.post(finalize)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['files'][0]['relative_path'], 'videos/clip.mp4')
+
+        att = Attachment.objects.get()
+        self.assertEqual((att.entry_id, att.size, att.content_type), (self.entry.id, len(payload), 'video/mp4'))
+        self.assertEqual(att.sha256, hashlib.sha256(payload).hexdigest())
+        with att.file.open('rb') as fh:
+            self.assertEqual(fh.read(), payload)
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.attachment_count, 1)
+        self.assertFalse(ResumableUpload.objects.exists())
+        self.assertEqual(self.client.post(finalize).status_code, 404)
+
+    def test_failed_finalize_keeps_file_for_retry(self):
+        payload = os.urandom(5000)
+        token = self._create(len(payload))
+        self._put(token, payload, 0, len(payload))
+        finalize = reverse('learning_logs:resumable_finalize', args=[token])
+        # 临时文件已移入存储后插入记录失败：文件取回原处，存储中不留孤儿
+        with mock.patch.object(Attachment.objects, 'bulk_create', side_effect=RuntimeError):
+            self.assertEqual(self.client.post(finalize).status_code, 500)
+        upload = ResumableUpload.objects.get(token=token)
+        with open(upload.partial_path(), 'rb') as fh:
+            self.assertEqual(fh.read(), payload)
+        self.assertEqual([f for _, _, files in os.walk(os.path.join(self.tmp_dir, 'media')) for f in files], [])
+        resp = self.client.post(finalize)
+        self.assertEqual(resp.status_code, 200)
+        with Attachment.objects.get().file.open('rb') as fh:
+            self.assertEqual(fh.read(), payload)
+
+    def test_expired_upload_cannot_be_finalized(self):
+        token = self._create(3)
+        self._put(token, b'abc', 0, 3)
+        ResumableUpload.objects.update(expires_at=timezone.now())
+        finalize = reverse('learning_logs:resumable_finalize', args=[token])
+        self.assertEqual(self.client.post(finalize).status_code, 410)
+        self.assertFalse(Attachment.objects.exists())
+
+    def test_expired_uploads_are_purged_with_their_files(self):
+        token = self._create(10)
+        upload = ResumableUpload.objects.get(token=token)
+        self.assertTrue(upload.partial_path().exists())
+        ResumableUpload.objects.update(expires_at=timezone.now())
+        self.assertEqual(self._put(token, b'x' * 10, 0, 10).status_code, 404)
+        self.assertEqual(resumable.purge_expired(), 1)
+        self.assertFalse(upload.partial_path().exists())
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class UploadSessionTests(TempMediaMixin, TestCase):
+    """异步上传会话：分块累计进度、按 key 一条 UPDATE 转挂到新日记、过期会话连同附件清理。"""
+
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='sess', password='pass')
+        self.client.login(username='sess', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='相册')
+
+    def _open(self, **extra):
+        resp = self.client.post(reverse('learning_logs:upload_session_open'), {
+            'parent_type': 'topic', 'parent_id': self.topic.id, **extra})
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    def _upload(self, key, *files, paths=None):
+        data = {'parent_type': 'topic', 'parent_id': self.topic.id, 'upload_session': key,
+                'files': [SimpleUploadedFile(name, content) for name, content in files]}
+        for i, path in enumerate(paths or ()):
+            data[f'relative_path[{i}]'] = path
+        return self.client.post(reverse('learning_logs:upload_attachments_api'), data)
+
+    def test_chunks_accumulate_progress(self):
+        key = self._open(files=3, bytes=9)['key']
+        self.assertEqual(self._upload(key, ('a.txt', b'aaa'), ('b.txt', b'bbb')).status_code, 200)
+        state = self.client.get(reverse('learning_logs:upload_session_state', args=[key])).json()
+        self.assertEqual((state['received_files'], state['received_bytes'], state['complete']), (2, 6, False))
+        self._upload(key, ('c.txt', b'ccc'))
+        state = self.client.get(reverse('learning_logs:upload_session_state', args=[key])).json()
+        self.assertEqual((state['received_files'], state['received_bytes'], state['complete']), (3, 9, True))
+        # 同一页面再次选择文件：在原会话上累加预期
+        self.assertEqual(self._open(key=key, files=1, bytes=1)['expected_files'], 4)
+
+    def test_session_key_of_another_user_is_rejected(self):
+        key = self._open(files=1, bytes=1)['key']
+        other = get_user_model().objects.create_user(username='other', password='pass')
+        public = Topic.objects.create(owner=other, text='公开', is_public=True)
+        self.client.login(username='other', password='pass')
+        resp = self.client.post(reverse('learning_logs:upload_attachments_api'), {
+            'parent_type': 'topic', 'parent_id': public.id, 'upload_session': key,
+            'files': [SimpleUploadedFile('x.txt', b'x')]})
+        self.assertEqual(resp.status_code, 400)
+        # 打开时撞上他人的 key 会换一个新的
+        resp = self.client.post(reverse('learning_logs:upload_session_open'), {
+            'parent_type': 'topic', 'parent_id': public.id, 'key': key})
+        self.assertNotEqual(resp.json()['key'], key)
+
+    def test_unopened_key_is_kept_but_never_purged(self):
+        # 旧页面未打开会话就带上 key：不补建会话，附件等待转挂
+        self.assertEqual(self._upload('s-legacy', ('a.txt', b'aa')).status_code, 200)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(Attachment.objects.get().upload_session, 's-legacy')
+        # 其他会话过期清理时不波及没有打开过会话的附件
+        key = self._open(files=1, bytes=1)['key']
+        self._upload(key, ('b.txt', b'b'))
+        UploadSession.objects.update(expires_at=timezone.now())
+        self.assertEqual(upload_sessions.purge_expired(), 1)
+        self.assertEqual(list(Attachment.objects.values_list('upload_session', flat=True)), ['s-legacy'])
+        resp = self.client.post(reverse('learning_logs:new_entry', kwargs={'topic_id': self.topic.id}),
+                                {'title': 't', 'text': '', 'upload_session': 's-legacy'})
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(Attachment.objects.get().entry, Entry.objects.get(topic=self.topic))
+
+    def test_only_new_entry_page_stages_uploads(self):
+        resp = self.client.get(reverse('learning_logs:new_entry', kwargs={'topic_id': self.topic.id}))
+        self.assertContains(resp, 'data-upload-staging')
+        resp = self.client.get(reverse('learning_logs:topic_by_user', args=[self.user.username, self.topic.text]))
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotContains(resp, 'data-upload-staging')
+
+    def test_new_entry_finalizes_session_in_one_update(self):
+        key = self._open(files=2, bytes=4)['key']
+        self._upload(key, ('a.txt', b'aa'), ('b.txt', b'bb'), paths=['pics/a.txt', 'pics/b.txt'])
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.post(reverse('learning_logs:new_entry', kwargs={'topic_id': self.topic.id}),
+                                    {'title': 't', 'text': '', 'upload_session': key})
+        self.assertEqual(resp.status_code, 302)
+        updates = [q['sql'] for q in ctx.captured_queries
+                   if q['sql'].startswith('UPDATE "learning_logs_attachment"')]
+        self.assertEqual(len(updates), 1)
+        entry = Entry.objects.get(topic=self.topic)
+        self.assertEqual(Attachment.objects.filter(entry=entry, upload_session__isnull=True).count(), 2)
+        self.assertEqual((entry.attachment_count, entry.attachment_bytes), (2, 4))
+        self.assertEqual(AttachmentFolder.objects.get(entry=entry, path='pics').total_files, 2)
+        self.assertEqual(AttachmentFolder.objects.get(topic=self.topic, path='pics').total_files, 2)
+        self.assertFalse(UploadSession.objects.filter(key=key).exists())
+
+    def test_files_are_relocated_to_entry_after_commit(self):
+        key = self._open(files=1, bytes=2)['key']
+        self._upload(key, ('a.txt', b'aa'), paths=['pics/a.txt'])
+        old = Attachment.objects.get().file.name
+        self.assertTrue(old.startswith(f'attachments/topics/{self.topic.id}/pics/'))
+        storage = Attachment.objects.get().file.storage
+        os.utime(storage.path(old), (1_600_000_000, 1_600_000_000))
+        with mock.patch.object(relocate, 'RELOCATE_IN_BACKGROUND', False), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('learning_logs:new_entry', kwargs={'topic_id': self.topic.id}),
+                             {'title': 't', 'text': '', 'upload_session': key})
+        entry = Entry.objects.get(topic=self.topic)
+        att = Attachment.objects.get()
+        self.assertTrue(att.file.name.startswith(f'attachments/entries/{entry.id}/pics/'))
+        self.assertFalse(att.file.storage.exists(old))
+        with att.file.open('rb') as fh:
+            self.assertEqual(fh.read(), b'aa')
+        # 副本沿用原文件的修改时间（签名地址据此判断文件名是否被复用）
+        self.assertEqual(int(os.stat(storage.path(att.file.name)).st_mtime), 1_600_000_000)
+        self.assertFalse(relocate.pending().exists())
+
+    def test_relocation_discards_copy_if_attachment_changed_meanwhile(self):
+        key = self._open(files=1, bytes=2)['key']
+        self._upload(key, ('a.txt', b'aa'))
+        entry = Entry.objects.create(topic=self.topic, owner=self.user, text='e')
+        Attachment.objects.update(entry=entry, upload_session=None)
+        old = Attachment.objects.get().file.name
+        real_save = Storage.save
+
+        def racing_save(storage, name, content, *args, **kwargs):
+            # 复制期间附件已被别处搬迁
+            Attachment.objects.update(file='attachments/elsewhere.txt')
+            return real_save(storage, name, content, *args, **kwargs)
+        with mock.patch.object(Storage, 'save', racing_save):
+            self.assertEqual(relocate.relocate(relocate.pending(Attachment.objects.filter(file=old))), 0)
+        storage = Attachment.objects.get().file.storage
+        self.assertTrue(storage.exists(old))
+        self.assertEqual(storage.listdir(f'attachments/entries/{entry.id}')[1], [])
+
+    def test_expired_session_is_purged_with_its_attachments(self):
+        key = self._open(files=1, bytes=2)['key']
+        self._upload(key, ('a.txt', b'aa'))
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.attachment_count, 1)
+        UploadSession.objects.update(expires_at=timezone.now())
+        self.assertEqual(upload_sessions.purge_expired(), 1)
+        self.assertFalse(Attachment.objects.exists())
+        self.topic.refresh_from_db()
+        self.assertEqual((self.topic.attachment_count, self.topic.attachment_bytes), (0, 0))
+
+    def test_folder_created_concurrently_is_reused(self):
+        entry = Entry.objects.create(topic=self.topic, owner=self.user, text='x')
+        existing = AttachmentFolder.objects.create(entry=entry, path='a', name='a')
+        real_filter = AttachmentFolder.objects.filter
+        calls = []
+
+        def stale_filter(*args, **kwargs):
+            # 第一次查询模拟另一个请求尚未提交时的快照
+            calls.append(1)
+            return AttachmentFolder.objects.none() if len(calls) == 1 else real_filter(*args, **kwargs)
+
+        with mock.patch.object(AttachmentFolder.objects, 'filter', side_effect=stale_filter):
+            folders._ensure_folders({('entry', entry.id, 'a'), ('entry', entry.id, 'a/b')})
+        self.assertEqual(AttachmentFolder.objects.get(entry=entry, path='a/b').parent_id, existing.id)
+        existing.refresh_from_db()
+        self.assertEqual(existing.folder_count, 1)
+
+
+class BulkIngestTests(TempMediaMixin, TestCase):
+    """批量导入：全部记录一条 INSERT 写入，计数与文件夹索引一次更新；单个文件存储失败时逐个报告。"""
+
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='bulk', password='pass')
+        self.client.login(username='bulk', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='导入')
+        self.entry = Entry.objects.create(topic=self.topic, owner=self.user, text='正文')
+
+    def _post(self, n):
+        data = {'parent_type': 'entry', 'parent_id': self.entry.id,
+                'files': [SimpleUploadedFile(f'f{i}.txt', b'x' * (i + 1)) for i in range(n)]}
+        for i in range(n):
+            data[f'relative_path[{i}]'] = f'dir/f{i}.txt'
+        return self.client.post(reverse('learning_logs:upload_attachments_api'), data)
+
+    def test_batch_is_inserted_in_one_statement(self):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self._post(20)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json()['files']), 20)
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "learning_logs_attachment"')]
+        self.assertEqual(len(inserts), 1)
+        self.entry.refresh_from_db()
+        self.assertEqual((self.entry.attachment_count, self.entry.attachment_bytes), (20, sum(range(1, 21))))
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.attachment_count, 0)
+        self.assertEqual(AttachmentFolder.objects.get(entry=self.entry, path='dir').file_count, 20)
+        att = Attachment.objects.get(original_name='f3.txt')
+        self.assertEqual((att.size, att.content_type, att.relative_path), (4, 'text/plain', 'dir/f3.txt'))
+        self.assertTrue(att.file.storage.exists(att.file.name))
+
+    def test_storage_failure_is_reported_per_file(self):
+        real_save = Storage.save
+
+        def flaky_save(storage, name, content, max_length=None):
+            if name.endswith('f1.txt'):
+                raise OSError('disk full')
+            return real_save(storage, name, content, max_length=max_length)
+
+        with mock.patch.object(Storage, 'save', flaky_save):
+            resp = self._post(3)
+        data = resp.json()
+        self.assertEqual(sorted(f['name'] for f in data['files']), ['f0.txt', 'f2.txt'])
+        self.assertEqual(data['failed'], [{'index': 1, 'name': 'f1.txt', 'error': 'storage error'}])
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.attachment_count, 2)
+
+
+def _scan_relative_path(idx, name, size, relative_paths, relative_meta):
+    """以往 _save_attachments_from_request 逐个扫描的匹配逻辑，作为对照。"""
+    rel_map, meta_map = {}, {}
+    for k, rp in (relative_paths or {}).items():
+        try:
+            rel_map[int(k)] = rp
+        except Exception:
+            rel_map[str(k)] = rp
+    for k, v in (relative_meta or {}).items():
+        meta_map[str(k)] = v
+    rp_raw = None
+    if idx in rel_map:
+        rp_raw = rel_map[idx]
+    if not rp_raw and rel_map:
+        for v in rel_map.values():
+            try:
+                if not isinstance(v, str):
+                    continue
+                if v.endswith('/' + name) or v.endswith('\\' + name) or v == name:
+                    rp_raw = v
+                    break
+            except Exception:
+                continue
+    if not rp_raw and meta_map:
+        for k, v in meta_map.items():
+            try:
+                if k.split('|', 2)[0] == name and str(k.split('|', 2)[1]) == str(size):
+                    rp_raw = v
+                    break
+            except Exception:
+                continue
+    return rp_raw
+
+
+class RelativePathLookupTests(TestCase):
+    """相对路径索引：随机生成的路径表上与逐个扫描的结果一致。"""
+
+    def test_matches_linear_scan(self):
+        rnd = random.Random(20261017)
+        names = ['a.txt', 'b.txt', 'a', '', 'x|1', 'c.md', 'd/a.txt', '\\b.txt']
+        segments = ['', 'a.txt', 'b.txt', 'a', 'dir', 'sub', '..', '.', 'c.md', 'x|1']
+
+        def path():
+            return rnd.choice(['/', '\\']).join(rnd.choice(segments) for _ in range(rnd.randint(0, 4)))
+
+        for _ in range(500):
+            n = rnd.randint(0, 8)
+            relative_paths = {}
+            for _ in range(rnd.randint(0, 10)):
+                key = rnd.choice([str(rnd.randint(0, n)), f'0{rnd.randint(0, n)}', 'k', str(rnd.randint(0, n))])
+                relative_paths[key] = rnd.choice([path(), path(), '', None, 3])
+            relative_meta = {}
+            for _ in range(rnd.randint(0, 6)):
+                key = '|'.join([rnd.choice(names), str(rnd.randint(0, 3)), str(rnd.randint(0, 2))][:rnd.randint(1, 3)])
+                relative_meta[key] = rnd.choice([path(), ''])
+            resolve = _relative_path_lookup(relative_paths, relative_meta)
+            for idx in range(n):
+                name, size = rnd.choice(names), rnd.randint(0, 3)
+                self.assertEqual(resolve(idx, name, size)[0],
+                                 _scan_relative_path(idx, name, size, relative_paths, relative_meta),
+                                 (idx, name, size, relative_paths, relative_meta))
+
+
+class UploadManifestTests(TempMediaMixin, TestCase):
+    """相对路径清单：作为单独的文件部分逐行解析，目录只写一次，不受表单字段数限制。"""
+
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='mani', password='pass')
+        self.client.login(username='mani', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='清单')
+
+    def test_iter_entries_streams_directory_runs(self):
+        body = b'{"d": "a/b"}\n["x.txt", 3, 1]\n\n["y.txt", 4]\n{"d": ""}\n["z.txt", 5]'
+        self.assertEqual(list(iter_entries(io.BytesIO(body))), [
+            (0, 'a/b/x.txt', 'x.txt', 3, 1), (1, 'a/b/y.txt', 'y.txt', 4, None), (2, 'z.txt', 'z.txt', 5, None)])
+
+    def test_rejects_oversized_lines_and_entries(self):
+        with self.assertRaises(ManifestError):
+            list(iter_entries(io.BytesIO(b'["' + b'a' * MAX_LINE_BYTES + b'", 1]')))
+        with self.assertRaises(ManifestError):
+            list(iter_entries(io.BytesIO(b'["a", 1]\n["b", 1]\n'), limit=1))
+
+    @override_settings(DATA_UPLOAD_MAX_NUMBER_FIELDS=10)
+    def test_upload_with_manifest_part(self):
+        n = 30
+        lines = ['{"d": "deep/dir"}'] + [json.dumps([f'f{i}.txt', 1, 0]) for i in range(n)]
+        manifest = SimpleUploadedFile('manifest.ndjson', '\n'.join(lines).encode(), 'application/x-ndjson')
+        resp = self.client.post(reverse('learning_logs:upload_attachments_api'), {
+            'parent_type': 'topic', 'parent_id': self.topic.id, 'manifest': manifest,
+            'files': [SimpleUploadedFile(f'f{i}.txt', b'x') for i in range(n)]})
+        self.assertEqual(resp.status_code, 200)
+        paths = sorted(f['relative_path'] for f in resp.json()['files'])
+        self.assertEqual(paths, sorted(f'deep/dir/f{i}.txt' for i in range(n)))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ArchiveIngestTests(TempMediaMixin, TestCase):
+    """归档导入：tar 流边读边入库，路径取自归档并做清洗；超限时整体撤销；已上传的 zip 附件可展开。"""
+
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='tarry', password='pass')
+        self.client.login(username='tarry', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='源码')
+        self.entry = Entry.objects.create(topic=self.topic, owner=self.user, text='正文')
+
+    def _tar(self, members, mode='w:gz'):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode=mode) as tf:
+            for name, data in members:
+                info = tarfile.TarInfo(name)
+                if data is None:
+                    info.type, info.linkname = tarfile.SYMTYPE, '/etc/passwd'
+                    tf.addfile(info)
+                else:
+                    info.size = len(data)
+                    tf.addfile(info, io.BytesIO(data))
+        return buf.getvalue()
+
+    def _post(self, body, **params):
+        query = urlencode({'parent_type': 'entry', 'parent_id': self.entry.id, **params})
+        return self.client.post(f"{reverse('learning_logs:upload_archive_api')}?{query}", body,
+                                content_type='application/gzip')
+
+    def test_tar_stream_becomes_attachments(self):
+        body = self._tar([('src/main.py', b'print(1)\n'), ('src/lib/util.py', b'x = 1\n'),
+                          ('../evil.txt', b'no'), ('/abs.txt', b'no'), ('link', None)])
+        resp = self._post(body, prefix='proj')
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(sorted(f['relative_path'] for f in data['files']),
+                         ['proj/src/lib/util.py', 'proj/src/main.py'])
+        self.assertEqual(sorted(x['name'] for x in data['skipped']), ['../evil.txt', '/abs.txt', 'link'])
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.attachment_count, 2)
+        att = Attachment.objects.get(relative_path='proj/src/main.py')
+        self.assertEqual(att.file.read(), b'print(1)\n')
+        self.assertEqual(len(att.sha256), 64)
+
+    def test_limits_roll_back_the_whole_archive(self):
+        body = self._tar([(f'f{i}.txt', b'x') for i in range(5)])
+        with mock.patch.object(archives, 'ARCHIVE_BATCH_FILES', 2), \
+                mock.patch('learning_logs.views.MAX_FOLDER_UPLOAD_FILES', 4):
+            resp = self.client.post(
+                f"{reverse('learning_logs:upload_archive_api')}?parent_type=entry&parent_id={self.entry.id}",
+                body, content_type='application/gzip')
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(Attachment.objects.exists())
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.attachment_count, 0)
+        self.assertEqual(self._post(b'not an archive').status_code, 400)
+
+    def test_zip_attachment_is_extracted_next_to_it(self):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as zf:
+            zf.writestr('notes/a.md', '# a')
+            zf.writestr('b.txt', 'b')
+        upload = self.client.post(reverse('learning_logs:upload_attachments_api'), {
+            'parent_type': 'entry', 'parent_id': self.entry.id,
+            'files': [SimpleUploadedFile('bundle.zip', buf.getvalue())]})
+        att_id = upload.json()['files'][0]['id']
+        resp = self.client.post(reverse('learning_logs:extract_attachment_archive', args=[att_id]))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(sorted(f['relative_path'] for f in resp.json()['files']),
+                         ['bundle/b.txt', 'bundle/notes/a.md'])
+        self.assertEqual(Attachment.objects.get(relative_path='bundle/b.txt').entry_id, self.entry.id)
+        # 只有上传者可以展开
+        get_user_model().objects.create_user(username='nosy', password='pass')
+        self.client.login(username='nosy', password='pass')
+        self.assertEqual(self.client.post(reverse('learning_logs:extract_attachment_archive', args=[att_id])).status_code, 404)
+
+
+class UploadPreflightTests(TempMediaMixin, TestCase):
+    """重新同步预检：同路径、同大小且 SHA-256 相同才视为未改变，清单外与被取代的旧文件列为 stale，prune 时删除。"""
+
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='sync', password='pass')
+        self.client.login(username='sync', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='同步')
+        self.entry = Entry.objects.create(topic=self.topic, owner=self.user, text='正文')
+        for path, data in (('docs/a.txt', b'aaa'), ('docs/b.txt', b'bbb'), ('docs/old.txt', b'old'), ('other/c.txt', b'c')):
+            self._add(path, data)
+
+    def _add(self, path, data):
+        att = Attachment.objects.create(owner=self.user, entry=self.entry, relative_path=path,
+                                        file=SimpleUploadedFile(path.rsplit('/', 1)[1], data))
+        Attachment.objects.filter(pk=att.pk).update(sha256=hashlib.sha256(data).hexdigest())
+        return att
+
+    @staticmethod
+    def _digest(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def _preflight(self, lines, **extra):
+        body = '\n'.join(json.dumps(line) for line in lines).encode()
+        return self.client.post(reverse('learning_logs:upload_preflight_api'), {
+            'parent_type': 'entry', 'parent_id': self.entry.id,
+            'manifest': SimpleUploadedFile('manifest.ndjson', body), **extra}).json()
+
+    def test_reports_unchanged_and_stale(self):
+        data = self._preflight([{'d': 'docs'}, ['a.txt', 3, 0, self._digest(b'aaa')],
+                                ['b.txt', 3, 0, self._digest(b'xyz')], ['new.txt', 1, 0]])
+        self.assertEqual((data['unchanged'], data['upload']), ([0], [1, 2]))
+        # other/ 不在清单覆盖的目录中，不算 stale
+        self.assertEqual([x['relative_path'] for x in data['stale']], ['docs/old.txt'])
+        self.assertEqual(Attachment.objects.count(), 4)
+
+    def test_same_size_edit_without_matching_digest_is_uploaded(self):
+        # 大小相同、内容不同：没有摘要或摘要不同都不能算未改变
+        data = self._preflight([{'d': 'docs'}, ['a.txt', 3, 0], ['b.txt', 3, 0, self._digest(b'BBB')]])
+        self.assertEqual((data['unchanged'], data['upload']), ([], [0, 1]))
+        # 库中附件没有摘要时同样需要上传
+        Attachment.objects.filter(relative_path='docs/a.txt').update(sha256='')
+        data = self._preflight([{'d': 'docs'}, ['a.txt', 3, 0, self._digest(b'aaa')]])
+        self.assertEqual(data['upload'], [0])
+        # 没有与清单一致的版本时不删除旧文件
+        data = self._preflight([{'d': 'docs'}, ['a.txt', 3, 0], ['b.txt', 3, 0], ['old.txt', 3, 0]], prune='1')
+        self.assertEqual((data['stale'], data['removed']), ([], 0))
+
+    def test_prune_removes_stale_and_superseded_versions(self):
+        self._add('docs/a.txt', b'aaaa')
+        data = self._preflight([{'d': 'docs'}, ['a.txt', 4, 0, self._digest(b'aaaa')],
+                                ['b.txt', 3, 0, self._digest(b'bbb')]], prune='1')
+        self.assertEqual((data['unchanged'], data['removed']), ([0, 1], 2))
+        self.assertEqual(sorted(Attachment.objects.values_list('relative_path', 'size')),
+                         [('docs/a.txt', 4), ('docs/b.txt', 3), ('other/c.txt', 1)])
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.attachment_count, 3)
+
+
+class IdempotentUploadTests(TempMediaMixin, TestCase):
+    """幂等重试：同一 key 的重试重放首次响应而不重复入库；处理中返回 409；失败或失效的占位可被重试接管。"""
+
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='retry', password='pass')
+        self.client.login(username='retry', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='重试')
+        self.entry = Entry.objects.create(topic=self.topic, owner=self.user, text='正文')
+
+    def _post(self, key, name='a.txt'):
+        return self.client.post(reverse('learning_logs:upload_attachments_api'), {
+            'parent_type': 'entry', 'parent_id': self.entry.id,
+            'files': [SimpleUploadedFile(name, b'data')]}, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_first_response(self):
+        first = self._post('k1')
+        again = self._post('k1')
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again['Idempotent-Replayed'], 'true')
+        self.assertEqual(again.json(), first.json())
+        self.assertEqual(Attachment.objects.count(), 1)
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.attachment_count, 1)
+        # 不同 key 是新的上传
+        self._post('k2')
+        self.assertEqual(Attachment.objects.count(), 2)
+
+    def test_in_flight_and_stale_claims(self):
+        path = reverse('learning_logs:upload_attachments_api')
+        now = timezone.now()
+        receipt = UploadReceipt.objects.create(owner=self.user, key='k', path=path, created_at=now,
+                                               expires_at=now + timedelta(days=1))
+        # 另一个 worker 正在处理同一 key
+        self.assertEqual(self._post('k').status_code, 409)
+        self.assertFalse(Attachment.objects.exists())
+        # 占位失效后由重试接管
+        UploadReceipt.objects.filter(pk=receipt.pk).update(
+            created_at=now - timedelta(seconds=IDEMPOTENCY_PENDING_SECONDS + 1))
+        self.assertEqual(self._post('k').status_code, 200)
+        self.assertEqual(UploadReceipt.objects.get(pk=receipt.pk).status_code, 200)
+        self.assertEqual(Attachment.objects.count(), 1)
+
+    def test_server_error_releases_key(self):
+        with mock.patch('learning_logs.views._save_attachments_from_request', side_effect=RuntimeError):
+            self.assertEqual(self._post('k').status_code, 500)
+        self.assertFalse(UploadReceipt.objects.exists())
+        self.assertEqual(self._post('k').status_code, 200)
+        self.assertEqual(Attachment.objects.count(), 1)
+
+
+class FolderZipStreamTests(TempMediaMixin, TestCase):
+    """文件夹下载：流式 zip（数据描述符、ZIP64），按类型选择 STORED / DEFLATED。"""
+
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='zipper', password='pass')
+        self.client.login(username='zipper', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='打包')
+        self.entry = Entry.objects.create(topic=self.topic, owner=self.user, text='正文')
+
+    def test_folder_is_streamed_as_zip(self):
+        text = b'hello world ' * 5000
+        photo = b'\xff\xd8\xff' + bytes(range(256)) * 400
+        self.client.post(reverse('learning_logs:upload_attachments_api'), {
+            'parent_type': 'entry', 'parent_id': self.entry.id,
+            'files': [SimpleUploadedFile('a.txt', text), SimpleUploadedFile('b.jpg', photo),
+                      SimpleUploadedFile('c.txt', b'other')],
+            'relative_path[0]': 'docs/a.txt', 'relative_path[1]': 'docs/img/b.jpg', 'relative_path[2]': 'misc/c.txt'})
+        resp = self.client.get(reverse('learning_logs:download_folder'), {
+            'parent_type': 'entry', 'parent_id': self.entry.id, 'folder_path': 'docs'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+        self.assertEqual(resp['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(io.BytesIO(b''.join(resp.streaming_content))) as zf:
+            self.assertEqual(sorted(zf.namelist()), ['docs/a.txt', 'docs/img/b.jpg'])
+            self.assertEqual(zf.read('docs/a.txt'), text)
+            self.assertEqual(zf.read('docs/img/b.jpg'), photo)
+            a, b = zf.getinfo('docs/a.txt'), zf.getinfo('docs/img/b.jpg')
+            self.assertEqual((a.compress_type, b.compress_type), (zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED))
+            self.assertTrue(a.flag_bits & 0x08)
+            self.assertLess(a.compress_size, len(text))
+
+    def test_iter_zip_streams_in_chunks_and_skips_unreadable_members(self):
+        data = os.urandom(256 * 1024)
+
+        def missing():
+            raise FileNotFoundError('gone')
+        members = [('big.bin', lambda: io.BytesIO(data), len(data), None, ''),
+                   ('lost.txt', missing, 1, None, 'text/plain'),
+                   # 大小未知时强制 ZIP64
+                   ('z.mp4', lambda: io.BytesIO(b'v' * 10), None, (2024, 1, 2, 3, 4, 5), 'video/mp4')]
+        chunks = list(iter_zip(members, chunk_size=16 * 1024))
+        self.assertGreater(len(chunks), 4)
+        self.assertTrue(all(len(c) < 64 * 1024 for c in chunks))
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as zf:
+            self.assertEqual(zf.namelist(), ['big.bin', 'z.mp4'])
+            self.assertEqual(zf.read('big.bin'), data)
+            self.assertEqual(zf.read('z.mp4'), b'v' * 10)
+            self.assertEqual(zf.getinfo('z.mp4').date_time, (2024, 1, 2, 3, 4, 4))
+            self.assertEqual(zf.testzip(), None)
+
+
+class FolderZipCacheTests(TempMediaMixin, TestCase):
+    """文件夹归档缓存：同一组文件只生成一次、文件变化后换键、未命中时边发送边写入、按 LRU 淘汰。"""
+
+    temp_settings = {'LL_ZIP_CACHE_DIR': 'zipcache'}
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'zipcache')
+        User = get_user_model()
+        self.user = User.objects.create_user(username='cacher', password='pass')
+        self.client.login(username='cacher', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='缓存')
+
+    def _upload(self, name, content):
+        self.client.post(reverse('learning_logs:upload_attachments_api'), {
+            'parent_type': 'topic', 'parent_id': self.topic.id,
+            'files': [SimpleUploadedFile(name, content)], 'relative_path[0]': f'album/{name}'})
+
+    def _download(self):
+        resp = self.client.get(reverse('learning_logs:download_folder'), {
+            'parent_type': 'topic', 'parent_id': self.topic.id, 'folder_path': 'album'})
+        self.assertEqual(resp.status_code, 200)
+        return b''.join(resp.streaming_content)
+
+    def test_archive_is_built_once_per_file_set(self):
+        self._upload('a.txt', b'aaa')
+        with mock.patch.object(zipstream, 'iter_zip', wraps=zipstream.iter_zip) as built:
+            first = self._download()
+            self.assertEqual(self._download(), first)
+            self.assertEqual(built.call_count, 1)
+            self._upload('b.txt', b'bbb')
+            with zipfile.ZipFile(io.BytesIO(self._download())) as zf:
+                self.assertEqual(sorted(zf.namelist()), ['album/a.txt', 'album/b.txt'])
+            self.assertEqual(built.call_count, 2)
+        self.assertEqual(len([n for n in os.listdir(self.cache_dir) if n.endswith('.zip')]), 2)
+
+    def test_cached_archive_supports_ranges(self):
+        self._upload('a.txt', b'aaa')
+        whole = self._download()
+        resp = self.client.get(reverse('learning_logs:download_folder'), {
+            'parent_type': 'topic', 'parent_id': self.topic.id, 'folder_path': 'album'}, HTTP_RANGE='bytes=10-')
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(b''.join(resp.streaming_content), whole[10:])
+
+    def test_large_folder_is_streamed_without_cache(self):
+        self._upload('a.txt', b'aaa')
+        with mock.patch.object(zipcache, 'ZIP_CACHE_MAX_ENTRY_BYTES', 2):
+            self.assertTrue(self._download())
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def _archive(self, calls, parts=(b'zip-', b'body-', b'end')):
+        def make_chunks():
+            calls.append(1)
+            yield from parts
+        return make_chunks
+
+    def _follow_in_thread(self, key, make_chunks, results):
+        t = threading.Thread(target=lambda: results.append(b''.join(zipcache.stream(key, make_chunks))))
+        t.start()
+        return t
+
+    def test_first_chunk_is_sent_before_archive_is_complete(self):
+        key = 'ab' * 32
+        calls, results = [], []
+        make_chunks = self._archive(calls)
+        stream = zipcache.stream(key, make_chunks)
+        # 第一块到达时归档还没生成完，也还没有缓存
+        self.assertEqual(next(stream), b'zip-')
+        self.assertIsNone(zipcache.fetch(key))
+        # 生成期间到达的请求跟读正在写的文件，不再各自生成
+        followers = [self._follow_in_thread(key, make_chunks, results) for _ in range(3)]
+        time.sleep(0.2)
+        self.assertEqual(b''.join(stream), b'body-end')
+        for t in followers:
+            t.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [b'zip-body-end'] * 3)
+        with zipcache.fetch(key) as fh:
+            self.assertEqual(fh.read(), b'zip-body-end')
+
+    def test_follower_takes_over_when_builder_gives_up(self):
+        key = 'cd' * 32
+        calls, results = [], []
+        make_chunks = self._archive(calls)
+        stream = zipcache.stream(key, make_chunks)
+        next(stream)
+        follower = self._follow_in_thread(key, make_chunks, results)
+        time.sleep(0.2)
+        # 客户端断开：响应关闭生成器，临时文件随之删除
+        stream.close()
+        follower.join(5)
+        self.assertEqual(results, [b'zip-body-end'])
+        self.assertEqual(len(calls), 2)
+        self.assertIsNone(zipcache.fetch(key))
+        self.assertEqual(os.listdir(self.cache_dir), [])
+        self.assertEqual(b''.join(zipcache.stream(key, make_chunks)), b'zip-body-end')
+        self.assertIsNotNone(zipcache.fetch(key))
+
+    def test_unrelated_archives_do_not_share_a_lock(self):
+        # 摘要首字节相同的两个文件夹同时生成，互不影响，都能写入缓存
+        first, second = 'ab' * 32, 'ab' + 'cd' * 31
+        calls = []
+        stream = zipcache.stream(first, self._archive(calls))
+        next(stream)
+        self.assertEqual(b''.join(zipcache.stream(second, self._archive(calls))), b'zip-body-end')
+        self.assertEqual(b''.join(stream), b'body-end')
+        self.assertIsNotNone(zipcache.fetch(first))
+        self.assertIsNotNone(zipcache.fetch(second))
+
+    def test_evicts_least_recently_used(self):
+        os.makedirs(self.cache_dir)
+        for i, key in enumerate(('a', 'b', 'c')):
+            path = os.path.join(self.cache_dir, f'{key * 64}.zip')
+            with open(path, 'wb') as fh:
+                fh.write(b'x' * 100)
+            os.utime(path, (1000 + i, 1000 + i))
+        # 命中会刷新最久未用的 a
+        zipcache.fetch('a' * 64).close()
+        self.assertEqual(zipcache.evict(max_bytes=200), 1)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ['a' * 64 + '.zip', 'c' * 64 + '.zip'])
+
+
+class RangeDownloadTests(TempMediaMixin, TestCase):
+    """附件下载的 Range 支持：拖动到大文件中部、多区间、If-Range、416 与不可 seek 的远程流。"""
+
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.user = User.objects.create_user(username='seeker', password='pass')
+        self.client.login(username='seeker', password='pass')
+        topic = Topic.objects.create(owner=self.user, text='视频')
+        entry = Entry.objects.create(topic=topic, owner=self.user, text='片段')
+        self.data = os.urandom(3 * 1024 * 1024 + 17)
+        self.client.post(reverse('learning_logs:upload_attachments_api'), {
+            'parent_type': 'entry', 'parent_id': entry.id,
+            'files': [SimpleUploadedFile('clip.mp4', self.data, content_type='video/mp4')]})
+        self.att = Attachment.objects.get()
+        self.url = reverse('learning_logs:download_attachment', args=[self.att.id])
+
+    def _get(self, **headers):
+        resp = self.client.get(self.url, **{'HTTP_' + k.upper().replace('-', '_'): v for k, v in headers.items()})
+        return resp, b''.join(resp.streaming_content) if resp.streaming else resp.content
+
+    def test_full_download_advertises_ranges(self):
+        resp, body = self._get()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Accept-Ranges'], 'bytes')
+        self.assertEqual(resp['Content-Length'], str(len(self.data)))
+        self.assertEqual(body, self.data)
+
+    def test_seek_into_large_file(self):
+        size = len(self.data)
+        resp, body = self._get(range='bytes=2000000-2000099')
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp['Content-Range'], f'bytes 2000000-2000099/{size}')
+        self.assertEqual(resp['Content-Length'], '100')
+        self.assertEqual(body, self.data[2000000:2000100])
+        resp, body = self._get(range='bytes=3000000-')
+        self.assertEqual(body, self.data[3000000:])
+        resp, body = self._get(range='bytes=-17')
+        self.assertEqual(resp['Content-Range'], f'bytes {size - 17}-{size - 1}/{size}')
+        self.assertEqual(body, self.data[-17:])
+
+    def test_multiple_ranges(self):
+        resp, body = self._get(range='bytes=0-9, 3000000-3000009, 5-14')
+        self.assertEqual(resp.status_code, 206)
+        self.assertTrue(resp['Content-Type'].startswith('multipart/byteranges; boundary='))
+        self.assertEqual(resp['Content-Length'], str(len(body)))
+        boundary = resp['Content-Type'].split('boundary=')[1].encode()
+        parts = [p for p in body.split(b'--' + boundary) if p.strip(b'\r\n-')]
+        # 重叠的 0-9 与 5-14 合并为一段
+        self.assertEqual(len(parts), 2)
+        self.assertIn(b'Content-Range: bytes 0-14/', parts[0])
+        self.assertTrue(parts[0].endswith(b'\r\n\r\n' + self.data[:15] + b'\r\n'))
+        self.assertTrue(parts[1].endswith(b'\r\n\r\n' + self.data[3000000:3000010] + b'\r\n'))
+
+    def test_if_range_and_unsatisfiable(self):
+        etag = self._get()[0]['ETag']
+        resp, body = self._get(range='bytes=10-19', if_range=etag)
+        self.assertEqual((resp.status_code, body), (206, self.data[10:20]))
+        resp, body = self._get(range='bytes=10-19', if_range='"stale"')
+        self.assertEqual((resp.status_code, len(body)), (200, len(self.data)))
+        resp, _ = self._get(range=f'bytes={len(self.data)}-')
+        self.assertEqual(resp.status_code, 416)
+        self.assertEqual(resp['Content-Range'], f'bytes */{len(self.data)}')
+        # 语法错误时忽略 Range
+        self.assertEqual(self._get(range='bytes=abc')[0].status_code, 200)
+        self.assertEqual(self._get(if_none_match=etag)[0].status_code, 304)
+
+    def test_non_seekable_remote_stream(self):
+
+        class Remote(io.RawIOBase):
+            def __init__(self, data):
+                self._buf = io.BytesIO(data)
+
+            def readable(self):
+                return True
+
+            def readinto(self, b):
+                return self._buf.readinto(b)
+        request = RequestFactory().get('/', HTTP_RANGE='bytes=100-199,1000000-1000009')
+        resp = file_response(request, Remote(self.data), size=len(self.data))
+        body = b''.join(resp.streaming_content)
+        self.assertIn(self.data[100:200], body)
+        self.assertIn(self.data[1000000:1000010], body)
+        self.assertEqual(resp['Content-Length'], str(len(body)))
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_preview_player_uses_range_capable_url(self):
+        resp = self.client.get(reverse('learning_logs:preview_attachment', args=[self.att.id]))
+        src = re.search(r'<source src="([^"]+)"', resp.content.decode()).group(1).replace('&amp;', '&')
+        self.assertIn('d=inline', src)
+        self.assertEqual(self.client.get(src, HTTP_RANGE='bytes=100-199').status_code, 206)
+        resp, _ = self._get()
+        self.assertTrue(resp['Content-Disposition'].startswith('attachment;'))
+        self.assertTrue(self.client.get(self.url + '?inline=1')['Content-Disposition'].startswith('inline;'))
+
+
+class AccelRedirectTests(TempMediaMixin, TestCase):
+    """启用 X-Accel-Redirect 时：权限检查仍在 Django，文件内容交给 nginx；远程存储退回 Python 发送。"""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(accel, 'ACCEL_REDIRECT', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        User = get_user_model()
+        self.user = User.objects.create_user(username='nginx', password='pass')
+        self.client.login(username='nginx', password='pass')
+        self.topic = Topic.objects.create(owner=self.user, text='私密')
+        self.client.post(reverse('learning_logs:upload_attachments_api'), {
+            'parent_type': 'topic', 'parent_id': self.topic.id,
+            'files': [SimpleUploadedFile('照片 1.jpg', b'\xff\xd8\xff', content_type='image/jpeg')],
+            'relative_path[0]': 'album/照片 1.jpg'})
+        self.att = Attachment.objects.get()
+
+    def test_download_is_offloaded_after_permission_check(self):
+        url = reverse('learning_logs:download_attachment', args=[self.att.id])
+        resp = self.client.get(url + '?inline=1')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['X-Accel-Redirect'], '/_protected/media/' + quote(self.att.file.name))
+        self.assertEqual(resp['Content-Type'], 'image/jpeg')
+        self.assertTrue(resp['Content-Disposition'].startswith('inline;'))
+        self.assertEqual(resp.content, b'')
+        other = get_user_model().objects.create_user(username='stranger', password='pass')
+        self.client.force_login(other)
+        with override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_cached_folder_archive_is_offloaded(self):
+        params = {'parent_type': 'topic', 'parent_id': self.topic.id, 'folder_path': 'album'}
+        # 第一次未命中：由 Django 边生成边发送并写入缓存，之后交给 nginx
+        first = self.client.get(reverse('learning_logs:download_folder'), params)
+        self.assertNotIn('X-Accel-Redirect', first)
+        b''.join(first.streaming_content)
+        resp = self.client.get(reverse('learning_logs:download_folder'), params)
+        self.assertTrue(resp['X-Accel-Redirect'].startswith('/_protected/zipcache/'))
+        self.assertTrue(resp['X-Accel-Redirect'].endswith('.zip'))
+        self.assertEqual(resp['Content-Type'], 'application/zip')
+
+    def test_remote_storage_falls_back_to_streaming(self):
+        remote = mock.Mock(storage=object(), name='attachments/x.jpg')
+        self.assertIsNone(accel.media_uri(remote))
+        with mock.patch.object(accel, 'ACCEL_REDIRECT', False):
+            resp = self.client.get(reverse('learning_logs:download_attachment', args=[self.att.id]))
+        self.assertFalse(resp.has_header('X-Accel-Redirect'))
+        self.assertEqual(b''.join(resp.streaming_content), b'\xff\xd8\xff')
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class SignedMediaTests(TempMediaMixin, TestCase):
+    """签名附件地址：渲染时签发，取文件不查数据库；篡改、过期与撤下的密钥被拒绝；HTML 不内联。"""
+
+    def setUp(self):
+        super().setUp()
+        signed_media._keys.cache_clear()
+        self.addCleanup(signed_media._keys.cache_clear)
+        User = get_user_model()
+        self.user = User.objects.create_user(username='gallery', password='pass')
+        self.client.login(username='gallery', password='pass')
+        topic = Topic.objects.create(owner=self.user, text='相册', is_public=True)
+        entry = Entry.objects.create(topic=topic, owner=self.user, text='照片', is_public=True)
+        self.client.post(reverse('learning_logs:upload_attachments_api'), {
+            'parent_type': 'entry', 'parent_id': entry.id,
+            'files': [SimpleUploadedFile('猫.png', b'\x89PNG\r\n\x1a\nimg', content_type='image/png'),
+                      SimpleUploadedFile('page.html', b'<script>alert(1)</script>', content_type='text/html')]})
+        self.png = Attachment.objects.get(original_name='猫.png')
+        self.html = Attachment.objects.get(original_name='page.html')
+
+    def _rekey(self, keys):
+        override = override_settings(LL_MEDIA_SIGNING_KEYS=keys)
+        override.enable()
+        self.addCleanup(override.disable)
+        signed_media._keys.cache_clear()
+
+    def test_preview_mints_url_served_without_queries(self):
+        page = self.client.get(reverse('learning_logs:preview_attachment', args=[self.png.id]))
+        src = re.search(r'<img src="([^"]+)"[^>]*class="img-fluid"', page.content.decode()).group(1).replace('&amp;', '&')
+        self.assertTrue(src.startswith('/m/'))
+        self.client.logout()
+        with self.assertNumQueries(0):
+            resp = self.client.get(src)
+            body = b''.join(resp.streaming_content)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(body, b'\x89PNG\r\n\x1a\nimg')
+        self.assertEqual(resp['Content-Type'], 'image/png')
+        self.assertTrue(resp['Content-Disposition'].startswith('inline;'))
+        self.assertTrue(resp['Cache-Control'].startswith('private, max-age='))
+        self.assertEqual(self.client.get(src, HTTP_RANGE='bytes=0-3').status_code, 206)
+
+    def test_tampered_or_expired_urls_are_rejected(self):
+        url = signed_media.attachment_url(self.png, inline=True)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        path, query = url.split('?', 1)
+        token, name = path[len('/m/'):].split('/', 1)
+        kid, expires, sig = token.split('.')
+        forged = f'/m/{kid}.{int(expires) + 3600}.{sig}/{name}?{query}'
+        for bad in (forged, path + '?' + query.replace('inline', 'attachment'),
+                    url.replace(name, name.replace('.png', '.jpg')), f'/m/{token}/{name}?t=text/html'):
+            self.assertEqual(self.client.get(bad).status_code, 403, bad)
+        old = signed_media.attachment_url(self.png)
+        past = signed_media.sign(self.png.file.name, now=time.time() - 10 * 3600)
+        self.assertEqual(self.client.get(past).status_code, 403)
+        self.assertEqual(self.client.get(old).status_code, 200)
+
+    def test_key_rotation(self):
+        self._rekey([('k1', 'first-secret')])
+        old = signed_media.attachment_url(self.png)
+        self._rekey([('k2', 'second-secret'), ('k1', 'first-secret')])
+        new = signed_media.attachment_url(self.png)
+        self.assertIn('/m/k2.', new)
+        self.assertEqual(self.client.get(old).status_code, 200)
+        self._rekey([('k2', 'second-secret')])
+        self.assertEqual(self.client.get(old).status_code, 403)
+        self.assertEqual(self.client.get(new).status_code, 200)
+
+    def test_html_is_never_inlined(self):
+        url = signed_media.attachment_url(self.html, inline=True)
+        self.assertNotIn('d=inline', url)
+        resp = self.client.get(url)
+        self.assertTrue(resp['Content-Disposition'].startswith('attachment;'))
+        self.assertEqual(resp['X-Content-Type-Options'], 'nosniff')
+        resp = self.client.get(reverse('learning_logs:download_attachment', args=[self.html.id]) + '?inline=1')
+        self.assertTrue(resp['Content-Disposition'].startswith('attachment;'))
+
+    def test_url_is_bound_to_attachment_version(self):
+        url = signed_media.attachment_url(self.png, inline=True)
+        version = signed_media.attachment_version(self.png)
+        self.assertIn('v=' + version, url)
+        resp = self.client.get(url)
+        self.assertEqual(resp['ETag'], f'"{version}-{self.png.size}"')
+        self.assertEqual(self.client.get(url.replace('v=' + version, f'v={self.png.pk + 1}.0')).status_code, 403)
+        # 附件删除后文件名被新上传的文件复用：旧地址仍在有效期内，但不再提供新文件
+        name, path = self.png.file.name, self.png.file.path
+        self.png.delete()
+        with open(path, 'wb') as fh:
+            fh.write(b'private')
+        later = int(self.png.uploaded_at.timestamp()) + 5
+        os.utime(path, (later, later))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(signed_media.sign(name)).status_code, 404)
+
+    def test_offloaded_to_nginx_when_enabled(self):
+        with mock.patch.object(accel, 'ACCEL_REDIRECT', True):
+            resp = self.client.get(signed_media.attachment_url(self.png, inline=True))
+        self.assertTrue(resp['X-Accel-Redirect'].startswith('/_protected/media/attachments/'))
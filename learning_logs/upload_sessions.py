@@ -0,0 +1,114 @@
+"""异步上传会话（UploadSession）：新建日记页在提交前先把附件上传到日记本下，提交时再一次性转挂。
+
+- POST attachments/upload_session/ 以 parent_type / parent_id 与预期的 files / bytes 打开会话；
+  带上已有的 key 时在原会话上累加预期（同一页面分多次选择文件），返回 key 与过期时间。
+- upload_attachments_api / resumable_finalize 每保存一批附件调用 record，
+  收到的文件数与字节数用 F() 累加，多个分块并发上传同一会话时互不覆盖。
+- new_entry 以一条 UPDATE 把会话内的附件转挂到新日记，并删除会话。
+- 超过 LL_UPLOAD_SESSION_TTL_SECONDS 未收到新分块、也未转挂的会话视为放弃，
+  其下的附件与会话一起清理（打开新会话时顺带清理，或 ``python manage.py purge_uploads``）。
+
+只有新建日记页的暂存区会打开会话。没有打开过的 key（旧页面、历史数据）不补建会话：
+附件照旧带着 key，等待 new_entry 转挂，但不统计进度，也不会被清理。
+"""
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import counters
+from .models import Attachment, UploadSession
+
+# 多久未收到新分块视为放弃（秒）
+UPLOAD_SESSION_TTL_SECONDS = getattr(settings, 'LL_UPLOAD_SESSION_TTL_SECONDS', 24 * 3600)
+# 每次清理最多处理的过期会话数
+PURGE_BATCH = 50
+
+MAX_KEY_LENGTH = UploadSession._meta.get_field('key').max_length
+
+
+def _expiry():
+    return timezone.now() + timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS)
+
+
+def _new_key():
+    return secrets.token_hex(16)
+
+
+def purge_expired(limit=PURGE_BATCH):
+    """删除过期会话及其尚未转挂的附件，返回删除的会话数。"""
+    keys = list(UploadSession.objects.filter(expires_at__lte=timezone.now())
+                .values_list('key', flat=True)[:limit])
+    if not keys:
+        return 0
+    with transaction.atomic():
+        counters.delete_attachments(Attachment.objects.filter(upload_session__in=keys, entry__isnull=True))
+        return UploadSession.objects.filter(key__in=keys).delete()[1].get(UploadSession._meta.label, 0)
+
+
+def _create(owner, key, **fields):
+    try:
+        with transaction.atomic():
+            return UploadSession.objects.create(key=key, owner=owner, expires_at=_expiry(), **fields)
+    except IntegrityError:
+        return None
+
+
+def open_session(owner, key=None, *, expected_files=0, expected_bytes=0, **parent):
+    """打开会话，或在 owner 自己的同名会话上累加预期；key 被他人占用时换一个新的 key。"""
+    purge_expired()
+    expected = {'expected_files': max(0, expected_files), 'expected_bytes': max(0, expected_bytes)}
+    if key and len(key) <= MAX_KEY_LENGTH:
+        extended = UploadSession.objects.filter(key=key, owner=owner).update(
+            expected_files=F('expected_files') + expected['expected_files'],
+            expected_bytes=F('expected_bytes') + expected['expected_bytes'],
+            expires_at=_expiry())
+        if extended:
+            return UploadSession.objects.get(key=key)
+        session = _create(owner, key, **expected, **parent)
+        if session is not None:
+            return session
+        if UploadSession.objects.filter(key=key, owner=owner).exists():
+            # 与并发的打开请求撞上，再累加一次即可
+            return open_session(owner, key, **expected, **parent)
+    return _create(owner, _new_key(), **expected, **parent)
+
+
+def resolve(key, owner):
+    """上传时取得 owner 打开过的会话；key 没有打开过时返回 None。
+
+    key 过长或已被其他用户打开时抛 ValueError。
+    """
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError('invalid upload_session')
+    session = UploadSession.objects.filter(key=key).first()
+    if session is not None and session.owner_id != owner.pk:
+        raise ValueError('invalid upload_session')
+    return session
+
+
+def record(session, files, size):
+    """累加收到的文件数与字节数，并顺延过期时间。"""
+    if session is None or not files:
+        return
+    UploadSession.objects.filter(pk=session.pk).update(
+        received_files=F('received_files') + files,
+        received_bytes=F('received_bytes') + size,
+        expires_at=_expiry())
+
+
+def state(session):
+    return {
+        'key': session.key,
+        'expected_files': session.expected_files,
+        'expected_bytes': session.expected_bytes,
+        'received_files': session.received_files,
+        'received_bytes': session.received_bytes,
+        'complete': session.is_complete,
+        'expires_at': session.expires_at.isoformat(),
+    }
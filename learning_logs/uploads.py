@@ -0,0 +1,187 @@
+"""上传处理：按固定大小的块接收上传文件，小文件在内存预算内留在内存，其余写入临时文件。
+
+- 单个文件最多 FILE_UPLOAD_MAX_MEMORY_SIZE 字节留在内存；同一请求、同一 worker 进程内
+  留在内存的上传数据分别不超过 LL_UPLOAD_REQUEST_MEMORY_BUDGET / LL_UPLOAD_WORKER_MEMORY_BUDGET。
+  超出任一预算的文件立即转存到临时文件，之后由存储层直接移动，不再复制。
+- 接收的同时计算大小、SHA-256 与 MIME 类型（file.sha256 / file.sniffed_content_type），
+  Attachment.save 直接使用，无需重新读取文件。
+- 内存中的上传文件在关闭（请求结束时 request.close 会关闭全部上传文件）或被回收时归还预算。
+"""
+import hashlib
+import io
+import mimetypes
+import os
+import threading
+import weakref
+
+from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+# 每次从请求体读取并处理的块大小（字节）
+UPLOAD_CHUNK_SIZE = getattr(settings, 'LL_UPLOAD_CHUNK_SIZE', 256 * 1024)
+# 单个请求 / 单个 worker 进程内留在内存中的上传数据上限（字节）
+REQUEST_MEMORY_BUDGET = getattr(settings, 'LL_UPLOAD_REQUEST_MEMORY_BUDGET', 16 * 1024 * 1024)
+WORKER_MEMORY_BUDGET = getattr(settings, 'LL_UPLOAD_WORKER_MEMORY_BUDGET', 64 * 1024 * 1024)
+
+# 判断文件类型所需的文件头长度（tar 的 ustar 标记位于 257 字节处）
+SNIFF_BYTES = 262
+_MAGIC = (
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'PK\x03\x04', 'application/zip'),
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (0, b'\x1aE\xdf\xa3', 'video/webm'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'fLaC', 'audio/flac'),
+    (4, b'ftyp', 'video/mp4'),
+    (257, b'ustar', 'application/x-tar'),
+)
+_RIFF = {b'WEBP': 'image/webp', b'WAVE': 'audio/wav', b'AVI ': 'video/x-msvideo'}
+
+_lock = threading.Lock()
+_worker_reserved = 0
+
+
+def _reserve(n):
+    global _worker_reserved
+    with _lock:
+        if _worker_reserved + n > WORKER_MEMORY_BUDGET:
+            return False
+        _worker_reserved += n
+        return True
+
+
+def _release(n):
+    global _worker_reserved
+    with _lock:
+        _worker_reserved -= n
+
+
+def worker_memory_in_use():
+    """当前进程中留在内存里的上传数据字节数。"""
+    return _worker_reserved
+
+
+def sniff_content_type(head, name=''):
+    """先按文件名猜测 MIME（与以往一致，尊重扩展名）；猜不出时按文件头魔数判断。"""
+    guessed, _ = mimetypes.guess_type(name or '')
+    if guessed:
+        return guessed
+    if head[:4] == b'RIFF' and head[8:12] in _RIFF:
+        return _RIFF[head[8:12]]
+    for offset, magic, content_type in _MAGIC:
+        if head[offset:offset + len(magic)] == magic:
+            return content_type
+    if head and b'\x00' not in head:
+        try:
+            head.decode('utf-8')
+            return 'text/plain'
+        except UnicodeDecodeError:
+            # 可能只是截断在多字节字符中间
+            try:
+                head[:-3].decode('utf-8')
+                return 'text/plain'
+            except UnicodeDecodeError:
+                pass
+    return 'application/octet-stream'
+
+
+class BudgetedInMemoryUploadedFile(InMemoryUploadedFile):
+    """留在内存中的上传文件：关闭或被回收时归还所占的 worker 内存预算。"""
+
+    def __init__(self, *args, reserved=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._release_budget = weakref.finalize(self, _release, reserved)
+
+    def close(self):
+        self._release_budget()
+        return super().close()
+
+
+class SpooledUploadHandler(FileUploadHandler):
+    """取代 Django 默认的 Memory / TemporaryFile 两个处理器，见模块说明。"""
+    chunk_size = UPLOAD_CHUNK_SIZE
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.request_reserved = 0
+        self.reserved = 0
+        self.spool = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.buffer = io.BytesIO()
+        self.spool = None
+        self.reserved = 0
+        self.digest = hashlib.sha256()
+        self.head = b''
+
+    def _fits_in_memory(self, n):
+        if self.reserved + n > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            return False
+        if self.request_reserved + n > REQUEST_MEMORY_BUDGET:
+            return False
+        return _reserve(n)
+
+    def _give_back(self):
+        _release(self.reserved)
+        self.request_reserved -= self.reserved
+        self.reserved = 0
+
+    def _spill(self):
+        """把已缓冲的内容转存到临时文件，并归还其占用的内存预算。"""
+        self.spool = TemporaryUploadedFile(self.file_name, self.content_type, 0, self.charset,
+                                           self.content_type_extra)
+        self.spool.write(self.buffer.getvalue())
+        self.buffer = None
+        self._give_back()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        if len(self.head) < SNIFF_BYTES:
+            self.head += raw_data[:SNIFF_BYTES - len(self.head)]
+        if self.spool is None:
+            n = len(raw_data)
+            if self._fits_in_memory(n):
+                self.reserved += n
+                self.request_reserved += n
+                self.buffer.write(raw_data)
+                return None
+            self._spill()
+        self.spool.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.spool is None:
+            self.buffer.seek(0)
+            f = BudgetedInMemoryUploadedFile(
+                self.buffer, self.field_name, self.file_name, self.content_type, file_size,
+                self.charset, self.content_type_extra, reserved=self.reserved,
+            )
+            # 预算此后由文件对象持有，请求内的累计占用不变
+            self.reserved = 0
+        else:
+            f = self.spool
+            f.flush()
+            f.seek(0)
+            f.size = file_size
+            self.spool = None
+        f.sha256 = self.digest.hexdigest()
+        f.sniffed_content_type = sniff_content_type(self.head, self.file_name)
+        return f
+
+    def upload_interrupted(self):
+        if self.spool is not None:
+            path = self.spool.temporary_file_path()
+            try:
+                self.spool.close()
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.spool = None
+        self._give_back()
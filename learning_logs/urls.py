@@ -21,6 +21,8 @@ urlpatterns = [
     path('discovey/', views.public_discovey, name='discovey_home'),
     # Discovery view: URL used from "发现" for browsing a topic (read-only, no edit button)
     path('discovey/<path:topic_name>/', views.discovey, name='discovey'),
+    # "Load more" fragment: next page of entry cards for a topic (cursor pagination)
+    path('entries/more/<int:topic_id>/', views.more_entries, name='more_entries'),
     # Start as traveler quick entry: auto-login visitor as 'traveler' and redirect to first public topic.
     path('start_traveler/', views.start_traveler, name='start_traveler'),
     # Page for adding a new topic.
@@ -39,10 +41,21 @@ urlpatterns = [
     path('attachments/preview/<int:attachment_id>/', views.preview_attachment, name='preview_attachment'),
     # Attachment downloads
     path('attachments/download/<int:attachment_id>/', views.download_attachment, name='download_attachment'),
+    # 签名地址：不查数据库的附件快速通道（见 signed_media 模块）
+    path('m/<str:token>/<path:name>', views.signed_media_file, name='signed_media_file'),
     path('attachments/download_folder/', views.download_folder, name='download_folder'),
     # Attachment APIs
     path('attachments/delete/<int:attachment_id>/', views.delete_attachment, name='delete_attachment'),
     path('attachments/upload/', views.upload_attachments_api, name='upload_attachments_api'),
     path('attachments/delete_folder/', views.delete_folder_api, name='delete_folder_api'),
     path('attachments/list_folder/', views.list_folder_api, name='list_folder_api'),
+    # Resumable single-file uploads (create / PUT ranges / query offset / finalize)
+    path('attachments/preflight/', views.upload_preflight_api, name='upload_preflight_api'),
+    path('attachments/upload_archive/', views.upload_archive_api, name='upload_archive_api'),
+    path('attachments/extract/<int:attachment_id>/', views.extract_attachment_archive, name='extract_attachment_archive'),
+    path('attachments/upload_session/', views.upload_session_open, name='upload_session_open'),
+    path('attachments/upload_session/<str:key>/', views.upload_session_state, name='upload_session_state'),
+    path('attachments/resumable/', views.resumable_create, name='resumable_create'),
+    path('attachments/resumable/<str:token>/', views.resumable_upload, name='resumable_upload'),
+    path('attachments/resumable/<str:token>/finalize/', views.resumable_finalize, name='resumable_finalize'),
 ]
\ No newline at end of file
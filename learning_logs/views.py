@@ -3,13 +3,21 @@ from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import get_user_model, login as auth_login
 from django.http import Http404, JsonResponse, HttpResponseBadRequest
-from django.http import FileResponse
-from django.db.models import Q
-from django.views.decorators.http import require_POST
+from django.http import FileResponse, HttpResponseForbidden, HttpResponseNotFound, StreamingHttpResponse
+from django.db.models import Count, Max, Q, Sum
+from django.views.decorators.http import require_POST, require_http_methods
 from django.conf import settings
 from django.core.files.uploadedfile import UploadedFile
 
-from .models import Topic, Entry, Comment, Attachment
+from .models import Topic, Entry, Comment, Attachment, ResumableUpload, UploadSession
+from .loaders import attachment_roots, assemble_entries, paginate_entries
+from . import accel, archives, counters, folders, manifest, preflight, ranges, relocate, resumable, signed_media, upload_sessions, zipcache, zipstream
+from .idempotency import idempotent
+from .pagecache import etag_for, not_modified, public_page_cache
+import functools
+import mimetypes
+import os
+import posixpath
 import re
 from .forms import TopicForm, EntryForm, CommentForm
 from django.db import transaction
@@ -19,10 +27,15 @@ from django.conf import settings
 
 # Max files per folder allowed in a single upload (server-side enforcement)
 MAX_FOLDER_UPLOAD_FILES = getattr(settings, 'LL_MAX_FOLDER_UPLOAD_FILES', 10000)
+# 批量导入附件时每条 INSERT 包含的行数
+BULK_CREATE_BATCH = getattr(settings, 'LL_ATTACHMENT_BULK_CREATE_BATCH', 500)
+# 日记流每页条数（按 (date_added, id) 游标分页）
+ENTRY_PAGE_SIZE = getattr(settings, 'LL_ENTRY_PAGE_SIZE', 20)
 
 
-def _parse_relative_paths(post_data):
-    """Parse relative_paths_json or per-file relative_path[*] inputs from POST data.
+def _parse_relative_paths(post_data, files=None):
+    """Parse the streamed manifest part (see manifest module), relative_paths_json or per-file
+    relative_path[*] inputs from POST data.
     Returns (rel_index_map, rel_meta_map)
     - rel_index_map: dict mapping index (string) -> path
     - rel_meta_map: dict mapping 'name|size' -> path (from object entries)
@@ -30,7 +43,21 @@ def _parse_relative_paths(post_data):
     rel_index_map = {}
     rel_meta_map = {}
     rp_json = post_data.get('relative_paths_json')
-    if rp_json:
+    manifest_file = files.get(manifest.MANIFEST_FIELD) if files is not None else None
+    if manifest_file is not None:
+        try:
+            for i, path, name, size, lastm in manifest.iter_entries(manifest_file, limit=MAX_FOLDER_UPLOAD_FILES):
+                if name and size is not None and lastm is not None:
+                    rel_meta_map[f"{name}|{size}|{lastm}"] = path
+                elif name and size is not None:
+                    rel_meta_map[f"{name}|{size}"] = path
+                rel_index_map[str(i)] = path
+        except manifest.ManifestError as e:
+            import logging
+            logging.getLogger('learning_logs.upload').warning('Ignoring upload manifest: %s', e)
+            rel_index_map = {}
+            rel_meta_map = {}
+    elif rp_json:
         try:
             parsed = json.loads(rp_json)
             if isinstance(parsed, list):
@@ -76,13 +103,37 @@ def _parse_relative_paths(post_data):
     return rel_index_map, rel_meta_map
 
 
+def _visible_entries(topic, user):
+    """日记可见性：作者看到全部；其他人只看到公开的或自己写的日记。"""
+    if user.is_authenticated and user == topic.owner:
+        return topic.entry_set.all()
+    if user.is_authenticated:
+        return topic.entry_set.filter(Q(is_public=True) | Q(owner=user))
+    return topic.entry_set.filter(is_public=True)
+
+
+def _entry_page(request, entries, *, allow_modify=True):
+    """按 ?cursor= 取一页日记并批量装配，返回 (entries, next_cursor)。游标非法时回到第一页。"""
+    try:
+        page, next_cursor = paginate_entries(entries, request.GET.get('cursor'), ENTRY_PAGE_SIZE)
+    except ValueError:
+        page, next_cursor = paginate_entries(entries, None, ENTRY_PAGE_SIZE)
+    return assemble_entries(page, request.user, allow_modify=allow_modify), next_cursor
+
+
+def _topics_version(topics_qs):
+    """左侧日记本列表的版本：数量、最大 id 与各日记本 render_version 之和（一条聚合查询）。"""
+    agg = topics_qs.order_by().aggregate(n=Count('id'), top=Max('id'), v=Sum('render_version'))
+    return agg['n'], agg['top'], agg['v']
+
+
 def index(request):
     """Home page: 未登录展示登录/注册；已登录展示“发现”：左侧日记本列表，右侧浏览所选日记本下的日记。"""
     # 左侧日记本：已登录用户看到自己 + 公开，未登录用户仅看到公开
     if request.user.is_authenticated:
-        topics_qs = Topic.objects.filter(Q(owner=request.user) | Q(is_public=True)).order_by('-date_added')
+        topics_qs = Topic.objects.filter(Q(owner=request.user) | Q(is_public=True)).select_related('owner').order_by('-date_added')
     else:
-        topics_qs = Topic.objects.filter(is_public=True).order_by('-date_added')
+        topics_qs = Topic.objects.filter(is_public=True).select_related('owner').order_by('-date_added')
 
     # 选中的日记本：支持通过 ?t=<id> 指定；若未指定，则默认选择第一个（便于匿名用户点击“立即开始”后看到内容）
     selected_topic = None
@@ -96,21 +147,27 @@ def index(request):
     if selected_topic is None and topics_qs.exists():
         selected_topic = topics_qs.first()
 
-    # 右侧日记列表：若无选中则为空
+    etag = etag_for(request, *_topics_version(topics_qs), getattr(selected_topic, 'pk', None))
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+
+    # 右侧日记列表：若无选中则为空；对于未登录或非作者用户，仅展示公开或属于当前用户（若登录）的日记
     entries = None
+    next_cursor = None
     if selected_topic is not None:
-        if request.user.is_authenticated and request.user == selected_topic.owner:
-            entries = selected_topic.entry_set.order_by('-date_added')
-        else:
-            # 对于未登录或非作者用户，仅展示公开或属于当前用户（若登录）的日记
-            entries = selected_topic.entry_set.filter(Q(is_public=True) | Q(owner=request.user) if request.user.is_authenticated else Q(is_public=True)).order_by('-date_added')
+        entries, next_cursor = _entry_page(request, _visible_entries(selected_topic, request.user))
 
     context = {
         'discover_topics': topics_qs,
         'selected_topic': selected_topic,
         'entries': entries,
+        'next_cursor': next_cursor,
+        'entries_mode': 'discovery',
     }
-    return render(request, 'learning_logs/index.html', context)
+    response = render(request, 'learning_logs/index.html', context)
+    response['ETag'] = etag
+    return response
 
 
 def start_traveler(request):
@@ -161,62 +218,23 @@ def topics(request):
     context = {'topics': topics}
     return render(request, 'learning_logs/topics.html', context)
 
-def build_attachment_tree(attachments):
-    """将扁平的附件列表构造成树状结构（字典）。"""
-    tree = {}
-    for att in attachments:
-        # 使用 original_name 以防 relative_path 为空
-        path = att.relative_path or att.original_name
-        parts = path.split('/')
-        
-        current_level = tree
-        for i, part in enumerate(parts):
-            if i == len(parts) - 1:
-                # 文件节点
-                if 'files' not in current_level:
-                    current_level['files'] = []
-                current_level['files'].append(att)
-            else:
-                # 目录节点
-                if 'dirs' not in current_level:
-                    current_level['dirs'] = {}
-                if part not in current_level['dirs']:
-                    current_level['dirs'][part] = {}
-                current_level = current_level['dirs'][part]
-    return tree
-
-
 def topic(request, topic_name, username=None):
     """按名称展示单个日记本及其日记，遵循可见性规则。"""
     # If username provided, prefer topic owned by that username
     topic = _resolve_topic_by_name_for_user(topic_name, request.user, username=username)
 
-    # 条目可见性：
-    if request.user == topic.owner:
-        entries = topic.entry_set.order_by('-date_added')
-    else:
-        entries = topic.entry_set.filter(Q(is_public=True) | Q(owner=request.user)).order_by('-date_added')
+    # 日记本及其下任何内容变化都会递增 topic.render_version，未变化时直接返回 304
+    etag = etag_for(request, topic.pk, topic.render_version)
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
 
-    # 为每个 entry 构建附件树
-    for entry in entries:
-        entry.attachment_tree = build_attachment_tree(entry.attachment_set.all())
-        # 预计算顶级评论 QuerySet，模板中直接使用，避免在模板里调用带参数的方法导致解析问题
-        try:
-            entry.top_comments = entry.comment_set.filter(parent__isnull=True)
-        except Exception:
-            entry.top_comments = entry.comment_set.none()
-        # 为该 entry 下的每条评论构建附件树与编辑权限标志
-        for c in entry.comment_set.all():
-            try:
-                c.attachment_tree = build_attachment_tree(c.attachment_set.all())
-            except Exception:
-                c.attachment_tree = {}
-            # 评论附件的编辑权限：评论作者或日记作者可修改
-            c.allow_modify = bool((c.user and c.user == request.user) or (entry.owner == request.user))
+    # 条目可见性见 _visible_entries；按游标取一页并批量装配附件树、评论与回复（固定查询次数）
+    entries, next_cursor = _entry_page(request, _visible_entries(topic, request.user))
 
     # 为 topic 本身构建附件树，过滤掉还带 upload_session 的临时资源
     try:
-        topic.attachment_tree = build_attachment_tree(topic.attachment_set.filter(upload_session__isnull=True).all())
+        topic.attachment_tree = attachment_roots('topic', topic.id)
     except Exception as e:
         try:
             import logging
@@ -228,10 +246,13 @@ def topic(request, topic_name, username=None):
         topic.attachment_tree = {}
 
     comment_form = CommentForm()
-    context = {'topic': topic, 'entries': entries, 'comment_form': comment_form}
-    return render(request, 'learning_logs/topic.html', context)
+    context = {'topic': topic, 'entries': entries, 'comment_form': comment_form, 'next_cursor': next_cursor, 'entries_mode': 'topic'}
+    response = render(request, 'learning_logs/topic.html', context)
+    response['ETag'] = etag
+    return response
 
 
+@public_page_cache
 def discovey(request, topic_name, username=None):
     """Discovery route: render the same layout as index but for a specific topic name.
     This is used from the "发现" page and is read-only (no edit links shown there).
@@ -239,47 +260,38 @@ def discovey(request, topic_name, username=None):
     """
     topic = _resolve_topic_by_name_for_user(topic_name, request.user, username=username)
 
-    # 条目可见性：与 topic 视图一致
-    if request.user == topic.owner:
-        entries = topic.entry_set.order_by('-date_added')
-    else:
-        entries = topic.entry_set.filter(Q(is_public=True) | Q(owner=request.user)).order_by('-date_added')
+    # 左侧的可发现日记本列表（兼容匿名用户）
+    topics_qs = Topic.objects.filter(Q(owner=request.user) | Q(is_public=True)).select_related('owner').order_by('-date_added') if request.user.is_authenticated else Topic.objects.filter(is_public=True).select_related('owner').order_by('-date_added')
 
-    # 为每个 entry 构建附件树
-    for entry in entries:
-        entry.attachment_tree = build_attachment_tree(entry.attachment_set.all())
-        # 预计算顶级评论 QuerySet，模板中直接使用，避免在模板里调用带参数的方法导致解析问题
-        try:
-            entry.top_comments = entry.comment_set.filter(parent__isnull=True)
-        except Exception:
-            entry.top_comments = entry.comment_set.none()
-        # 为该 entry 下的每条评论构建附件树与编辑权限标志
-        for c in entry.comment_set.all():
-            try:
-                c.attachment_tree = build_attachment_tree(c.attachment_set.all())
-            except Exception:
-                c.attachment_tree = {}
-            c.allow_modify = bool((c.user and c.user == request.user) or (entry.owner == request.user))
+    etag = etag_for(request, topic.pk, *_topics_version(topics_qs))
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+
+    # 条目可见性：与 topic 视图一致
+    entries, next_cursor = _entry_page(request, _visible_entries(topic, request.user))
 
     # 为 topic 本身构建附件树
-    topic.attachment_tree = build_attachment_tree(topic.attachment_set.filter(upload_session__isnull=True).all())
+    topic.attachment_tree = attachment_roots('topic', topic.id)
 
     comment_form = CommentForm()
 
-    # 左侧的可发现日记本列表（兼容匿名用户）
-    topics_qs = Topic.objects.filter(Q(owner=request.user) | Q(is_public=True)).order_by('-date_added') if request.user.is_authenticated else Topic.objects.filter(is_public=True).order_by('-date_added')
-
     context = {
         'discover_topics': topics_qs,
         'selected_topic': topic,
         'entries': entries,
+        'next_cursor': next_cursor,
+        'entries_mode': 'discovery',
         'comment_form': comment_form,
         # 标记为发现页视图，模板可据此在匿名情况下隐藏首页 hero
         'is_discovery_view': True,
     }
-    return render(request, 'learning_logs/index.html', context)
+    response = render(request, 'learning_logs/index.html', context)
+    response['ETag'] = etag
+    return response
 
 
+@public_page_cache
 def public_discovey(request):
     """Public discovery landing: allow anonymous users to browse public topics and entries.
 
@@ -287,33 +299,61 @@ def public_discovey(request):
     so the left topic list and right entry column are populated for unauthenticated visitors.
     """
     # public topics only
-    topics_qs = Topic.objects.filter(is_public=True).order_by('-date_added')
+    topics_qs = Topic.objects.filter(is_public=True).select_related('owner').order_by('-date_added')
+    etag = etag_for(request, *_topics_version(topics_qs))
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
     selected_topic = topics_qs.first() if topics_qs.exists() else None
 
     entries = None
+    next_cursor = None
     if selected_topic:
-        entries = selected_topic.entry_set.filter(is_public=True).order_by('-date_added')
-        for entry in entries:
-            entry.attachment_tree = build_attachment_tree(entry.attachment_set.all())
-            try:
-                entry.top_comments = entry.comment_set.filter(parent__isnull=True)
-            except Exception:
-                entry.top_comments = entry.comment_set.none()
-            for c in entry.comment_set.all():
-                try:
-                    c.attachment_tree = build_attachment_tree(c.attachment_set.all())
-                except Exception:
-                    c.attachment_tree = {}
-                c.allow_modify = False
+        entries, next_cursor = _entry_page(request, selected_topic.entry_set.filter(is_public=True), allow_modify=False)
 
     context = {
         'discover_topics': topics_qs,
         'selected_topic': selected_topic,
         'entries': entries,
+        'next_cursor': next_cursor,
+        'entries_mode': 'public',
         'comment_form': CommentForm(),
         'is_discovery_view': True,
     }
-    return render(request, 'learning_logs/index.html', context)
+    response = render(request, 'learning_logs/index.html', context)
+    response['ETag'] = etag
+    return response
+
+def more_entries(request, topic_id):
+    """“加载更多”片段：按 ?cursor= 返回下一页日记卡片的 HTML。
+
+    ?mode=topic|discovery|public 与整页视图保持一致的可见性与按钮：
+    public 只含公开日记且评论附件不可修改；topic 显示“编辑日记”按钮。
+    """
+    topic = get_object_or_404(Topic.objects.select_related('owner'), id=topic_id)
+    mode = request.GET.get('mode') or 'discovery'
+    if mode not in {'topic', 'discovery', 'public'}:
+        return HttpResponseBadRequest('invalid mode')
+    if mode == 'public':
+        if not topic.is_public:
+            raise Http404
+        entries = topic.entry_set.filter(is_public=True)
+    else:
+        if topic.owner != request.user and not topic.is_public:
+            raise Http404
+        entries = _visible_entries(topic, request.user)
+    try:
+        page, next_cursor = paginate_entries(entries, request.GET.get('cursor'), ENTRY_PAGE_SIZE)
+    except ValueError:
+        return HttpResponseBadRequest('invalid cursor')
+    context = {
+        'entries': assemble_entries(page, request.user, allow_modify=(mode != 'public')),
+        'next_cursor': next_cursor,
+        'page_topic': topic,
+        'entries_mode': mode,
+        'show_edit': mode == 'topic',
+    }
+    return render(request, 'learning_logs/_entries_page.html', context)
 
 @login_required
 def new_topic(request):
@@ -345,7 +385,7 @@ def new_topic(request):
             # 支持两种前端传参格式：
             # 1) 多个 hidden inputs: relative_path[0]=..., relative_path[1]=... （向后兼容）
             # 2) 单个 hidden JSON 字段: relative_paths_json = JSON array or dict
-            rel_index_map, rel_meta_map = _parse_relative_paths(request.POST)
+            rel_index_map, rel_meta_map = _parse_relative_paths(request.POST, request.FILES)
             _save_attachments_from_request(files, request.user, topic=new_topic, relative_paths=rel_index_map, relative_meta=rel_meta_map)
             return redirect('learning_logs:topics')
 
@@ -381,7 +421,7 @@ def new_entry(request, topic_id):
             form.add_error(None, '上传的表单内容无法解析（可能文件过大或请求异常）。')
             files = []
         # 支持文件夹上传：前端通过 single JSON hidden input `relative_paths_json` 或多个 hidden inputs `relative_path[...]`
-        rel_index_map, rel_meta_map = _parse_relative_paths(request.POST)
+        rel_index_map, rel_meta_map = _parse_relative_paths(request.POST, request.FILES)
         # 简短调试日志（仅在需要时可查看）
         try:
             import logging
@@ -411,15 +451,20 @@ def new_entry(request, topic_id):
                 # reassign any topic-level attachments for this upload_session to this new entry.
                 session_key = request.POST.get('upload_session')
                 if session_key:
+                    n = 0
                     try:
-                        reassigned = Attachment.objects.filter(topic=topic, owner=request.user, entry__isnull=True, upload_session=session_key)
-                        for a in reassigned:
-                            a.entry = new_entry
-                            a.upload_session = None
-                            a.save()
+                        # 一条 UPDATE 完成转挂；表单直接上传的附件没有 topic，moved 只会选中转挂过来的这批
+                        with transaction.atomic():
+                            n = Attachment.objects.filter(topic=topic, owner=request.user, entry__isnull=True, upload_session=session_key).update(entry=new_entry, upload_session=None)
+                            if n:
+                                # 转挂不是新建，post_save 不计数；这里一次性计入新日记并建立文件夹索引
+                                counters.reassigned_to_entry(Attachment.objects.filter(entry=new_entry, topic=topic))
+                                # 文件仍在日记本目录下，提交后在后台移到日记目录
+                                relocate.schedule(new_entry.id)
+                            UploadSession.objects.filter(key=session_key, owner=request.user).delete()
                         try:
                             import logging
-                            logging.getLogger('learning_logs.new_entry').debug('reassigned %s topic attachments to entry id=%s for session=%s', reassigned.count(), new_entry.id, session_key)
+                            logging.getLogger('learning_logs.new_entry').debug('reassigned %s topic attachments to entry id=%s for session=%s', n, new_entry.id, session_key)
                         except Exception:
                             pass
                     except Exception:
@@ -428,7 +473,7 @@ def new_entry(request, topic_id):
                     # If there were no reassigned attachments, log a debug message so we can see whether session matched
                     try:
                         import logging
-                        if session_key and reassigned.count() == 0:
+                        if n == 0:
                             logging.getLogger('learning_logs.new_entry').warning('No topic attachments found to reassign for session=%s topic=%s owner=%s', session_key, topic.id, request.user.id)
                     except Exception:
                         pass
@@ -441,7 +486,7 @@ def new_entry(request, topic_id):
     # Display a blank or invalid form.
     # 构建日记本附件树供页面展示
     try:
-        topic.attachment_tree = build_attachment_tree(topic.attachment_set.filter(upload_session__isnull=True).all())
+        topic.attachment_tree = attachment_roots('topic', topic.id)
     except Exception:
         topic.attachment_tree = {}
     context = {'topic': topic, 'form': form}
@@ -483,7 +528,7 @@ def edit_entry(request, entry_id):
                 log = logging.getLogger('learning_logs.edit_entry')
                 log.exception('Failed to parse uploaded files in edit_entry: %s', e)
                 files = []
-            rel_index_map, rel_meta_map = _parse_relative_paths(request.POST)
+            rel_index_map, rel_meta_map = _parse_relative_paths(request.POST, request.FILES)
             try:
                 import logging
                 log = logging.getLogger('learning_logs.edit_entry')
@@ -499,7 +544,7 @@ def edit_entry(request, entry_id):
 
     # 构建本日记附件树供页面展示
     try:
-        entry.attachment_tree = build_attachment_tree(entry.attachment_set.all())
+        entry.attachment_tree = attachment_roots('entry', entry.id)
     except Exception:
         entry.attachment_tree = {}
     context = {'entry': entry, 'topic': topic, 'form': form}
@@ -534,7 +579,54 @@ def delete_entry(request, entry_id):
     })
 
 
-def _save_attachments_from_request(files, owner, *, topic=None, entry=None, comment=None, relative_paths=None, relative_meta=None, upload_session=None):
+def _relative_path_lookup(relative_paths, relative_meta):
+    """为一批上传文件预建相对路径索引，返回 resolve(idx, name, size) -> (path, source)。
+
+    查找顺序与结果同以往逐个扫描一致：先按序号；再按文件名，即某个路径等于文件名、
+    或以 '/文件名' / '\\文件名' 结尾（取最先出现的路径）；最后按 'name|size'（取最先出现的键）。
+    每个文件只做哈希查找，不再扫描全部路径。
+    """
+    rel_map = {}
+    for idx, rp in (relative_paths or {}).items():
+        try:
+            rel_map[int(idx)] = rp
+        except Exception:
+            rel_map[str(idx)] = rp
+    by_name = {}
+    for v in rel_map.values():
+        if not isinstance(v, str):
+            continue
+        by_name.setdefault(v, v)
+        for i, ch in enumerate(v):
+            if ch == '/' or ch == '\\':
+                by_name.setdefault(v[i + 1:], v)
+    by_meta = {}
+    for k, v in (relative_meta or {}).items():
+        parts = str(k).split('|', 2)
+        if len(parts) >= 2:
+            by_meta.setdefault((parts[0], parts[1]), v)
+
+    def resolve(idx, name, size):
+        rp_raw, source = None, None
+        if idx in rel_map:
+            rp_raw, source = rel_map[idx], 'index'
+        if not rp_raw and isinstance(name, str) and name in by_name:
+            rp_raw, source = by_name[name], 'basename'
+        if not rp_raw and (name, str(size)) in by_meta:
+            rp_raw, source = by_meta[(name, str(size))], 'meta'
+        return rp_raw, source
+
+    return resolve
+
+
+def _save_attachments_from_request(files, owner, *, topic=None, entry=None, comment=None, relative_paths=None, relative_meta=None, upload_session=None, failures=None, keep_stored=False):
+    """保存一批上传文件，返回新建的附件列表。
+
+    先逐个把文件写入存储，再在一个事务中 bulk_create 全部记录并按归属一次性更新计数与文件夹索引；
+    单个文件写入失败时跳过，并在 failures（若传入列表）中追加 {'index', 'name', 'error'}。
+    记录写入失败时默认删除已存入存储的文件；keep_stored 时保留，并在 failures 中给出 'stored'（存储文件名），
+    由调用方处理（如续传的临时文件已被移入存储）。
+    """
     if not files:
         return []
     try:
@@ -543,23 +635,8 @@ def _save_attachments_from_request(files, owner, *, topic=None, entry=None, comm
             len(files), list(relative_paths.keys()) if relative_paths else [], list(relative_meta.keys()) if relative_meta else [], getattr(topic,'id', None), getattr(entry,'id', None), getattr(comment,'id', None), upload_session)
     except Exception:
         pass
-    created = []
-    rel_map = {}
-    meta_map = {}
-    if relative_paths:
-        # relative_paths may be a mapping of numeric indices to paths or be a dict/list parsed from JSON
-        for idx, rp in relative_paths.items():
-            try:
-                rel_map[int(idx)] = rp
-            except Exception:
-                # keep non-numeric mapping as-is; we'll also build name-based fallback later
-                rel_map[str(idx)] = rp
-    if relative_meta:
-        for k, v in relative_meta.items():
-            try:
-                meta_map[str(k)] = v
-            except Exception:
-                continue
+    prepared = []
+    resolve_path = _relative_path_lookup(relative_paths, relative_meta)
 
     def _sanitize_rel_path(p: str) -> str:
         """清洗相对路径，确保：
@@ -606,51 +683,8 @@ def _save_attachments_from_request(files, owner, *, topic=None, entry=None, comm
             derived_public = True
         att = Attachment(owner=owner, topic=topic, entry=entry, comment=comment, file=f, is_public=derived_public)
         att.original_name = getattr(f, 'name', '')
-        # Attempt to find a relative path for this file in several ways
-        rp_raw = None
-        matched_source = None
-        # 1) Index-based mapping (preferred; used for chunked uploads)
-        try:
-            if idx in rel_map:
-                rp_raw = rel_map[idx]
-                matched_source = 'index'
-        except Exception:
-            # rel_map keys might be strings; try string keys as fallback
-            try:
-                if str(idx) in rel_map:
-                    rp_raw = rel_map[str(idx)]
-                    matched_source = 'index'
-            except Exception:
-                pass
-
-        # 2) Basename mapping: if any provided relative path ends with the filename
-        if not rp_raw and rel_map:
-            for v in rel_map.values():
-                try:
-                    if not isinstance(v, str):
-                        continue
-                    if v.endswith('/' + f.name) or v.endswith('\\' + f.name) or v == f.name:
-                        rp_raw = v
-                        matched_source = 'basename'
-                        break
-                except Exception:
-                    continue
-
-        # 3) Meta mapping by name|size
-        if not rp_raw and meta_map:
-            try:
-                n = getattr(f, 'name', '')
-                s = getattr(f, 'size', '')
-                for k, v in meta_map.items():
-                    try:
-                        if k.split('|', 2)[0] == n and str(k.split('|', 2)[1]) == str(s):
-                            rp_raw = v
-                            matched_source = 'meta'
-                            break
-                    except Exception:
-                        continue
-            except Exception:
-                pass
+        # 依次按序号、文件名、name|size 查找相对路径
+        rp_raw, matched_source = resolve_path(idx, getattr(f, 'name', None), getattr(f, 'size', ''))
 
         if rp_raw:
             _rp = _sanitize_rel_path(rp_raw)
@@ -671,30 +705,58 @@ def _save_attachments_from_request(files, owner, *, topic=None, entry=None, comm
         else:
             try:
                 import logging
-                logging.getLogger('learning_logs.save_attach').debug('No relative path match for file idx=%s name=%s size=%s rel_map_keys=%s meta_keys_sample=%s', idx, getattr(f,'name',None), getattr(f,'size',None), list(rel_map.keys())[:5], list(meta_map.keys())[:5])
+                logging.getLogger('learning_logs.save_attach').debug('No relative path match for file idx=%s name=%s size=%s rel_map_keys=%s meta_keys_sample=%s', idx, getattr(f,'name',None), getattr(f,'size',None), list(relative_paths or {})[:5], list(relative_meta or {})[:5])
             except Exception:
                 pass
-        if upload_session:
+        # upload_session 只用于 new_entry 把 topic 级临时附件转挂到新日记，其它归属不保留
+        if upload_session and topic is not None and entry is None and comment is None:
             att.upload_session = upload_session
         try:
-            att.save()
+            att.prepare()
+            # 写入存储（文件名由 upload_to 决定）；之后 bulk_create 不再重复写入
+            att.file.save(att.file.name, f, save=False)
         except Exception:
-            # If saving a single attachment fails (e.g. storage error, name issue), log and continue with others
+            # If storing a single attachment fails (e.g. storage error, name issue), log and continue with others
             try:
                 import logging
                 log = logging.getLogger('learning_logs.save_attach')
-                log.exception('Failed to save attachment for file index=%s name=%s owner=%s topic=%s entry=%s', idx, getattr(att, 'original_name', None), getattr(owner, 'id', None), getattr(topic, 'id', None) if topic else None, getattr(entry, 'id', None) if entry else None)
+                log.exception('Failed to store attachment for file index=%s name=%s owner=%s topic=%s entry=%s', idx, getattr(att, 'original_name', None), getattr(owner, 'id', None), getattr(topic, 'id', None) if topic else None, getattr(entry, 'id', None) if entry else None)
             except Exception:
                 pass
+            if failures is not None:
+                failures.append({'index': idx, 'name': getattr(f, 'name', ''), 'error': 'storage error'})
             continue
-        try:
-            import logging
-            log = logging.getLogger('learning_logs.save_attach')
-            log.debug('Saved attachment id=%s name=%s rel=%s owner=%s topic=%s entry=%s comment=%s', att.id, att.original_name, att.relative_path, getattr(owner, 'id', None), getattr(att.topic, 'id', None), getattr(att.entry, 'id', None), getattr(att.comment, 'id', None))
-        except Exception:
-            pass
-        created.append(att)
-    return created
+        prepared.append((idx, att))
+    if not prepared:
+        return []
+    try:
+        with transaction.atomic(), counters.suspended():
+            attachments = Attachment.objects.bulk_create([att for _, att in prepared], batch_size=BULK_CREATE_BATCH)
+            counters.add_created(attachments)
+            # 整批计入文件夹索引（upload_session 附件在转挂时才计入）
+            folders.index_attachments(attachments)
+    except Exception:
+        import logging
+        logging.getLogger('learning_logs.save_attach').exception('Failed to insert %s attachments owner=%s', len(prepared), getattr(owner, 'id', None))
+        # 记录没能写入，已存入存储的文件不再有归属
+        for idx, att in prepared:
+            if keep_stored:
+                if failures is not None:
+                    failures.append({'index': idx, 'name': att.original_name, 'error': 'database error', 'stored': att.file.name})
+                continue
+            try:
+                att.file.storage.delete(att.file.name)
+            except Exception:
+                pass
+            if failures is not None:
+                failures.append({'index': idx, 'name': att.original_name, 'error': 'database error'})
+        return []
+    try:
+        import logging
+        logging.getLogger('learning_logs.save_attach').debug('Saved %s attachments owner=%s topic=%s entry=%s comment=%s', len(attachments), getattr(owner, 'id', None), getattr(topic, 'id', None), getattr(entry, 'id', None), getattr(comment, 'id', None))
+    except Exception:
+        pass
+    return attachments
 
 
 @login_required
@@ -768,53 +830,23 @@ def delete_folder_api(request):
     count = targets.count()
     if not count:
         return JsonResponse({'ok': True, 'deleted': 0})
-    with transaction.atomic():
-        for att in targets:
-            att.delete()
+    # 一次聚合扣减计数后批量删除；文件由 post_delete 信号逐个清理
+    counters.delete_attachments(targets)
     return JsonResponse({'ok': True, 'deleted': count})
 
 
 @login_required
 @require_POST
+@idempotent
 def upload_attachments_api(request):
     """异步上传接口：支持多文件与文件夹（相对路径）。
     期望前端 name=files，多值；对应相对路径通过 formData.append('relative_path[index]', path)
     需提供 parent_type 与 parent_id 指向归属（topic/entry/comment）。
     """
     try:
-        parent_type = request.POST.get('parent_type')
-        parent_id = request.POST.get('parent_id')
-        if parent_type not in {'topic', 'entry', 'comment'}:
-            return JsonResponse({'ok': False, 'error': 'invalid parent_type'}, status=400)
-        try:
-            parent_id_int = int(parent_id)
-        except Exception:
-            return JsonResponse({'ok': False, 'error': 'invalid parent_id'}, status=400)
-
-        parent_obj = None
-        kw = {'topic': None, 'entry': None, 'comment': None}
-        if parent_type == 'topic':
-            parent_obj = get_object_or_404(Topic, id=parent_id_int)
-            kw['topic'] = parent_obj
-        elif parent_type == 'entry':
-            parent_obj = get_object_or_404(Entry, id=parent_id_int)
-            kw['entry'] = parent_obj
-        else:
-            parent_obj = get_object_or_404(Comment, id=parent_id_int)
-            kw['comment'] = parent_obj
-
-        # 权限：必须是作者或符合创建附件的约束（例如公开 topic 允许匿名/其他用户在其下添加日记）
-        if parent_type == 'topic':
-            if not (parent_obj.owner == request.user or (parent_obj.is_public and request.user.is_authenticated)):
-                raise Http404
-        elif parent_type == 'entry':
-            if parent_obj.owner != request.user:
-                raise Http404
-        elif parent_type == 'comment':
-            if parent_obj.user != request.user:
-                raise Http404
-
-        # 从这里继续正常逻辑
+        kw = _upload_parent(request.user, request.POST.get('parent_type'), request.POST.get('parent_id'))
+    except ValueError as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=400)
     except Exception as e:
         import logging
         logging.getLogger('learning_logs.upload').exception('Unexpected error before file parsing in upload_attachments_api: %s', e)
@@ -841,18 +873,11 @@ def upload_attachments_api(request):
     except Exception:
         pass
 
-    # Parse relative paths from POST (supports object list with name/size/path)
-    # Defensive: if client sent extremely large JSON, limit its length
-    rp_json = request.POST.get('relative_paths_json')
-    if isinstance(rp_json, str) and len(rp_json) > 20000:
-        try:
-            import logging
-            logging.getLogger('learning_logs.upload').warning('relative_paths_json unusually large, truncating length=%s', len(rp_json))
-        except Exception:
-            pass
-        # truncate to avoid parsing overly large payloads
-        rp_json = rp_json[:20000]
-    rel_index_map, rel_meta_map = _parse_relative_paths(request.POST)
+    # Parse relative paths: streamed manifest part, or legacy relative_paths_json / relative_path[i] fields
+    rel_index_map, rel_meta_map = _parse_relative_paths(request.POST, request.FILES)
+    upload_session, session, error = _upload_session_for(request, kw)
+    if error:
+        return error
     try:
         try:
             import logging
@@ -861,8 +886,10 @@ def upload_attachments_api(request):
             upload_log.debug('upload_attachments_api files=%s total_bytes=%s names=%s rel_index_map_keys=%s rel_meta_map_keys_sample=%s referer=%s', len(files), total_bytes, [getattr(f, 'name', None) for f in files], list(rel_index_map.keys()), list(rel_meta_map.keys())[:10], request.META.get('HTTP_REFERER'))
         except Exception:
             pass
-        upload_session = request.POST.get('upload_session')
-        created = _save_attachments_from_request(files, request.user, **kw, relative_paths=rel_index_map, relative_meta=rel_meta_map, upload_session=upload_session)
+        failed = []
+        created = _save_attachments_from_request(files, request.user, **kw, relative_paths=rel_index_map, relative_meta=rel_meta_map, upload_session=upload_session, failures=failed)
+        # 同一会话的多个分块可能并发到达，进度以 F() 累加
+        upload_sessions.record(session, len(created), sum(a.size or 0 for a in created))
         try:
             import logging
             upl = logging.getLogger('learning_logs.upload')
@@ -875,20 +902,293 @@ def upload_attachments_api(request):
         log = logging.getLogger('learning_logs.upload')
         log.exception('Error saving attachments: %s', e)
         return JsonResponse({'ok': False, 'error': 'Server error when saving attachments.'}, status=500)
-    data = []
-    for a in created:
-        data.append({
-            'id': a.id,
-            'name': a.original_name,
-            'url': a.file.url,
-            'is_image': a.is_image,
-            'is_text': a.is_text_like,
-            'is_audio': a.is_audio,
-            'is_video': a.is_video,
-            'size': a.size,
-            'relative_path': a.relative_path,
-        })
-    return JsonResponse({'ok': True, 'files': data})
+    # 部分文件失败时仍返回成功保存的部分，failed 列出失败文件的序号与原因
+    return JsonResponse({'ok': True, 'files': [_attachment_json(a) for a in created], 'failed': failed})
+
+
+def _ingest_archive(request, fileobj, kw, *, prefix='', upload_session=None, session=None):
+    """把归档中的文件逐批存为 kw 指定归属下的附件（见 archives 模块），返回 JsonResponse。
+
+    超出文件数 / 大小上限或归档损坏时，已入库的附件全部撤销并返回 400。
+    """
+    created, failed, skipped = [], [], []
+    try:
+        for batch in archives.iter_batches(fileobj, max_files=MAX_FOLDER_UPLOAD_FILES, prefix=prefix,
+                                           request=request, skipped=skipped):
+            batch_failed = []
+            try:
+                saved = _save_attachments_from_request(
+                    [f for _, f in batch], request.user, **kw,
+                    relative_paths={i: path for i, (path, _) in enumerate(batch)},
+                    upload_session=upload_session, failures=batch_failed)
+            finally:
+                for _, f in batch:
+                    f.close()
+            created.extend(saved)
+            failed.extend({'name': batch[x['index']][0], 'error': x['error']} for x in batch_failed)
+            upload_sessions.record(session, len(saved), sum(a.size or 0 for a in saved))
+    except archives.ArchiveError as e:
+        if created:
+            counters.delete_attachments(Attachment.objects.filter(pk__in=[a.pk for a in created]))
+        return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+    return JsonResponse({'ok': True, 'files': [_attachment_json(a) for a in created],
+                         'failed': failed, 'skipped': skipped})
+
+
+@login_required
+@require_POST
+@idempotent
+def upload_archive_api(request):
+    """以单个 tar（可 gzip 等压缩）或 zip 作为请求体批量上传，展开为附件。
+
+    参数放在查询串中：parent_type, parent_id, 可选 prefix（放入的目录）与 upload_session。
+    """
+    try:
+        kw = _upload_parent(request.user, request.GET.get('parent_type'), request.GET.get('parent_id'))
+    except ValueError as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+    except Http404:
+        return JsonResponse({'ok': False, 'error': 'Invalid upload request.'}, status=400)
+    upload_session, session, error = _upload_session_for(request, kw, request.GET)
+    if error:
+        return error
+    try:
+        declared = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        declared = 0
+    if declared > archives.ARCHIVE_MAX_BYTES:
+        return JsonResponse({'ok': False, 'error': f'Archive too large (max {archives.ARCHIVE_MAX_BYTES} bytes).'}, status=400)
+    return _ingest_archive(request, request, kw, prefix=request.GET.get('prefix') or '',
+                           upload_session=upload_session, session=session)
+
+
+@login_required
+@require_POST
+def extract_attachment_archive(request, attachment_id):
+    """把已上传的 zip / tar 附件展开到同一归属下，默认放在与归档同名的目录中（POST 可选 prefix）。"""
+    att = get_object_or_404(Attachment, id=attachment_id, owner=request.user, upload_session__isnull=True)
+    parent_type = 'entry' if att.entry_id else 'comment' if att.comment_id else 'topic'
+    try:
+        _upload_parent(request.user, parent_type, getattr(att, f'{parent_type}_id'))
+    except ValueError:
+        raise Http404
+    # 转挂过的附件同时属于日记本与日记，展开出的文件沿用同样的归属
+    kw = {'topic': att.topic, 'entry': att.entry, 'comment': att.comment}
+    stem = att.original_name
+    for ext in ('.tar.gz', '.tar.bz2', '.tar.xz', '.tgz', '.tar', '.zip'):
+        if stem.lower().endswith(ext):
+            stem = stem[:-len(ext)]
+            break
+    default_prefix = '/'.join(p for p in (att.folder_path, stem) if p)
+    try:
+        fileobj = att.file.open('rb')
+    except (FileNotFoundError, OSError):
+        raise Http404
+    with fileobj:
+        return _ingest_archive(request, fileobj, kw, prefix=request.POST.get('prefix') or default_prefix)
+
+
+@login_required
+@require_POST
+def upload_preflight_api(request):
+    """重新同步文件夹前的预检（见 preflight 模块）。
+
+    POST: parent_type, parent_id, manifest（文件部分，格式同上传清单，每个文件附 SHA-256），可选 prune=1。
+    返回 unchanged / upload（清单中的文件序号）与 stale；prune 时同时删除 stale。
+    """
+    try:
+        kw = _upload_parent(request.user, request.POST.get('parent_type'), request.POST.get('parent_id'))
+    except ValueError as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+    except Http404:
+        return JsonResponse({'ok': False, 'error': 'Invalid upload request.'}, status=400)
+    manifest_file = request.FILES.get(manifest.MANIFEST_FIELD)
+    if manifest_file is None:
+        return JsonResponse({'ok': False, 'error': 'missing manifest'}, status=400)
+    parent = {k: v for k, v in kw.items() if v is not None}
+    if kw['topic'] is not None:
+        # 已转挂到日记的附件不算日记本自身的文件
+        parent['entry__isnull'] = True
+    try:
+        entries = list(manifest.iter_entries(manifest_file, limit=MAX_FOLDER_UPLOAD_FILES, with_digest=True))
+    except manifest.ManifestError as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+    result = preflight.compare(entries, request.user, prune=request.POST.get('prune') in ('1', 'true'), **parent)
+    return JsonResponse({'ok': True, **result})
+
+
+def _upload_parent(user, parent_type, parent_id):
+    """解析上传目标并校验权限，返回 {'topic': ..., 'entry': ..., 'comment': ...}（只有一个非空）。
+
+    参数非法抛 ValueError（消息即错误码），对象不存在或无权上传抛 Http404。
+    """
+    if parent_type not in {'topic', 'entry', 'comment'}:
+        raise ValueError('invalid parent_type')
+    try:
+        parent_id_int = int(parent_id)
+    except Exception:
+        raise ValueError('invalid parent_id')
+
+    kw = {'topic': None, 'entry': None, 'comment': None}
+    if parent_type == 'topic':
+        parent_obj = get_object_or_404(Topic, id=parent_id_int)
+    elif parent_type == 'entry':
+        parent_obj = get_object_or_404(Entry, id=parent_id_int)
+    else:
+        parent_obj = get_object_or_404(Comment, id=parent_id_int)
+    kw[parent_type] = parent_obj
+
+    # 权限：必须是作者或符合创建附件的约束（例如公开 topic 允许匿名/其他用户在其下添加日记）
+    if parent_type == 'topic':
+        if not (parent_obj.owner == user or (parent_obj.is_public and user.is_authenticated)):
+            raise Http404
+    elif parent_type == 'entry':
+        if parent_obj.owner != user:
+            raise Http404
+    elif parent_type == 'comment':
+        if parent_obj.user != user:
+            raise Http404
+    return kw
+
+
+def _upload_session_for(request, kw, params=None):
+    """取出请求中的 upload_session（只对日记本级上传有意义），返回 (key, 会话, 错误响应)。"""
+    key = (request.POST if params is None else params).get('upload_session') or None
+    if not key or kw.get('topic') is None:
+        return key, None, None
+    try:
+        session = upload_sessions.resolve(key, request.user)
+    except ValueError as e:
+        return key, None, JsonResponse({'ok': False, 'error': str(e)}, status=400)
+    return key, session, None
+
+
+@login_required
+@require_POST
+def upload_session_open(request):
+    """打开（或在已有 key 上扩展）异步上传会话，POST: parent_type, parent_id, files, bytes, 可选 key。"""
+    try:
+        kw = _upload_parent(request.user, request.POST.get('parent_type'), request.POST.get('parent_id'))
+        expected_files = int(request.POST.get('files') or 0)
+        expected_bytes = int(request.POST.get('bytes') or 0)
+    except ValueError as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+    except Http404:
+        return JsonResponse({'ok': False, 'error': 'Invalid upload request.'}, status=400)
+    if kw['topic'] is None:
+        return JsonResponse({'ok': False, 'error': 'invalid parent_type'}, status=400)
+    session = upload_sessions.open_session(request.user, request.POST.get('key') or None,
+                                           expected_files=expected_files, expected_bytes=expected_bytes,
+                                           topic=kw['topic'])
+    return JsonResponse({'ok': True, **upload_sessions.state(session)})
+
+
+@login_required
+def upload_session_state(request, key):
+    """查询会话的预期与已收到的文件数 / 字节数。"""
+    session = get_object_or_404(UploadSession, key=key, owner=request.user)
+    return JsonResponse({'ok': True, **upload_sessions.state(session)})
+
+
+def _attachment_json(a):
+    return {
+        'id': a.id,
+        'name': a.original_name,
+        'url': a.file.url,
+        'is_image': a.is_image,
+        'is_text': a.is_text_like,
+        'is_audio': a.is_audio,
+        'is_video': a.is_video,
+        'size': a.size,
+        'relative_path': a.relative_path,
+    }
+
+
+def _resumable_state(upload):
+    return {'ok': True, 'token': upload.token, 'offset': upload.received, 'size': upload.size,
+            'chunk_size': resumable.RESUMABLE_CHUNK_BYTES, 'expires_at': upload.expires_at.isoformat()}
+
+
+@login_required
+@require_POST
+def resumable_create(request):
+    """建立可续传的单文件上传（协议见 resumable 模块）。"""
+    try:
+        kw = _upload_parent(request.user, request.POST.get('parent_type'), request.POST.get('parent_id'))
+    except ValueError as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({'ok': False, 'error': 'invalid size'}, status=400)
+    name = (request.POST.get('name') or '').strip()
+    if not name:
+        return JsonResponse({'ok': False, 'error': 'empty name'}, status=400)
+    if size < 0 or size > resumable.RESUMABLE_UPLOAD_MAX_BYTES:
+        return JsonResponse({'ok': False, 'error': f'File too large (max {resumable.RESUMABLE_UPLOAD_MAX_BYTES} bytes).'}, status=400)
+    upload_session, _, error = _upload_session_for(request, kw)
+    if error:
+        return error
+    upload = resumable.create(request.user, name=name, size=size,
+                              relative_path=request.POST.get('relative_path') or '',
+                              upload_session=upload_session,
+                              **{k: v for k, v in kw.items() if v is not None})
+    return JsonResponse(_resumable_state(upload))
+
+
+@login_required
+@require_http_methods(['GET', 'HEAD', 'PUT', 'DELETE'])
+def resumable_upload(request, token):
+    """GET 查询已收到的 offset；PUT 追加一个字节区间（Content-Range）；DELETE 放弃上传。"""
+    upload = get_object_or_404(ResumableUpload, token=token, owner=request.user, expires_at__gt=timezone.now())
+    if request.method == 'DELETE':
+        upload.delete()
+        return JsonResponse({'ok': True})
+    if request.method == 'PUT':
+        try:
+            start, end, total = resumable.parse_content_range(request.META.get('HTTP_CONTENT_RANGE'))
+            if total != upload.size:
+                raise ValueError('size mismatch')
+            resumable.write_range(upload, request, start, end)
+        except resumable.OffsetMismatch as e:
+            return JsonResponse({'ok': False, 'error': 'offset mismatch', 'offset': e.offset}, status=409)
+        except ValueError as e:
+            return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+        except FileNotFoundError:
+            # 临时文件已被清理（过期或已 finalize）
+            raise Http404
+    return JsonResponse(_resumable_state(upload))
+
+
+@login_required
+@require_POST
+def resumable_finalize(request, token):
+    """收齐后生成附件（与 upload_attachments_api 相同的归属、相对路径与 upload_session 处理）。"""
+    upload = get_object_or_404(ResumableUpload, token=token, owner=request.user)
+    # 同时延长有效期，处理期间不会被清理
+    if not resumable.renew(upload):
+        return JsonResponse({'ok': False, 'error': 'upload expired'}, status=410)
+    if upload.received != upload.size:
+        return JsonResponse({'ok': False, 'error': 'incomplete upload', 'offset': upload.received}, status=409)
+    try:
+        completed = resumable.claim(upload)
+    except FileNotFoundError:
+        return JsonResponse({'ok': False, 'error': 'upload already finalized'}, status=409)
+    relative_paths = {0: upload.relative_path} if upload.relative_path else None
+    failed = []
+    created = _save_attachments_from_request(
+        [completed], request.user, topic=upload.topic, entry=upload.entry, comment=upload.comment,
+        relative_paths=relative_paths, upload_session=upload.upload_session, failures=failed, keep_stored=True)
+    if not created:
+        # 临时文件可能已被移入存储，取回后客户端可以再次 finalize
+        resumable.unclaim(upload, completed, next((f['stored'] for f in failed if f.get('stored')), None))
+        return JsonResponse({'ok': False, 'error': 'Server error when saving attachments.'}, status=500)
+    completed.close()
+    upload.delete()
+    if upload.upload_session and upload.topic_id and not (upload.entry_id or upload.comment_id):
+        upload_sessions.record(UploadSession.objects.filter(key=upload.upload_session, owner=request.user).first(),
+                               len(created), sum(a.size or 0 for a in created))
+    return JsonResponse({'ok': True, 'files': [_attachment_json(a) for a in created]})
 
 
 def preview_attachment(request, attachment_id):
@@ -923,6 +1223,12 @@ def preview_attachment(request, attachment_id):
     if not allowed:
         raise Http404
 
+    # 附件或其所在日记本内容变化时 topic.render_version 递增
+    etag = etag_for(request, att.pk, topic.pk, topic.render_version)
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+
     # 根据附件类型选择预览方式：文本类读取片段，图片/音视频在模板中直接嵌入
     context = {'attachment': att, 'entry': entry, 'topic': topic}
     if att.is_text_like:
@@ -948,7 +1254,9 @@ def preview_attachment(request, attachment_id):
     else:
         context['preview_type'] = 'unsupported'
 
-    return render(request, 'learning_logs/preview_attachment.html', context)
+    response = render(request, 'learning_logs/preview_attachment.html', context)
+    response['ETag'] = etag
+    return response
 
 
 def download_attachment(request, attachment_id):
@@ -981,38 +1289,48 @@ def download_attachment(request, attachment_id):
         log.warning('download_attachment forbidden id=%s user=%s user_id=%s topic_public=%s entry_public=%s att_public=%s att_owner=%s', att.id, getattr(request.user, 'username', None), getattr(request.user, 'id', None), topic_public, entry_public, att_public, getattr(att.owner, 'id', None))
         raise Http404
     f = att.file
-    try:
-        # 诊断读写：尝试读取首字节确认 storage 真正返回内容，然后重新打开以供 FileResponse 使用
-        try:
-            # 先记录一些元信息
-            size_attr = getattr(f, 'size', None)
-            name_attr = getattr(f, 'name', None)
-            log.info('download_attachment attempt open id=%s name=%s size_attr=%s content_type=%s att.size=%s', att.id, name_attr, size_attr, att.content_type, att.size)
-        except Exception:
-            log.exception('download_attachment metadata read failed for id=%s', att.id)
-
-        # 尝试读取一小段以确认后端是否返回有效数据
+    accel_uri = accel.media_uri(f)
+    if accel_uri:
+        # 权限已检查，文件内容（含 Range）交给 nginx 发送
+        size = att.size
+        response = accel.redirect(accel_uri, att.content_type or 'application/octet-stream')
+    else:
         try:
-            tmp = f.open('rb')
-            first = tmp.read(1)
-            tmp.close()
-            log.info('download_attachment first_byte_len=%d id=%s', 0 if first is None else len(first), att.id)
-        except Exception:
-            log.exception('download_attachment quick_read failed id=%s', att.id)
+            # 诊断读写：尝试读取首字节确认 storage 真正返回内容，然后重新打开以供 FileResponse 使用
+            try:
+                # 先记录一些元信息
+                size_attr = getattr(f, 'size', None)
+                name_attr = getattr(f, 'name', None)
+                log.info('download_attachment attempt open id=%s name=%s size_attr=%s content_type=%s att.size=%s', att.id, name_attr, size_attr, att.content_type, att.size)
+            except Exception:
+                log.exception('download_attachment metadata read failed for id=%s', att.id)
 
-        # 重新打开用于返回，部分 storage backend 在重复 open 上表现不同但通常可行
-        fh = f.open('rb')
-        response = FileResponse(fh)
-    except Exception:
-        # 无法通过 storage.open 读取（例如 Cloudinary 未正确配置或网络问题），退回到重定向到文件外链
-        log.exception('download_attachment file_open_failed id=%s storage_name=%s, falling back to redirect', att.id, getattr(f, 'name', None))
-        try:
-            url = f.url
+            # 尝试读取一小段以确认后端是否返回有效数据
+            try:
+                tmp = f.open('rb')
+                first = tmp.read(1)
+                tmp.close()
+                log.info('download_attachment first_byte_len=%d id=%s', 0 if first is None else len(first), att.id)
+            except Exception:
+                log.exception('download_attachment quick_read failed id=%s', att.id)
+
+            # 重新打开用于返回，部分 storage backend 在重复 open 上表现不同但通常可行
+            fh = f.open('rb')
+            size = att.size or f.size
+            # 强 ETag：内容不变则不变（relocate 只改存储位置），供 If-Range 判断续传是否仍然有效
+            validator = att.sha256[:20] or int(att.uploaded_at.timestamp())
+            response = ranges.file_response(request, fh, size=size, content_type=att.content_type or 'application/octet-stream',
+                                            etag=f'{att.pk}-{validator}-{size}', last_modified=att.uploaded_at)
         except Exception:
-            url = None
-        if url:
-            return redirect(url)
-        raise Http404
+            # 无法通过 storage.open 读取（例如 Cloudinary 未正确配置或网络问题），退回到重定向到文件外链
+            log.exception('download_attachment file_open_failed id=%s storage_name=%s, falling back to redirect', att.id, getattr(f, 'name', None))
+            try:
+                url = f.url
+            except Exception:
+                url = None
+            if url:
+                return redirect(url)
+            raise Http404
     # 设置文件名（处理非 ASCII），并尽量设置 Content-Type / Content-Length 以兼容各浏览器
     from urllib.parse import quote
     # 允许通过 ?download_name=... 指定建议的下载文件名（仅建议，浏览器可忽略）
@@ -1024,22 +1342,46 @@ def download_attachment(request, attachment_id):
         return n[:200]
 
     download_name = _sanitize_name(request.GET.get('download_name', '') or att.original_name or 'download')
-    response['Content-Disposition'] = "attachment; filename*=UTF-8''" + quote(download_name)
-    try:
-        # 明确告知浏览器真实的 MIME 类型
-        if att.content_type:
-            response['Content-Type'] = att.content_type
-    except Exception:
-        pass
-    try:
-        if getattr(att, 'size', None):
-            response['Content-Length'] = str(att.size)
-    except Exception:
-        pass
-    log.info('download_attachment success id=%s filename=%s size=%s', att.id, download_name, getattr(f, 'size', None))
+    # ?inline=1 供预览页的 <video>/<audio> 直接播放
+    # 只有图片、音视频可以内联，上传的 HTML 等不能在本站同源打开
+    disposition = 'inline' if request.GET.get('inline') and signed_media.inline_safe(att.content_type) else 'attachment'
+    response['Content-Disposition'] = f"{disposition}; filename*=UTF-8''" + quote(download_name)
+    log.info('download_attachment success id=%s filename=%s size=%s status=%s', att.id, download_name, size, response.status_code)
     return response
 
 
+
+def signed_media_file(request, token, name):
+    """签名地址的快速通道：只验签与过期时间，不查数据库（见 signed_media 模块）。"""
+    params = {k: request.GET[k] for k in ('v', 'd', 'n', 't') if k in request.GET}
+    try:
+        remaining = signed_media.verify(token, name, params)
+    except signed_media.SignatureError:
+        return HttpResponseForbidden()
+    version = params.get('v', '')
+    content_type = params.get('t') or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    storage = Attachment._meta.get_field('file').storage
+    if not version or signed_media.replaced(storage, name, version):
+        return HttpResponseNotFound()
+    accel_uri = accel.storage_uri(storage, name)
+    if accel_uri:
+        response = accel.redirect(accel_uri, content_type)
+    else:
+        try:
+            fh = storage.open(name, 'rb')
+            size = storage.size(name)
+        except (FileNotFoundError, OSError):
+            return HttpResponseNotFound()
+        # 版本（附件 id 与上传时间）与大小一起作强 ETag，文件名复用后的新文件不会与之混淆
+        etag = f'{version}-{size}'
+        response = ranges.file_response(request, fh, size=size, content_type=content_type, etag=etag)
+    from urllib.parse import quote
+    disposition = 'inline' if params.get('d') == 'inline' and signed_media.inline_safe(content_type) else 'attachment'
+    response['Content-Disposition'] = f"{disposition}; filename*=UTF-8''" + quote(params.get('n') or posixpath.basename(name))
+    response['Cache-Control'] = f'private, max-age={remaining}'
+    response['X-Content-Type-Options'] = 'nosniff'
+    return response
+
 @login_required
 def download_folder(request):
     """将指定父对象下某个相对路径前缀对应的所有附件打包 zip 下载。
@@ -1084,24 +1426,28 @@ def download_folder(request):
     targets = attachments_qs.filter(Q(relative_path=folder_path) | Q(relative_path__startswith=prefix))
     if not targets.exists():
         raise Http404
-    # 构建 zip 流
-    import io, zipfile
-    buf = io.BytesIO()
-    zf = zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED)
-    for att in targets:
+    members = []
+    for att in targets.only('file', 'original_name', 'relative_path', 'size', 'content_type', 'uploaded_at').order_by('id'):
         # 计算在 zip 中的相对路径：使用 att.relative_path 的后缀部分（去掉前缀文件夹）
         rel = att.relative_path or att.original_name
         if rel.startswith(folder_path):
             arcname = rel
         else:
             arcname = folder_path + '/' + (att.original_name or 'file')
-        try:
-            with att.file.open('rb') as rf:
-                zf.writestr(arcname, rf.read())
-        except Exception:
-            continue
-    zf.close()
-    buf.seek(0)
+        members.append((arcname, att))
+
+    # 边读边发的 zip 流：不把文件或整个包载入内存
+    def _members():
+        for arcname, att in members:
+            modified = timezone.localtime(att.uploaded_at).timetuple()[:6] if att.uploaded_at else None
+            yield arcname, functools.partial(att.file.open, 'rb'), att.size, modified, att.content_type
+
+    cached = key = None
+    if zipcache.enabled_for(sum(att.size for _, att in members)):
+        # 同一组文件的归档只生成一次，之后直接读缓存；未命中时边发送边写入缓存
+        key = zipcache.cache_key((att.id, att.size, att.uploaded_at, arcname) for arcname, att in members)
+        cached = zipcache.fetch(key)
+
     from urllib.parse import quote
     # 支持 ?download_name=custom_name.zip 来建议客户端下载时的文件名（浏览器可选择忽略）
     def _sanitize_name(n: str) -> str:
@@ -1112,21 +1458,35 @@ def download_folder(request):
 
     requested_name = _sanitize_name(request.GET.get('download_name', ''))
     zip_name = requested_name or (folder_path + '.zip')
-    resp = FileResponse(buf, as_attachment=True, filename=zip_name)
-    resp['Content-Type'] = 'application/zip'
+    accel_uri = accel.zipcache_uri(cached.name) if cached is not None else None
+    if accel_uri:
+        cached.close()
+        resp = accel.redirect(accel_uri, 'application/zip')
+    elif cached is not None:
+        # 缓存的归档内容由 key 决定，可作强 ETag，中断的下载可以续传
+        resp = ranges.file_response(request, cached, size=os.fstat(cached.fileno()).st_size,
+                                    content_type='application/zip', etag=key)
+    else:
+        if key is not None:
+            chunks = zipcache.stream(key, lambda: zipstream.iter_zip(_members()))
+        else:
+            chunks = zipstream.iter_zip(_members())
+        resp = StreamingHttpResponse(chunks, content_type='application/zip')
     resp['Content-Disposition'] = "attachment; filename*=UTF-8''" + quote(zip_name)
     return resp
 
 
 @login_required
-@require_POST
+@require_http_methods(['GET', 'POST'])
 def list_folder_api(request):
     """Return JSON listing of files and immediate subfolders under a given folder path
-    POST params: parent_type, parent_id, folder_path. Optionally upload_session to include session uploads.
+    GET/POST params: parent_type, parent_id, folder_path. Optionally upload_session to include session uploads.
+    GET responses carry an ETag so unchanged listings revalidate with 304.
     """
-    parent_type = request.POST.get('parent_type')
-    parent_id = request.POST.get('parent_id')
-    folder_path = (request.POST.get('folder_path') or '').replace('\\', '/').strip('/')
+    params = request.POST if request.method == 'POST' else request.GET
+    parent_type = params.get('parent_type')
+    parent_id = params.get('parent_id')
+    folder_path = (params.get('folder_path') or '').replace('\\', '/').strip('/')
     if parent_type not in {'topic', 'entry', 'comment'}:
         return JsonResponse({'ok': False, 'error': 'invalid parent_type'}, status=400)
     try:
@@ -1150,40 +1510,37 @@ def list_folder_api(request):
             raise Http404
         base_qs = obj.attachment_set.all()
 
-    # Optionally include attachments in a specific upload session
-    upload_session = request.POST.get('upload_session')
-    if upload_session:
-        # include both session and normal ones visible to owner
-        qs = base_qs.filter(Q(upload_session__isnull=True) | Q(upload_session=upload_session))
-    else:
-        qs = base_qs.filter(upload_session__isnull=True)
-
-    prefix = folder_path + '/' if folder_path else ''
-    targets = qs.filter(Q(relative_path=folder_path) | Q(relative_path__startswith=prefix))
-    files = []
-    folders = set()
-    for att in targets:
-        rel = (att.relative_path or att.original_name or '').lstrip('/')
-        if folder_path:
-            if not rel.startswith(folder_path + '/'):  # If equal to folder_path, treat as file?
-                if rel == folder_path:
-                    name = rel.split('/')[-1]
-                    files.append({'id': att.id, 'name': name, 'relative_path': rel, 'size': att.size, 'is_image': att.is_image, 'is_text': att.is_text_like, 'is_video': att.is_video, 'is_audio': att.is_audio})
-                continue
-            rest = rel[len(prefix):]
-        else:
-            rest = rel
-        parts = rest.split('/')
-        if len(parts) == 1:
-            # file in this folder
-            if parts[0]:
-                files.append({'id': att.id, 'name': parts[0], 'relative_path': rel, 'size': att.size, 'is_image': att.is_image, 'is_text': att.is_text_like, 'is_video': att.is_video, 'is_audio': att.is_audio})
-        else:
-            # subfolder
-            folders.add(parts[0])
+    # 附件增删改都会递增所属日记本 / 日记的 render_version（评论附件计入其日记）
+    version = obj.entry.render_version if parent_type == 'comment' else obj.render_version
+    upload_session = params.get('upload_session')
+    etag = etag_for(request, parent_type, pid, version, folder_path, upload_session)
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+
+    def _file_item(att):
+        rel = att.relative_path or att.original_name or ''
+        return {'id': att.id, 'name': rel.split('/')[-1], 'relative_path': rel, 'size': att.size, 'is_image': att.is_image, 'is_text': att.is_text_like, 'is_video': att.is_video, 'is_audio': att.is_audio}
 
-    folders_list = [{'name': f, 'path': (folder_path + '/' + f) if folder_path else f} for f in sorted(folders)]
-    return JsonResponse({'ok': True, 'files': files, 'folders': folders_list})
+    # 直接子目录与统计取自文件夹索引；直接文件按 folder_path 索引读取，均与子树大小无关
+    _, subfolders = folders.list_folder(parent_type, pid, folder_path)
+    folder_map = {f.name: {'name': f.name, 'path': f.path, 'files': f.total_files, 'bytes': f.total_bytes} for f in subfolders}
+    files = [_file_item(att) for att in base_qs.filter(upload_session__isnull=True, folder_path=folder_path)]
+
+    # Optionally include attachments in a specific upload session (尚未转挂的临时附件不在索引中)
+    if upload_session:
+        session_qs = base_qs.filter(upload_session=upload_session)
+        files.extend(_file_item(att) for att in session_qs.filter(folder_path=folder_path))
+        prefix = folder_path + '/' if folder_path else ''
+        session_dirs = session_qs.filter(folder_path__startswith=prefix).exclude(folder_path=folder_path)
+        for path in session_dirs.order_by().values_list('folder_path', flat=True).distinct():
+            name = path[len(prefix):].split('/')[0]
+            folder_map.setdefault(name, {'name': name, 'path': prefix + name})
+
+    folders_list = [folder_map[name] for name in sorted(folder_map)]
+    response = JsonResponse({'ok': True, 'files': files, 'folders': folders_list})
+    response['ETag'] = etag
+    return response
 
 
 @login_required
@@ -1245,7 +1602,7 @@ def add_comment(request, entry_id):
             comment.name = ''
         files = request.FILES.getlist('comment_attachments')
         # 支持文件夹上传的相对路径映射：relative_paths_json (优先) 或 relative_path[<index>] = path
-        rel_index_map, rel_meta_map = _parse_relative_paths(request.POST)
+        rel_index_map, rel_meta_map = _parse_relative_paths(request.POST, request.FILES)
         # 若文本与附件皆为空，则忽略此次提交
         if (not (comment.text or '').strip()) and not files:
             try:
@@ -1274,18 +1631,8 @@ def delete_comment(request, comment_id):
     # 仅评论作者可删
     if c.user != request.user:
         raise Http404
-    # 删除该评论下的所有附件（Attachment 的 post_delete 会清理文件）
-    for a in c.attachment_set.all():
-        a.delete()
-    # 删除所有子回复（递归删除）
-    def _del_subtree(comment):
-        for r in comment.replies.all():
-            _del_subtree(r)
-            for a in r.attachment_set.all():
-                a.delete()
-            r.delete()
-    _del_subtree(c)
-    c.delete()
+    # 按物化路径前缀一次删除整棵子树；附件随级联删除（Attachment 的 post_delete 会清理文件）
+    counters.delete_comment_subtree(c)
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         return JsonResponse({'ok': True})
     return redirect(request.META.get('HTTP_REFERER', 'learning_logs:index'))
@@ -1332,8 +1679,8 @@ def delete_topic(request, topic_name):
         raise Http404
 
     if request.method == 'POST':
-        # 确认删除
-        topic.delete()
+        # 确认删除（级联删除其下全部内容，跳过逐行计数维护）
+        counters.delete_topic(topic)
         return redirect('learning_logs:topics')
 
     # 确认页
@@ -0,0 +1,288 @@
+"""文件夹下载生成的 zip 的磁盘缓存，按内容寻址。
+
+- 键为文件夹内各附件 (id, size, uploaded_at, arcname) 集合的摘要：增删、改名任何一个文件都会得到新键，
+  旧归档不再被引用，随 LRU 淘汰。
+- 未命中时边生成边发送：第一个请求生成归档，一边发送一边写入 <键>.part，完整发送后原子地换成缓存文件，
+  首字节不必等整个归档生成完。
+- 每个键只生成一次：生成方对自己的 .part 文件持有排他的文件锁（跨进程有效，只与同一归档冲突），
+  生成期间到达的请求跟读这个文件，不再各自生成；生成方中途放弃（客户端断开、写入失败、进程退出）时，
+  跟读方自己生成并跳过已发送的部分（同一组文件按 id 顺序生成的归档逐字节相同），不写缓存。
+- 命中时更新文件的 mtime，总大小超过 LL_ZIP_CACHE_MAX_BYTES 时从最久未用的开始删除。
+  超过 LL_ZIP_CACHE_MAX_ENTRY_BYTES 的文件夹不缓存，仍按 zipstream 流式发送。
+- 缓存目录不在 MEDIA_ROOT 下，避免私密文件夹的归档被当作媒体文件访问。
+- 没有 fcntl（Windows）时无法判断生成方是否还在：.part 以 O_EXCL 创建，生成期间的其余请求各自流式发送。
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows：退化为进程内的锁
+    fcntl = None
+
+# 缓存总字节数上限，0 表示不缓存
+ZIP_CACHE_MAX_BYTES = getattr(settings, 'LL_ZIP_CACHE_MAX_BYTES', 2 * 1024 ** 3)
+# 单个归档（按文件总大小估计）超过此值时不缓存
+ZIP_CACHE_MAX_ENTRY_BYTES = getattr(settings, 'LL_ZIP_CACHE_MAX_ENTRY_BYTES', ZIP_CACHE_MAX_BYTES // 4)
+# 跟读时最多等待多久没有新数据（秒），超过后视为生成方卡住，自己生成
+ZIP_CACHE_FOLLOW_TIMEOUT_SECONDS = getattr(settings, 'LL_ZIP_CACHE_FOLLOW_TIMEOUT_SECONDS', 30)
+# 归档格式有变化时递增，使旧缓存失效
+FORMAT_VERSION = 1
+STALE_TMP_SECONDS = 3600
+FOLLOW_POLL_SECONDS = 0.05
+READ_CHUNK_BYTES = 256 * 1024
+
+log = logging.getLogger('learning_logs.zipcache')
+
+
+def cache_dir() -> Path:
+    default = Path(getattr(settings, 'FILE_UPLOAD_TEMP_DIR', None) or tempfile.gettempdir()) / 'll-zipcache'
+    return Path(getattr(settings, 'LL_ZIP_CACHE_DIR', None) or default)
+
+
+def enabled_for(total_bytes):
+    return ZIP_CACHE_MAX_BYTES > 0 and total_bytes <= ZIP_CACHE_MAX_ENTRY_BYTES
+
+
+def cache_key(items):
+    """items 为 (附件 id, size, uploaded_at, arcname) 的可迭代对象，与顺序无关。"""
+    lines = sorted(f'{pk}\t{size}\t{uploaded.isoformat() if uploaded else ""}\t{arcname}'
+                   for pk, size, uploaded, arcname in items)
+    h = hashlib.sha256(f'v{FORMAT_VERSION}\n'.encode())
+    for line in lines:
+        h.update(line.encode('utf-8'))
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+def _path(key):
+    return cache_dir() / f'{key}.zip'
+
+
+def _part_path(key):
+    return cache_dir() / f'{key}.part'
+
+
+def _try_lock(fh, shared=False):
+    """不等待地对打开的文件加锁，返回是否取得。"""
+    try:
+        fcntl.flock(fh, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+def _claim(key):
+    """尝试成为该键的生成方：返回已加排他锁、清空的 .part 文件，已有生成方时返回 None。"""
+    part = _part_path(key)
+    part.parent.mkdir(parents=True, exist_ok=True)
+    if fcntl is None:
+        try:
+            return open(part, 'xb')
+        except FileExistsError:
+            return None
+    while True:
+        fh = open(part, 'ab')
+        if not _try_lock(fh):
+            fh.close()
+            return None
+        try:
+            same = os.path.samestat(os.fstat(fh.fileno()), os.stat(part))
+        except FileNotFoundError:
+            same = False
+        if same:
+            fh.truncate(0)
+            return fh
+        # 加锁前上一个生成方已完成或放弃，文件名指向了别的文件，重来
+        fh.close()
+
+
+def _open(key):
+    path = _path(key)
+    try:
+        fh = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return fh
+
+
+def evict(max_bytes=None):
+    """删除最久未用的归档，直到总大小不超过上限；返回删除个数。"""
+    max_bytes = ZIP_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    files = []
+    total = 0
+    abandoned = time.time() - STALE_TMP_SECONDS
+    try:
+        with os.scandir(cache_dir()) as it:
+            for de in it:
+                if not de.is_file():
+                    continue
+                st = de.stat()
+                if de.name.endswith('.zip'):
+                    files.append((st.st_mtime, st.st_size, de.path))
+                    total += st.st_size
+                elif de.name.endswith('.part') and st.st_mtime < abandoned:
+                    # 中断的生成（进程被杀）留下的临时文件
+                    _unlink(de.path)
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for _mtime, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        _unlink(path)
+        total -= size
+        removed += 1
+    return removed
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def fetch(key):
+    """返回该键的归档（以二进制打开的文件），未缓存时返回 None。"""
+    return _open(key)
+
+
+def stream(key, make_chunks):
+    """未命中时逐块产出该键的归档：成为生成方时调用 make_chunks() 并写入缓存，否则跟读正在生成的文件。"""
+    out = _claim(key)
+    if out is None:
+        yield from _follow(key, make_chunks)
+        return
+    cached = _open(key)
+    if cached is not None:
+        # 上一个生成方刚好完成
+        _abandon(key, out)
+        with cached:
+            yield from iter(lambda: cached.read(READ_CHUNK_BYTES), b'')
+        return
+    yield from _write_through(key, out, make_chunks())
+    evict()
+
+
+def _abandon(key, out):
+    # 持锁期间删除，跟读方据此得知生成已放弃
+    _unlink(_part_path(key))
+    out.close()
+
+
+def _write_through(key, out, chunks):
+    """逐块产出 chunks，同时写入 .part；全部产出后换成缓存文件。写缓存出错只记日志，不影响发送。"""
+    done = False
+    try:
+        for chunk in chunks:
+            if out is not None:
+                try:
+                    out.write(chunk)
+                    # 跟读方立即可见
+                    out.flush()
+                except OSError:
+                    log.warning('zip cache write failed for %s', key, exc_info=True)
+                    _abandon(key, out)
+                    out = None
+            yield chunk
+        if out is not None:
+            try:
+                os.replace(_part_path(key), _path(key))
+                done = True
+            except OSError:
+                log.warning('zip cache store failed for %s', key, exc_info=True)
+    finally:
+        if out is not None:
+            if done:
+                out.close()
+            else:
+                _abandon(key, out)
+
+
+def _follow(key, make_chunks):
+    """跟读生成方正在写的 .part；生成方完成时读到完整归档，放弃时自己生成并跳过已发送的部分。"""
+    src = None
+    sent = 0
+    idle_since = time.monotonic()
+    try:
+        while True:
+            if src is None:
+                src = _open(key) or _open_part(key)
+                if src is None and fcntl is None:
+                    break
+            if src is not None:
+                data = src.read(READ_CHUNK_BYTES)
+                if data:
+                    sent += len(data)
+                    idle_since = time.monotonic()
+                    yield data
+                    continue
+                if not _building(src):
+                    # 生成方已释放锁：读完余下的内容，若它已成为缓存文件即为完整归档
+                    rest = src.read()
+                    if rest:
+                        sent += len(rest)
+                        yield rest
+                    if _is_cached(key, src):
+                        return
+                    break
+            elif not _part_path(key).exists():
+                # 生成方尚未创建 .part，或已完成 / 放弃
+                cached = _open(key)
+                if cached is None:
+                    break
+                src = cached
+                continue
+            if time.monotonic() - idle_since > ZIP_CACHE_FOLLOW_TIMEOUT_SECONDS:
+                log.warning('zip cache builder for %s stalled, streaming independently', key)
+                break
+            time.sleep(FOLLOW_POLL_SECONDS)
+    finally:
+        if src is not None:
+            src.close()
+    yield from _skip(make_chunks(), sent)
+
+
+def _open_part(key):
+    try:
+        return open(_part_path(key), 'rb')
+    except FileNotFoundError:
+        return None
+
+
+def _building(src):
+    """生成方是否仍持有 src 所指文件的排他锁。"""
+    if fcntl is None:
+        return False
+    if _try_lock(src, shared=True):
+        fcntl.flock(src, fcntl.LOCK_UN)
+        return False
+    return True
+
+
+def _is_cached(key, src):
+    try:
+        return os.path.samestat(os.fstat(src.fileno()), os.stat(_path(key)))
+    except FileNotFoundError:
+        return False
+
+
+def _skip(chunks, n):
+    """跳过 chunks 的前 n 个字节后继续产出。"""
+    for chunk in chunks:
+        if n >= len(chunk):
+            n -= len(chunk)
+            continue
+        yield chunk[n:] if n else chunk
+        n = 0
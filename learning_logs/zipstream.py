@@ -0,0 +1,112 @@
+"""边读边发的 zip 打包，供文件夹下载使用，内存占用与文件夹大小无关。
+
+- 输出流不可 seek，zipfile 自动为每个成员写数据描述符（CRC 与大小写在内容之后），
+  因此不必预先读完或缓存任何文件；成员与中央目录在需要时使用 ZIP64 扩展（单个文件或整个包超过 4 GiB、文件数超过 65535）。
+- 每个文件按 ZIP_CHUNK_SIZE 分块读取、写入，攒够一块就交给响应发送。
+- 已压缩的内容（图片、音视频、压缩包、Office 文档等）以 STORED 存入，其余用 DEFLATED。
+"""
+import logging
+import posixpath
+import zipfile
+
+from django.conf import settings
+
+ZIP_CHUNK_SIZE = getattr(settings, 'LL_ZIP_CHUNK_SIZE', 256 * 1024)
+
+# 再压缩几乎没有收益的扩展名与 MIME 类型
+_STORED_EXTS = frozenset((
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.heif', '.avif',
+    '.mp4', '.m4v', '.mov', '.mkv', '.webm', '.avi', '.mp3', '.m4a', '.aac', '.ogg', '.opus', '.flac',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.epub', '.jar', '.apk',
+))
+_STORED_TYPES = frozenset((
+    'application/zip', 'application/gzip', 'application/x-gzip', 'application/x-bzip2', 'application/x-xz',
+    'application/zstd', 'application/x-7z-compressed', 'application/vnd.rar', 'application/x-rar-compressed',
+    'application/epub+zip', 'application/java-archive',
+))
+# 这些图片格式未压缩或压缩率低，仍用 DEFLATED
+_DEFLATE_IMAGES = frozenset(('image/svg+xml', 'image/bmp', 'image/x-ms-bmp', 'image/tiff', 'image/x-icon', 'image/vnd.microsoft.icon'))
+
+log = logging.getLogger('learning_logs.zipstream')
+
+
+def compress_type_for(name, content_type=''):
+    """按扩展名与 MIME 类型选择 STORED 或 DEFLATED。"""
+    ext = posixpath.splitext(name or '')[1].lower()
+    if ext in _STORED_EXTS:
+        return zipfile.ZIP_STORED
+    ct = (content_type or '').split(';', 1)[0].strip().lower()
+    if ct in _STORED_TYPES or ct.startswith(('video/', 'audio/')):
+        return zipfile.ZIP_STORED
+    if ct.startswith('image/') and ct not in _DEFLATE_IMAGES:
+        return zipfile.ZIP_STORED
+    if ct.startswith('application/vnd.openxmlformats-officedocument.') or ct.startswith('application/vnd.oasis.opendocument.'):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+class _Sink:
+    """只支持 write 的输出，zipfile 因此按流式（数据描述符）方式写入。"""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        return data
+
+
+def iter_zip(members, chunk_size=None):
+    """逐块产出 zip 的字节。
+
+    members 为 (arcname, open_file, size, date_time, content_type) 的可迭代对象：
+    open_file 是无参函数，返回以二进制方式打开的文件；打开失败（OSError）的成员被跳过。
+    size 为预计大小，用于决定是否在本地文件头中使用 ZIP64；date_time 为 6 元组或 None。
+    """
+    chunk_size = chunk_size or ZIP_CHUNK_SIZE
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as zf:
+        for arcname, open_file, size, date_time, content_type in members:
+            try:
+                src = open_file()
+            except OSError:
+                log.warning('zip: skip unreadable member %s', arcname, exc_info=True)
+                continue
+            info = zipfile.ZipInfo(arcname, date_time=_clamp(date_time))
+            info.compress_type = compress_type_for(arcname, content_type)
+            info.external_attr = 0o644 << 16
+            # zipfile 按预计大小决定本地文件头是否带 ZIP64 字段
+            info.file_size = size or 0
+            with src, zf.open(info, 'w', force_zip64=size is None) as dst:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    if sink.size >= chunk_size:
+                        yield sink.take()
+            if sink.size >= chunk_size:
+                yield sink.take()
+    if sink.size:
+        yield sink.take()
+
+
+def _clamp(date_time):
+    # zip 的时间字段只能表示 1980-2107 年
+    if not date_time or date_time[0] < 1980:
+        return (1980, 1, 1, 0, 0, 0)
+    if date_time[0] > 2107:
+        return (2107, 12, 31, 23, 59, 58)
+    return tuple(date_time[:6])
@@ -100,6 +100,7 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'learning_logs.context_processors.background_image',
                 'learning_logs.context_processors.background_video',
+                'learning_logs.context_processors.page_cache_placeholders',
             ],
         },
     },
@@ -187,13 +188,27 @@ LOGIN_REDIRECT_URL = 'learning_logs:index'
 LOGOUT_REDIRECT_URL = 'learning_logs:index'
 LOGIN_URL = 'accounts:login'
 
-# 文件上传大小限制：扩展到 1GB（以支持大文件夹上传）
-DATA_UPLOAD_MAX_MEMORY_SIZE = 1 * 1024 * 1024 * 1024  # 1 GiB
-FILE_UPLOAD_MAX_MEMORY_SIZE = 1 * 1024 * 1024 * 1024  # 1 GiB
+# 附件与文件夹归档下载：Django 检查权限后以 X-Accel-Redirect 交给 nginx 发送文件（learning_logs.accel），
+# 需要 deploy/nginx/diary.conf 中的 /_protected/ location，且 nginx 能读到 MEDIA_ROOT 与 LL_ZIP_CACHE_DIR。
+# 未启用时由 Django 流式发送（支持 Range）。
+LL_ACCEL_REDIRECT = os.getenv('LL_ACCEL_REDIRECT', 'false').lower() in ('1', 'true', 'yes')
+LL_ZIP_CACHE_DIR = os.getenv('LL_ZIP_CACHE_DIR') or None
+# 附件签名地址的密钥（learning_logs.signed_media），格式 "kid:secret,kid:secret"，第一个用于签发、全部用于验证；
+# 未设置时由 SECRET_KEY 与 SECRET_KEY_FALLBACKS 派生
+LL_MEDIA_SIGNING_KEYS = [tuple(item.strip().split(':', 1)) for item in os.getenv('LL_MEDIA_SIGNING_KEYS', '').split(',') if ':' in item]
+
+# 上传文件按块流式写入（learning_logs.uploads）：单个文件超过 FILE_UPLOAD_MAX_MEMORY_SIZE
+# 或超出请求 / worker 内存预算（LL_UPLOAD_REQUEST_MEMORY_BUDGET / LL_UPLOAD_WORKER_MEMORY_BUDGET）
+# 时写入临时文件，大文件夹上传不会整体驻留在 worker 内存中。
+FILE_UPLOAD_HANDLERS = ['learning_logs.uploads.SpooledUploadHandler']
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2 * 1024 * 1024  # 2 MiB
+# 非文件字段（如每个文件的相对路径）的总大小上限；文件内容不计入
+DATA_UPLOAD_MAX_MEMORY_SIZE = 64 * 1024 * 1024  # 64 MiB
 
 # 当上传整个文件夹时，会产生大量字段（每个文件一个 file input + 一个相对路径 hidden input），
 # 默认的 DATA_UPLOAD_MAX_NUMBER_FIELDS=1000 可能导致 Django 抛出 Bad Request (400)。
-# 提高此值以允许较大的文件/文件夹上传。
+# 提高此值以允许较大的文件/文件夹上传。异步上传（attachments.js）改用单独的 manifest 文件部分
+# 传相对路径（见 learning_logs/manifest.py），不再占用字段数；此值仍供表单直接提交时使用。
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 20000
 
 # Ensure uncommon extensions are served with correct MIME types (e.g., custom H.264 files)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Measure what the background_image / background_video context processors cost per page render.
+
+"cold" clears the process-level static lookup caches before every render, which reproduces
+the old behaviour (finders.find walking STATICFILES_DIRS and every app's static/ on each
+request); "warm" is the memoized steady state. Both render learning_logs/index.html for an
+anonymous visitor, so the difference is the per-request saving of a real page render.
+
+Usage:
+  python scripts/bench_context_processors.py --renders 500
+  python scripts/bench_context_processors.py --manifest   # use the configured (manifest) storage; needs collectstatic
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'll_project.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import AnonymousUser  # noqa: E402
+from django.shortcuts import render  # noqa: E402
+from django.test import RequestFactory, override_settings  # noqa: E402
+
+from learning_logs import context_processors as cp  # noqa: E402
+
+
+def clear_caches() -> None:
+    cp._static_exists.cache_clear()
+    cp._resolve_path.cache_clear()
+    cp._video_path.cache_clear()
+
+
+def bench(renders: int, cold: bool) -> float:
+    """Return mean milliseconds per render."""
+    factory = RequestFactory()
+    total = 0.0
+    for _ in range(renders):
+        if cold:
+            clear_caches()
+        request = factory.get('/')
+        request.user = AnonymousUser()
+        start = time.perf_counter()
+        render(request, 'learning_logs/index.html', {'entries_mode': 'discovery'})
+        total += time.perf_counter() - start
+    return total / renders * 1000
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--renders', type=int, default=300)
+    ap.add_argument('--manifest', action='store_true', help='keep the configured STATICFILES_STORAGE')
+    args = ap.parse_args()
+
+    storage = {} if args.manifest else {
+        'STATICFILES_STORAGE': 'django.contrib.staticfiles.storage.StaticFilesStorage'}
+    with override_settings(**storage):
+        bench(20, cold=False)  # template loader / URL resolver warm-up
+        cold = bench(args.renders, cold=True)
+        warm = bench(args.renders, cold=False)
+    print(f"renders per run:  {args.renders}")
+    print(f"cold lookups:     {cold:.3f} ms/render")
+    print(f"memoized lookups: {warm:.3f} ms/render")
+    print(f"saving:           {cold - warm:.3f} ms/render ({(cold - warm) / cold * 100:.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
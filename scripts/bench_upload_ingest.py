@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Measure attachment ingest through upload_attachments_api for many tiny files.
+
+The files are posted the way static/js/attachments.js sends a folder: in requests of
+--per-request files (50 by default) with a relative_path per file, into one entry.
+"bulk" is the current path (files stored first, then one bulk_create per request);
+"per-row" replaces bulk_create with one Attachment.save() per file, which reproduces the
+old cost (an INSERT, a transaction and the counter signals for every row).
+
+Runs against a throwaway test database and a temporary MEDIA_ROOT.
+
+Usage:
+  python scripts/bench_upload_ingest.py                  # 1000 and 10000 files
+  python scripts/bench_upload_ingest.py --files 1000 --per-request 200
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'll_project.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.files.uploadedfile import SimpleUploadedFile  # noqa: E402
+from django.db import connection, reset_queries  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from learning_logs.models import Attachment, Entry, Topic  # noqa: E402
+
+
+def per_row_bulk_create(objs, batch_size=None, **kwargs):
+    for obj in objs:
+        obj.save()
+    return objs
+
+
+def ingest(client, entry, files: int, per_request: int) -> tuple[float, int]:
+    """Return (seconds, queries) to post `files` tiny files."""
+    url = reverse('learning_logs:upload_attachments_api')
+    elapsed = 0.0
+    queries = 0
+    for start in range(0, files, per_request):
+        n = min(per_request, files - start)
+        data = {'parent_type': 'entry', 'parent_id': entry.id,
+                'files': [SimpleUploadedFile(f'f{start + i}.txt', b'x' * 16) for i in range(n)]}
+        for i in range(n):
+            data[f'relative_path[{i}]'] = f'd{(start + i) % 20}/f{start + i}.txt'
+        reset_queries()
+        t = time.perf_counter()
+        resp = client.post(url, data)
+        elapsed += time.perf_counter() - t
+        queries += len(connection.queries)
+        if resp.status_code != 200 or len(resp.json()['files']) != n:
+            raise SystemExit(f'upload failed: {resp.status_code} {resp.content[:200]!r}')
+    return elapsed, queries
+
+
+def run(files: int, per_request: int, per_row: bool) -> tuple[float, int]:
+    user = get_user_model().objects.create_user(username=f'bench{time.monotonic_ns()}', password='x')
+    topic = Topic.objects.create(owner=user, text='bench')
+    entry = Entry.objects.create(topic=topic, owner=user, text='bench')
+    client = Client()
+    client.force_login(user)
+    if per_row:
+        with mock.patch.object(Attachment.objects, 'bulk_create', per_row_bulk_create):
+            return ingest(client, entry, files, per_request)
+    return ingest(client, entry, files, per_request)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--files', type=int, nargs='+', default=[1000, 10000])
+    ap.add_argument('--per-request', type=int, default=50)
+    args = ap.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with tempfile.TemporaryDirectory() as media, override_settings(
+                MEDIA_ROOT=media, DEBUG=True, DATA_UPLOAD_MAX_NUMBER_FILES=max(args.per_request, 100)):
+            run(args.per_request, args.per_request, per_row=False)  # warm-up
+            print(f"{'files':>7} {'mode':>8} {'seconds':>9} {'ms/file':>8} {'queries':>8}")
+            for files in args.files:
+                for per_row in (True, False):
+                    seconds, queries = run(files, args.per_request, per_row)
+                    mode = 'per-row' if per_row else 'bulk'
+                    print(f'{files:>7} {mode:>8} {seconds:>9.2f} {seconds / files * 1000:>8.3f} {queries:>8}')
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -87,29 +87,44 @@
   const MAX_FOLDER_UPLOAD_FILES = 10000;
   const UPLOAD_CHUNK_SIZE = 50; // max files per request
   const UPLOAD_CHUNK_MAX_BYTES = 2 * 1024 * 1024; // 2MB per request
+  const UPLOAD_PARALLEL = 3; // chunks kept in flight at once
 
   // Send a single chunk (FormData) to server and handle response (supports progress via XHR)
-  async function sendChunk(wrapper, files){
-    const parentType = wrapper.dataset.parentType;
-    const parentId = wrapper.dataset.parentId;
-    const fd = new FormData();
-    const paths = [];
-    [...files].forEach((f,i)=>{
-      fd.append('files', f, f.name);
+  // NDJSON manifest, one line per file in upload order: a {"d": dir} line whenever the directory
+  // changes, then ["name", size, lastModified]. The server resolves the i-th file line to the
+  // i-th uploaded file (see learning_logs/manifest.py).
+  function buildManifest(files, digests){
+    const lines = [];
+    let currentDir = '';
+    [...files].forEach((f, i) => {
       // Preserve folder structure when available. Fall back to file name to avoid empty paths.
-      const rel = f.webkitRelativePath || f.relativePath || f.name || '';
-      const relClean = (rel || '').replace(/\\/g,'/').replace(/^\/+/, '');
+      const rel = (f.webkitRelativePath || f.relativePath || f.name || '').replace(/\\/g,'/').replace(/^\/+/, '');
+      const cut = rel.lastIndexOf('/');
+      const dir = cut >= 0 ? rel.slice(0, cut) : '';
+      const name = cut >= 0 ? rel.slice(cut + 1) : rel;
+      if (dir !== currentDir) { lines.push(JSON.stringify({d: dir})); currentDir = dir; }
       const lastMod = typeof f.lastModified === 'number' ? f.lastModified : 0;
-      paths.push({name: f.name, size: f.size, lastModified: lastMod, path: relClean});
-      // Always append a per-file relative_path index field (may be empty string), so server can map by index reliably.
-      fd.append(`relative_path[${i}]`, relClean);
+      lines.push(JSON.stringify(digests && digests[i] ? [name, f.size, lastMod, digests[i]] : [name, f.size, lastMod]));
     });
-    try{ fd.append('relative_paths_json', JSON.stringify(paths)); }catch(err){}
+    return new Blob([lines.join('\n') + '\n'], {type: 'application/x-ndjson'});
+  }
+
+  // onProgress (optional) receives the fraction of this chunk sent so far
+  async function sendChunk(wrapper, files, onProgress){
+    const parentType = wrapper.dataset.parentType;
+    const parentId = wrapper.dataset.parentId;
+    const fd = new FormData();
+    [...files].forEach(f => fd.append('files', f, f.name));
+    // Relative paths travel in a single NDJSON manifest part instead of one form field per file
+    fd.append('manifest', buildManifest(files), 'manifest.ndjson');
     fd.append('parent_type', parentType);
     fd.append('parent_id', parentId);
     const uploadSession = wrapper.dataset.uploadSession;
     if (uploadSession) fd.append('upload_session', uploadSession);
     if(!csrftoken) throw new Error('CSRF token not found');
+    // Same key on every retry of this chunk: if an earlier attempt was stored but its response
+    // was lost, the server replays that response instead of saving the files again
+    const idempotencyKey = 'c' + Date.now().toString(36) + Math.random().toString(36).slice(2, 12);
     const MAX_RETRIES = 3;
     let lastErr = null;
     for (let attempt = 1; attempt <= MAX_RETRIES; attempt++){
@@ -121,10 +136,12 @@
           xhr.withCredentials = true;
           xhr.setRequestHeader('X-CSRFToken', csrftoken);
           xhr.setRequestHeader('X-Requested-With', 'XMLHttpRequest');
+          xhr.setRequestHeader('Idempotency-Key', idempotencyKey);
           xhr.upload.onprogress = function(e){
             if (e.lengthComputable) {
               const chunkProgress = e.loaded / e.total;
               const chunkBytesUploaded = Math.floor(e.loaded);
+              if (onProgress) onProgress(chunkProgress);
               document.dispatchEvent(new CustomEvent('ll:upload:chunkprogress', { detail: { wrapper: wrapper, chunkProgress: chunkProgress, chunkBytesUploaded: chunkBytesUploaded, momentum: e.loaded } }));
             }
           };
@@ -159,14 +176,134 @@
     return data;
   }
 
-  async function uploadBatch(wrapper, files){
-    // Ensure we have an upload_session id on the wrapper so server can associate async uploads
+  // Files at least this large go through the resumable API: sent as byte ranges, and after
+  // a failure only the missing tail is resent (the server reports how much it already has).
+  const RESUMABLE_MIN_BYTES = 8 * 1024 * 1024;
+
+  function resumableRequest(method, url, body, headers, onProgress){
+    return new Promise((resolve, reject) => {
+      const xhr = new XMLHttpRequest();
+      xhr.open(method, url, true);
+      xhr.withCredentials = true;
+      xhr.setRequestHeader('X-CSRFToken', csrftoken);
+      xhr.setRequestHeader('X-Requested-With', 'XMLHttpRequest');
+      Object.keys(headers || {}).forEach(k => xhr.setRequestHeader(k, headers[k]));
+      if (onProgress) xhr.upload.onprogress = function(e){ if (e.lengthComputable) onProgress(e.loaded); };
+      xhr.onreadystatechange = function(){
+        if (xhr.readyState !== XMLHttpRequest.DONE) return;
+        let j = null; try { j = JSON.parse(xhr.responseText); } catch(e) { j = { ok: false, error: xhr.responseText || xhr.status }; }
+        j.status = xhr.status;
+        resolve(j);
+      };
+      xhr.onerror = function(){ reject(new Error('Network error')); };
+      xhr.send(body);
+    });
+  }
+
+  // Upload one large file with the resumable API; resolves to the same shape as sendChunk ({ok, files})
+  async function sendResumable(wrapper, file, onProgress){
+    if(!csrftoken) throw new Error('CSRF token not found');
+    const fd = new FormData();
+    fd.append('parent_type', wrapper.dataset.parentType);
+    fd.append('parent_id', wrapper.dataset.parentId);
+    fd.append('name', file.name);
+    fd.append('size', file.size);
+    fd.append('relative_path', (file.webkitRelativePath || file.relativePath || '').replace(/\\/g,'/').replace(/^\/+/, ''));
+    if (wrapper.dataset.uploadSession) fd.append('upload_session', wrapper.dataset.uploadSession);
+    const created = await resumableRequest('POST', '/attachments/resumable/', fd);
+    if (!created.ok) throw new Error(created.error || 'upload failed');
+    const url = `/attachments/resumable/${created.token}/`;
+    const chunkSize = created.chunk_size || RESUMABLE_MIN_BYTES;
+    let offset = created.offset || 0;
+    let failures = 0;
+    const MAX_RETRIES = 5;
+    while (offset < file.size){
+      const end = Math.min(offset + chunkSize, file.size);
+      try {
+        const res = await resumableRequest('PUT', url, file.slice(offset, end),
+          {'Content-Type': 'application/octet-stream', 'Content-Range': `bytes ${offset}-${end - 1}/${file.size}`},
+          loaded => {
+            const chunkProgress = (offset + loaded) / (file.size || 1);
+            if (onProgress) onProgress(chunkProgress);
+            document.dispatchEvent(new CustomEvent('ll:upload:chunkprogress', { detail: { wrapper: wrapper, chunkProgress: chunkProgress } }));
+          });
+        if (res.ok || res.status === 409) { offset = res.offset; failures = 0; continue; }
+        if (res.status >= 400 && res.status < 500) throw new Error(res.error || res.status);
+        throw new Error(res.error || 'upload failed');
+      } catch (err) {
+        if (++failures > MAX_RETRIES) throw err;
+        await new Promise(r => setTimeout(r, 500 * failures));
+        // Ask the server how much arrived before the failure and continue from there
+        try { const state = await resumableRequest('GET', url); if (state.ok) offset = state.offset; else throw new Error(state.error || 'upload expired'); }
+        catch (e) { if (failures >= MAX_RETRIES) throw e; }
+      }
+    }
+    const done = await resumableRequest('POST', url + 'finalize/');
+    if (!done.ok) throw new Error(done.error || 'upload failed');
+    return done;
+  }
+
+  // Register the batch with the server-side upload session so the server knows how many files / bytes
+  // to expect; the server may hand back a different key. Only the new-entry staging area
+  // (data-upload-staging) has a session: its files wait under the topic until the entry is submitted.
+  // Failure is not fatal: the files keep the key and are still reassigned, only progress is not tracked.
+  async function openUploadSession(wrapper, files, totalBytes){
+    if (!wrapper.hasAttribute('data-upload-staging') || !wrapper.dataset.uploadSession || !csrftoken) return;
     try {
-      if (!wrapper.dataset.uploadSession) {
-        wrapper.dataset.uploadSession = 's'+Date.now().toString(36) + Math.random().toString(36).slice(2,8);
-        try { document.dispatchEvent(new CustomEvent('ll:upload_session:set', { detail: { wrapper: wrapper } })); } catch (e) { }
+      const fd = new FormData();
+      fd.append('parent_type', wrapper.dataset.parentType);
+      fd.append('parent_id', wrapper.dataset.parentId);
+      fd.append('files', files.length);
+      fd.append('bytes', totalBytes);
+      if (wrapper.dataset.uploadSession) fd.append('key', wrapper.dataset.uploadSession);
+      const res = await resumableRequest('POST', '/attachments/upload_session/', fd);
+      if (res.ok && res.key && res.key !== wrapper.dataset.uploadSession) {
+        wrapper.dataset.uploadSession = res.key;
+        document.dispatchEvent(new CustomEvent('ll:upload_session:set', { detail: { wrapper: wrapper } }));
       }
-    } catch (e) { /* ignore */ }
+    } catch (e) { console.warn('open upload session failed', e); }
+  }
+
+  // The server stores what it can and lists the files it could not save in `failed`
+  function reportFailedFiles(failed){
+    if (failed && failed.length) alert('以下文件上传失败：\n' + failed.map(x => x.name).join('\n'));
+  }
+
+  // Files above this size are not hashed for preflight (SubtleCrypto needs the whole file in memory)
+  const PREFLIGHT_HASH_MAX_BYTES = 64 * 1024 * 1024;
+
+  // Hex SHA-256 of a file, or null when it cannot be computed (no SubtleCrypto, too large, read error)
+  async function sha256Hex(file){
+    if (!(window.crypto && crypto.subtle) || file.size > PREFLIGHT_HASH_MAX_BYTES) return null;
+    try {
+      const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+      return [...new Uint8Array(digest)].map(b => b.toString(16).padStart(2, '0')).join('');
+    } catch (e) { return null; }
+  }
+
+  // Folder re-sync: ask the server which files already exist unchanged at the same relative path
+  // and return only the files that still need uploading. A file is skipped only when the server
+  // confirmed its SHA-256; files without a digest are always uploaded. Any failure falls back to all files.
+  async function preflightFiles(wrapper, files){
+    const list = [...files];
+    if (wrapper.dataset.parentType === 'topic' || !list.some(f => f.webkitRelativePath || f.relativePath)) return list;
+    try {
+      const digests = [];
+      for (const f of list) digests.push(await sha256Hex(f));
+      if (!digests.some(Boolean)) return list;
+      const fd = new FormData();
+      fd.append('parent_type', wrapper.dataset.parentType);
+      fd.append('parent_id', wrapper.dataset.parentId);
+      fd.append('manifest', buildManifest(list, digests), 'manifest.ndjson');
+      const res = await resumableRequest('POST', '/attachments/preflight/', fd);
+      if (!res.ok || !Array.isArray(res.unchanged)) return list;
+      const unchanged = new Set(res.unchanged.filter(i => digests[i]));
+      if (unchanged.size) console.debug(`[attachments] ${unchanged.size} unchanged files skipped`);
+      return list.filter((f, i) => !unchanged.has(i));
+    } catch (e) { console.warn('upload preflight failed', e); return list; }
+  }
+
+  async function uploadBatch(wrapper, files){
     // If wrapper contains an input marked data-no-async or wrapper itself is marked, treat files as staged
     if (wrapper.querySelector('input[type=file][data-no-async]') || wrapper.hasAttribute('data-no-async')){
       try {
@@ -179,6 +316,8 @@
     const parentType=wrapper.dataset.parentType;
     const parentId=wrapper.dataset.parentId;
     if(!files.length) return;
+    files = await preflightFiles(wrapper, files);
+    if(!files.length) return;
     if(files.length > MAX_FOLDER_UPLOAD_FILES){
       alert('单次上传的文件数超过上限（' + MAX_FOLDER_UPLOAD_FILES + '），请减少文件或分批上传。');
       return;
@@ -186,6 +325,7 @@
     // Chunk by size or count to avoid network/proxy/Django limits
     var totalBytes = 0;
     for (let f of files) totalBytes += (f.size || 0);
+    await openUploadSession(wrapper, files, totalBytes);
     // Initialize progress/disable UI
     try{ wrapper._upload_total = totalBytes; wrapper._upload_uploaded = 0; }catch(e){}
     if (!wrapper._upload_inflight) wrapper._upload_inflight = 0;
@@ -213,6 +353,12 @@
       let curBytes = 0;
       for (let f of files){
         const fsize = f.size || 0;
+        if (fsize >= RESUMABLE_MIN_BYTES){
+          const single = [f];
+          single.resumable = true;
+          chunks.push(single);
+          continue;
+        }
         if ((curChunk.length > 0 && (curBytes + fsize > UPLOAD_CHUNK_MAX_BYTES)) || curChunk.length >= UPLOAD_CHUNK_SIZE){
           chunks.push(curChunk);
           curChunk = [];
@@ -222,34 +368,52 @@
         curBytes += fsize;
       }
       if (curChunk.length) chunks.push(curChunk);
-      try{
-      for (let chunk of chunks){
-        // Compute chunk bytes
-        const chunkTotal = chunk.reduce((s,f)=>s + (f.size || 0), 0);
-        let handler = function(ev){};
-        handler = function(ev){ if (ev.detail && ev.detail.wrapper === wrapper){
-            const uploadedSoFar = wrapper._upload_uploaded || 0;
-            const curChunkUploaded = (ev.detail.chunkProgress || 0) * chunkTotal;
-            const percent = (uploadedSoFar + curChunkUploaded) / (totalBytes || 1) * 100;
-            setWrapperProgress(wrapper, percent);
-          }};
-        document.addEventListener('ll:upload:chunkprogress', handler);
-        // sendChunk now ensures relative_path JSON includes path fallback to file name
-        const data = await sendChunk(wrapper, chunk);
-        document.removeEventListener('ll:upload:chunkprogress', handler);
-        wrapper._upload_uploaded = (wrapper._upload_uploaded || 0) + chunkTotal;
-        setWrapperProgress(wrapper, (wrapper._upload_uploaded || 0) / (totalBytes || 1) * 100);
-        // Insert returned items to UI
-        const listContainer = wrapper.querySelector('.ll-attach-list') || wrapper;
-        data.files.forEach(f=>{
-          const canEdit = wrapper.dataset.canEdit && wrapper.dataset.canEdit !== '0' ? true : false;
-          const newItem = buildItem(f, {canEdit: canEdit});
-          let targetContainer = listContainer;
-          if (f.relative_path && f.relative_path.includes('/')) targetContainer = ensureFolderPath(listContainer, f.relative_path) || listContainer;
-          const inputContainer = (targetContainer === listContainer) ? listContainer.querySelector('.mt-2') : null;
-          if (inputContainer) targetContainer.insertBefore(newItem, inputContainer); else targetContainer.appendChild(newItem);
-        });
+      // Keep up to UPLOAD_PARALLEL chunks in flight; progress is the sum over finished and running chunks
+      const listContainer = wrapper.querySelector('.ll-attach-list') || wrapper;
+      const canEdit = wrapper.dataset.canEdit && wrapper.dataset.canEdit !== '0' ? true : false;
+      const running = new Map();
+      function reportProgress(){
+        let inFlight = 0;
+        running.forEach(v => { inFlight += v; });
+        setWrapperProgress(wrapper, ((wrapper._upload_uploaded || 0) + inFlight) / (totalBytes || 1) * 100);
+      }
+      let next = 0;
+      let failed = null;
+      const failedFiles = [];
+      async function worker(){
+        while (!failed && next < chunks.length){
+          const chunk = chunks[next++];
+          const chunkTotal = chunk.reduce((s,f)=>s + (f.size || 0), 0);
+          const onProgress = fraction => { running.set(chunk, (fraction || 0) * chunkTotal); reportProgress(); };
+          let data;
+          try {
+            // sendChunk now ensures relative_path JSON includes path fallback to file name
+            data = chunk.resumable ? await sendResumable(wrapper, chunk[0], onProgress) : await sendChunk(wrapper, chunk, onProgress);
+          } catch (err) {
+            failed = failed || err;
+            return;
+          } finally {
+            running.delete(chunk);
+          }
+          wrapper._upload_uploaded = (wrapper._upload_uploaded || 0) + chunkTotal;
+          reportProgress();
+          if (data.failed) failedFiles.push(...data.failed);
+          // Insert returned items to UI
+          data.files.forEach(f=>{
+            const newItem = buildItem(f, {canEdit: canEdit});
+            let targetContainer = listContainer;
+            if (f.relative_path && f.relative_path.includes('/')) targetContainer = ensureFolderPath(listContainer, f.relative_path) || listContainer;
+            const inputContainer = (targetContainer === listContainer) ? listContainer.querySelector('.mt-2') : null;
+            if (inputContainer) targetContainer.insertBefore(newItem, inputContainer); else targetContainer.appendChild(newItem);
+          });
+        }
       }
+      try{
+        const workers = [];
+        for (let i = 0; i < Math.min(UPLOAD_PARALLEL, chunks.length); i++) workers.push(worker());
+        await Promise.all(workers);
+        if (failed) throw failed;
+        reportFailedFiles(failedFiles);
       }catch(err){
         console.error('Upload chunked error', err);
         alert('上传失败: ' + (err.message || err));
@@ -269,6 +433,7 @@
     // For single-chunk path, reuse sendChunk to centralize behavior
     try {
       const data = await sendChunk(wrapper, files);
+      reportFailedFiles(data.failed);
       const listContainer = wrapper.querySelector('.ll-attach-list') || wrapper;
       data.files.forEach(f => {
         const canEdit = wrapper.dataset.canEdit && wrapper.dataset.canEdit !== '0' ? true : false;
@@ -598,6 +763,26 @@
         window.location.href = url;
       }
     });
+    // 日记流“加载更多”：按游标拉取下一页日记卡片片段，替换按钮所在容器（片段末尾自带新的按钮）
+    document.addEventListener('click', (e)=>{
+      const btn = e.target.closest('.ll-load-more');
+      if(!btn) return;
+      const wrap = btn.closest('.ll-load-more-wrap');
+      if(!wrap || !btn.dataset.url) return;
+      btn.disabled = true;
+      fetch(btn.dataset.url, {
+        credentials: 'same-origin',
+        headers: {'X-Requested-With': 'XMLHttpRequest'}
+      }).then(async r=>{
+        if(!r.ok){ throw new Error(await r.text() || r.status); }
+        const tpl = document.createElement('template');
+        tpl.innerHTML = await r.text();
+        wrap.replaceWith(tpl.content);
+      }).catch(err=>{
+        btn.disabled = false;
+        alert('加载失败：'+err.message);
+      });
+    });
     // 评论删除（AJAX）：class delete-comment, data-id
     document.addEventListener('click', (e)=>{
       const btn = e.target.closest('.delete-comment');
@@ -612,7 +797,19 @@
         headers: {'X-CSRFToken': csrftoken, 'X-Requested-With': 'XMLHttpRequest','Accept':'application/json'}
       }).then(async r=>{
         if(!r.ok){ throw new Error(await r.text() || r.status); }
-        // 成功：移除评论节点
+        // 成功：移除评论节点；回复按深度优先平铺，需连同其后代（path 前缀相同的后续回复）一并移除
+        const reply = btn.closest('.reply-item');
+        if(reply && reply.dataset.path){
+          const prefix = reply.dataset.path;
+          let sib = reply.nextElementSibling;
+          while(sib && sib.dataset.path && sib.dataset.path.startsWith(prefix)){
+            const next = sib.nextElementSibling;
+            sib.remove();
+            sib = next;
+          }
+          reply.remove();
+          return;
+        }
         const node = btn.closest('.comment-item');
         if(node) node.remove();
       }).catch(err=>{
@@ -653,18 +850,17 @@
             const parentType = wrapper.dataset.parentType;
             const parentId = wrapper.dataset.parentId;
             const folderPath = row.dataset.folderPath || row.dataset.folderName || '';
-            // assemble form data
-            const fd = new FormData();
-            fd.append('parent_type', parentType);
-            fd.append('parent_id', parentId);
-            fd.append('folder_path', folderPath);
+            // GET 请求可被浏览器缓存，未变化时服务器按 ETag 返回 304
+            const qs = new URLSearchParams();
+            qs.append('parent_type', parentType);
+            qs.append('parent_id', parentId);
+            qs.append('folder_path', folderPath);
             const upload_session = wrapper.dataset.uploadSession;
-            if (upload_session) fd.append('upload_session', upload_session);
-            fetch('/attachments/list_folder/', {
-              method: 'POST',
+            if (upload_session) qs.append('upload_session', upload_session);
+            fetch('/attachments/list_folder/?' + qs.toString(), {
+              method: 'GET',
               credentials: 'same-origin',
-              headers: {'X-CSRFToken': csrftoken,'X-Requested-With':'XMLHttpRequest','Accept':'application/json'},
-              body: fd
+              headers: {'X-Requested-With':'XMLHttpRequest','Accept':'application/json'}
             }).then(async r => {
               const raw = await r.text();
               let res = null; try{ res = JSON.parse(raw); } catch(e){ res = { ok: false, error: raw }; }
@@ -675,6 +871,11 @@
                   const created = createFolderRow(f.name, wrapper.dataset.canEdit && wrapper.dataset.canEdit !== '0');
                   created.row.dataset.folderPath = f.path;
                   created.row.dataset.folderName = f.name;
+                  // 索引中的子树统计（session 临时目录没有统计，保留默认文案）
+                  if (typeof f.files === 'number') {
+                    const meta = created.row.querySelector('.ll-folder-meta');
+                    if (meta) meta.textContent = `${f.files} 个文件 · ${humanSize(f.bytes || 0)}`;
+                  }
                   // TBD: folder meta or download/delete buttons handled by ensureFolderPath
                   children.appendChild(created.row);
                   children.appendChild(created.children);